@@ -0,0 +1,125 @@
+"""
+Benchmark the launch profiles of init_driver() against the corpus served
+by fixture_server.py with synthetic assets and third-party trackers.
+Report, for each profile, the time driver.get() takes per page and the
+bytes and requests the server answers per page.
+
+"""
+from fixture_server import start_fixture_server, load_fixtures,\
+    RENDERED_PATH
+from utils import init_driver, launch_profile, LAUNCH_PROFILES
+from time import perf_counter, sleep
+import argparse
+
+
+def served(server):
+    """
+    Get the total requests and bytes answered by the fixture server.
+
+    :param server: ThreadingHTTPServer started by start_fixture_server()
+    :return: tuple (int requests, int bytes)
+    """
+    handler = server.RequestHandlerClass
+    with handler.lock:
+        return (sum(handler.requests_served.values()),
+                sum(handler.bytes_served.values()))
+
+
+def wait_idle(server, quiet=0.3, timeout=10.):
+    """
+    Wait until the server has answered no request for the quiet period,
+    so that the resources still loading after driver.get() returned
+    are counted with their own page.
+
+    :param server: ThreadingHTTPServer started by start_fixture_server()
+    :param quiet: float seconds without requests
+    :param timeout: float max seconds waited
+    :return: None
+    """
+    start = perf_counter()
+    last = served(server)
+    since = perf_counter()
+    while perf_counter() - start < timeout:
+        sleep(0.05)
+        current = served(server)
+        if current != last:
+            last = current
+            since = perf_counter()
+        elif perf_counter() - since >= quiet:
+            return
+
+
+def benchmark_profile(driver, server, urls):
+    """
+    Load every URL with the driver.
+
+    :param driver: selenium chrome driver object
+    :param server: ThreadingHTTPServer started by start_fixture_server()
+    :param urls: list of str URLs
+    :return: tuple (float seconds, int requests, int bytes)
+    """
+    seconds = 0.
+    requests_before, bytes_before = served(server)
+    for url in urls:
+        start = perf_counter()
+        driver.get(url)
+        seconds += perf_counter() - start
+        wait_idle(server)
+    requests_after, bytes_after = served(server)
+    return seconds, requests_after - requests_before,\
+        bytes_after - bytes_before
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Benchmark the launch profiles of Chrome on the corpus")
+    argparser.add_argument('--chrome-path', type=str, required=True,
+                           help='Chrome executable')
+    argparser.add_argument('--chromedriver-path', type=str, required=True,
+                           help='Chrome driver')
+    argparser.add_argument('--corpus', type=str, default="corpus",
+                           help='Path of the corpus directory')
+    argparser.add_argument('--profiles', nargs='+',
+                           choices=sorted(LAUNCH_PROFILES),
+                           default=sorted(LAUNCH_PROFILES),
+                           help='Launch profiles to compare')
+    argparser.add_argument('-r', '--repeat', type=int, default=3,
+                           help='Number of times each page is loaded')
+    argparser.add_argument('-a', '--assets', type=int, default=20,
+                           help='Number of static assets in every page')
+    argparser.add_argument('--asset-kib', type=int, default=64,
+                           help='Size of every static asset in KiB')
+    argparser.add_argument('-t', '--trackers', type=int, default=5,
+                           help='Number of third-party trackers in every page')
+    argparser.add_argument('-d', '--delay', type=float, default=0.02,
+                           help='Seconds the server waits per response')
+    args = argparser.parse_args()
+    server, server_url = start_fixture_server(
+        args.corpus, n_assets=args.assets, asset_kib=args.asset_kib,
+        delay=args.delay, n_trackers=args.trackers)
+    page_urls = [server_url + path
+                 for path in sorted(load_fixtures(args.corpus))
+                 if path != RENDERED_PATH] * args.repeat
+    print("INFO :: Loading " + str(len(page_urls)) + " page(s) with " +
+          str(args.assets) + " asset(s) of " + str(args.asset_kib) +
+          " KiB and " + str(args.trackers) + " tracker(s) each")
+    print("{:<10} {:>7} {:>10} {:>10} {:>10}".format(
+        "profile", "pages", "ms/page", "KiB/page", "req/page"))
+    for profile_name in args.profiles:
+        profile = launch_profile(profile_name)
+        if profile["BLOCK_HOSTS"]:
+            # the trackers of the fixture server are on "localhost"
+            profile["BLOCK_HOSTS"] = list(profile["BLOCK_HOSTS"]) +\
+                ["localhost"]
+        chrome = init_driver(args.chrome_path, args.chromedriver_path,
+                             profile)
+        try:
+            load_seconds, n_requests, n_bytes = benchmark_profile(
+                chrome, server, page_urls)
+        finally:
+            chrome.quit()
+        print("{:<10} {:>7} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+            profile_name, len(page_urls),
+            1000. * load_seconds / len(page_urls),
+            n_bytes / 1024. / len(page_urls), n_requests / len(page_urls)))
+    server.shutdown()
@@ -0,0 +1,179 @@
+"""
+Run the extractors over the golden HTML corpus.
+Check that their output still matches the golden data, report the
+throughput in pages per second and the peak memory allocated per page,
+and exit with an error when the output differs from the golden data
+or the throughput drops below the thresholds of the corpus.
+
+"""
+from utils import make_soup, get_job_urls, filter_non_printable, PARSERS,\
+    JOB_SEARCH_CLASSES
+from classes.JobScraper import JobScraper
+from classes.UserScraper import UserScraper, PROFILE_EXTRACTOR
+from time import perf_counter
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+
+
+def load_corpus(corpus_dir):
+    """
+    Load the pages of the corpus together with their golden data.
+    Return a list of dictionaries with the keys of golden.json
+    plus "path", "html" and "text".
+
+    :param corpus_dir: str path of the corpus directory
+    :return: list of dict
+    """
+    with open(os.path.join(corpus_dir, "golden.json"), 'r',
+              encoding='utf-8') as golden_file:
+        golden = json.load(golden_file)
+    entries = []
+    for path in sorted(golden):
+        with open(os.path.join(corpus_dir, path), 'r',
+                  encoding='utf-8') as page_file:
+            html = page_file.read()
+        entry = dict(golden[path], path=path, html=html)
+        entry["text"] = make_soup(html).get_text()
+        entries.append(entry)
+    return entries
+
+
+def run_job_data(entry, parser):
+    soup = make_soup(entry["html"], parser, JobScraper.PAGE_CLASSES)
+    return JobScraper(soup, entry["url"], entry["query"]).get_job_data()
+
+
+def run_user_getters(entry, parser):
+    soup = make_soup(entry["html"], parser, PROFILE_EXTRACTOR.classes)
+    return {
+        "URL": entry["url"],
+        "name": UserScraper.get_name(soup),
+        "query": entry["query"],
+        "job_title": UserScraper.get_job_title(soup),
+        "degree": UserScraper.get_degree(soup),
+        "location": UserScraper.get_location(soup),
+        "languages": UserScraper.get_languages(soup),
+        "skills": UserScraper.get_skills(soup)
+    }
+
+
+def run_extract_user_data(entry, parser):
+    soup = make_soup(entry["html"], parser, PROFILE_EXTRACTOR.classes)
+    return UserScraper.extract_user_data(soup, entry["url"], entry["query"])
+
+
+def run_job_urls(entry, parser):
+    return get_job_urls(make_soup(entry["html"], parser, JOB_SEARCH_CLASSES))
+
+
+def run_filter_non_printable(entry, parser):
+    return filter_non_printable(entry["text"])
+
+
+# name -> (kind of the pages, function, compare with the golden data)
+BENCHMARKS = {
+    "job_data": ("job", run_job_data, True),
+    "user_getters": ("profile", run_user_getters, True),
+    "extract_user_data": ("profile", run_extract_user_data, True),
+    "job_urls": ("search", run_job_urls, True),
+    "filter_non_printable": ("profile", run_filter_non_printable, False)
+}
+
+
+def check_golden(entries, parser):
+    """
+    Run every benchmark once and compare its output with the golden data.
+    Return a list of str describing the mismatches.
+
+    :param entries: list of dict corpus entries
+    :param parser: str parser backend
+    :return: list of str
+    """
+    mismatches = []
+    for name, (kind, function, compare) in sorted(BENCHMARKS.items()):
+        if not compare:
+            continue
+        for entry in entries:
+            if entry["kind"] != kind:
+                continue
+            output = function(entry, parser)
+            if output != entry["expected"]:
+                mismatches.append(name + " on " + entry["path"] + ": " +
+                                  json.dumps(output, ensure_ascii=False))
+    return mismatches
+
+
+def run_benchmark(function, entries, parser, repeat):
+    """
+    Run the function over the entries "repeat" times.
+    Return the throughput in pages per second and the peak memory
+    in KiB allocated while processing a single page.
+
+    :param function: callable(entry, parser)
+    :param entries: list of dict corpus entries
+    :param parser: str parser backend
+    :param repeat: int number of passes over the entries
+    :return: tuple (float pages/sec, float peak KiB)
+    """
+    start = perf_counter()
+    for _ in range(repeat):
+        for entry in entries:
+            function(entry, parser)
+    elapsed = perf_counter() - start
+    peak = 0
+    for entry in entries:
+        tracemalloc.start()
+        function(entry, parser)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return repeat * len(entries) / elapsed, peak / 1024.
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description=("Benchmark the extractors on the golden corpus " +
+                     "and fail on regressions"))
+    argparser.add_argument('-d', '--corpus', type=str, metavar='',
+                           default=os.path.join(
+                               os.path.dirname(os.path.abspath(__file__)),
+                               "corpus"),
+                           help='Path of the corpus directory')
+    argparser.add_argument('-p', '--parser', choices=PARSERS,
+                           default="html.parser",
+                           help='Parser backend')
+    argparser.add_argument('-r', '--repeat', type=int, default=10,
+                           help='Number of passes over the corpus')
+    argparser.add_argument('-t', '--thresholds', type=str, metavar='',
+                           default=None,
+                           help=('Path of the JSON file with the minimum ' +
+                                 'pages/sec of each benchmark, by default ' +
+                                 'thresholds.json in the corpus directory'))
+    args = argparser.parse_args()
+    thresholds_path = args.thresholds or os.path.join(
+        args.corpus, "thresholds.json")
+    with open(thresholds_path, 'r') as thresholds_file:
+        thresholds = json.load(thresholds_file).get(args.parser, {})
+    corpus = load_corpus(args.corpus)
+    failed = False
+    for mismatch in check_golden(corpus, args.parser):
+        print("ERROR :: Output differs from the golden data for " + mismatch)
+        failed = True
+    print("{:<22} {:>8} {:>12} {:>10} {:>10}".format(
+        "benchmark", "pages", "pages/sec", "peak KiB", "min"))
+    for name, (kind, function, _) in sorted(BENCHMARKS.items()):
+        pages = [entry for entry in corpus if entry["kind"] == kind]
+        rate, peak_kib = run_benchmark(function, pages, args.parser,
+                                       args.repeat)
+        minimum = thresholds.get(name, 0)
+        print("{:<22} {:>8} {:>12.1f} {:>10.1f} {:>10}".format(
+            name, len(pages), rate, peak_kib, minimum))
+        if rate < minimum:
+            print("ERROR :: Throughput of " + name + " dropped below " +
+                  str(minimum) + " pages/sec")
+            failed = True
+    if failed:
+        sys.exit(1)
+    print("INFO :: All benchmarks passed")
@@ -0,0 +1,126 @@
+"""
+Benchmark the HTTP fetcher of scrape_jobs.py against the corpus served
+by fixture_server.py. Check that the job data extracted from the pages
+fetched over HTTP matches the golden data, that the page rendered by a
+script is left to the driver, and report the pages fetched per second,
+optionally next to the same pages loaded by Chrome.
+
+"""
+from classes.PageFetcher import PageFetcher
+from classes.JobScraper import JobScraper
+from fixture_server import start_fixture_server, RENDERED_PATH
+from utils import make_soup, init_driver
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from time import perf_counter
+import argparse
+import json
+import os
+import sys
+
+
+def load_job_entries(corpus_dir):
+    """
+    Load the golden data of the job pages of the corpus.
+
+    :param corpus_dir: str path of the corpus directory
+    :return: list of dict golden entries
+    """
+    with open(os.path.join(corpus_dir, "golden.json"), 'r',
+              encoding='utf-8') as golden_file:
+        golden = json.load(golden_file)
+    return [entry for _, entry in sorted(golden.items())
+            if entry["kind"] == "job"]
+
+
+def fetch_jobs(fetcher, base_url, entries, n_workers):
+    """
+    Fetch the job pages over HTTP with n_workers threads and extract
+    their data. Return the data of each page, None for the pages
+    that would be left to the driver, and the seconds taken.
+
+    :param fetcher: PageFetcher object
+    :param base_url: str URL of the fixture server
+    :param entries: list of dict golden entries
+    :param n_workers: int number of pages fetched at once
+    :return: tuple (list of dict or None, float seconds)
+    """
+    def fetch_job(entry):
+        page_source = fetcher.fetch_http(
+            base_url + urlparse(entry["url"]).path)
+        if page_source is None:
+            return None
+        soup = make_soup(page_source, "lxml", JobScraper.PAGE_CLASSES)
+        return JobScraper(soup, entry["url"], entry["query"]).get_job_data()
+    start = perf_counter()
+    with ThreadPoolExecutor(n_workers) as executor:
+        results = list(executor.map(fetch_job, entries))
+    return results, perf_counter() - start
+
+
+def load_with_driver(driver, base_url, entries):
+    """
+    Load the job pages with a driver and read their source.
+
+    :param driver: selenium chrome driver object
+    :param base_url: str URL of the fixture server
+    :param entries: list of dict golden entries
+    :return: float seconds taken
+    """
+    start = perf_counter()
+    for entry in entries:
+        driver.get(base_url + urlparse(entry["url"]).path)
+        driver.page_source
+    return perf_counter() - start
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Benchmark the HTTP fetcher on the served corpus")
+    argparser.add_argument('--corpus', type=str, default="corpus",
+                           help='Path of the corpus directory')
+    argparser.add_argument('-r', '--repeat', type=int, default=50,
+                           help='Number of times each page is fetched')
+    argparser.add_argument('-w', '--workers', type=int, default=4,
+                           help='Number of pages fetched at once')
+    argparser.add_argument('-d', '--delay', type=float, default=0.05,
+                           help='Seconds the server waits per response')
+    argparser.add_argument('--chrome-path', type=str, default=None,
+                           help='Chrome executable, to compare with Chrome')
+    argparser.add_argument('--chromedriver-path', type=str, default=None,
+                           help='Chrome driver, to compare with Chrome')
+    args = argparser.parse_args()
+    server, server_url = start_fixture_server(args.corpus,
+                                              delay=args.delay)
+    job_entries = load_job_entries(args.corpus)
+    page_fetcher = PageFetcher(pool_size=args.workers)
+    failures = 0
+    results, _ = fetch_jobs(page_fetcher, server_url, job_entries, 1)
+    for entry, job_data in zip(job_entries, results):
+        if job_data != entry["expected"]:
+            failures += 1
+            print("ERROR :: Job data fetched over HTTP differs from the " +
+                  "golden data for " + entry["url"])
+    if page_fetcher.fetch_http(server_url + RENDERED_PATH) is not None:
+        failures += 1
+        print("ERROR :: The page rendered by a script has not been " +
+              "left to the driver")
+    results, seconds = fetch_jobs(page_fetcher, server_url,
+                                  job_entries * args.repeat, args.workers)
+    print("INFO :: HTTP fetcher: {} page(s) in {:.2f} seconds "
+          "({:.1f} pages/sec) with {} worker(s)".format(
+              len(results), seconds, len(results) / seconds, args.workers))
+    page_fetcher.close()
+    if args.chrome_path and args.chromedriver_path:
+        chrome = init_driver(args.chrome_path, args.chromedriver_path)
+        try:
+            seconds = load_with_driver(chrome, server_url,
+                                       job_entries * args.repeat)
+        finally:
+            chrome.quit()
+        print("INFO :: Chrome: {} page(s) in {:.2f} seconds "
+              "({:.1f} pages/sec)".format(
+                  len(job_entries) * args.repeat, seconds,
+                  len(job_entries) * args.repeat / seconds))
+    server.shutdown()
+    sys.exit(1 if failures else 0)
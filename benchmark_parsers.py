@@ -0,0 +1,76 @@
+"""
+Benchmark the parser backends of make_soup() on saved pages.
+For each backend report the parse time per page and the peak
+memory allocated while parsing.
+
+"""
+from utils import make_soup, PARSERS, JOB_SEARCH_CLASSES
+from classes.JobScraper import JobScraper
+from classes.UserScraper import PROFILE_EXTRACTOR
+from time import perf_counter
+import argparse
+import tracemalloc
+
+
+PAGE_CLASSES = {
+    "profile": PROFILE_EXTRACTOR.classes,
+    "job": JobScraper.PAGE_CLASSES,
+    "search": JOB_SEARCH_CLASSES
+}
+
+
+def benchmark_parser(pages, parser, only_classes, repeat=1):
+    """
+    Parse every page "repeat" times with the given backend.
+    Return the mean parse time per page in milliseconds and the
+    peak memory in KiB allocated while parsing a single page.
+
+    :param pages: list of str HTML code of the pages
+    :param parser: str parser backend
+    :param only_classes: list of str HTML classes for the strained parser
+    :param repeat: int number of times each page is parsed
+    :return: tuple (float ms per page, float peak KiB)
+    """
+    elapsed = 0.
+    for _ in range(repeat):
+        for page in pages:
+            start = perf_counter()
+            make_soup(page, parser, only_classes)
+            elapsed += perf_counter() - start
+    peak = 0
+    for page in pages:
+        tracemalloc.start()
+        soup = make_soup(page, parser, only_classes)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        del soup
+    return 1000. * elapsed / (repeat * len(pages)), peak / 1024.
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Benchmark the parser backends on saved pages")
+    argparser.add_argument('pages', nargs='+',
+                           help='Paths of the saved HTML pages')
+    argparser.add_argument('-k', '--kind',
+                           choices=sorted(PAGE_CLASSES),
+                           default="profile",
+                           help='Kind of the saved pages')
+    argparser.add_argument('-r', '--repeat', type=int, default=5,
+                           help='Number of times each page is parsed')
+    argparser.add_argument('-p', '--parsers', nargs='+',
+                           choices=PARSERS, default=list(PARSERS),
+                           help='Parser backends to benchmark')
+    args = argparser.parse_args()
+    saved_pages = []
+    for path in args.pages:
+        with open(path, 'r', encoding='utf-8') as page_file:
+            saved_pages.append(page_file.read())
+    print("INFO :: Parsing " + str(len(saved_pages)) + " " + args.kind +
+          " page(s) " + str(args.repeat) + " time(s) per backend")
+    print("{:<12} {:>14} {:>14}".format("parser", "ms/page", "peak KiB"))
+    for backend in args.parsers:
+        ms_per_page, peak_kib = benchmark_parser(
+            saved_pages, backend, PAGE_CLASSES[args.kind], args.repeat)
+        print("{:<12} {:>14.2f} {:>14.1f}".format(
+            backend, ms_per_page, peak_kib))
@@ -0,0 +1,163 @@
+"""
+Check the rate scheduler on a simulated clock, without waiting: the
+spacing of the tokens of a domain, the AIMD changes of its rate and the
+backoff after failures. Report the navigations per minute a run of
+successful requests reaches, and exit with an error when a check fails.
+
+"""
+from classes.RateScheduler import RateScheduler, SimulatedClock
+import argparse
+import sys
+
+
+DOMAIN = "example.com"
+URL = "https://www." + DOMAIN + "/page"
+# tolerance of the comparisons of simulated times and rates
+EPSILON = 1e-9
+
+
+def new_scheduler(rate, **options):
+    """
+    Create a scheduler on a simulated clock pacing DOMAIN at a rate,
+    without jitter.
+
+    :param rate: float requests per second at the start
+    :param options: other arguments of RateScheduler
+    :return: RateScheduler object
+    """
+    options.setdefault("jitter", 0.)
+    return RateScheduler({DOMAIN: rate}, clock=SimulatedClock(), **options)
+
+
+def check_spacing(rate, burst):
+    """
+    Check that the first burst requests are sent at once, and every
+    next one 1 / rate seconds after the previous one.
+
+    :param rate: float requests per second
+    :param burst: int max requests sent at once
+    :return: list of str errors
+    """
+    scheduler = new_scheduler(rate, burst=burst, increase=0.)
+    times = []
+    for _ in range(burst + 5):
+        scheduler.acquire(URL)
+        times.append(scheduler.clock.now())
+    errors = []
+    if any(abs(time) > EPSILON for time in times[:burst]):
+        errors.append("the first " + str(burst) + " request(s) waited: " +
+                      str(times[:burst]))
+    for previous, time in zip(times[burst - 1:], times[burst:]):
+        if abs(time - previous - 1. / rate) > EPSILON:
+            errors.append("requests {:.3f} s apart instead of {:.3f} s"
+                          .format(time - previous, 1. / rate))
+            break
+    return errors
+
+
+def check_aimd(rate):
+    """
+    Check that the rate grows by the increase after a success, halves
+    after a failure, and stays between min_rate and max_factor times
+    the rate at the start.
+
+    :param rate: float requests per second at the start
+    :return: list of str errors
+    """
+    scheduler = new_scheduler(rate, increase=0.05, decrease=0.5,
+                              min_rate=0.01, max_factor=2.)
+    state = scheduler._state(DOMAIN)
+    errors = []
+    scheduler.success(URL)
+    if abs(state.rate - (rate + 0.05)) > EPSILON:
+        errors.append("rate {:.3f} after a success instead of {:.3f}"
+                      .format(state.rate, rate + 0.05))
+    expected = state.rate / 2.
+    scheduler.failure(URL, "timeout")
+    if abs(state.rate - expected) > EPSILON:
+        errors.append("rate {:.3f} after a failure instead of {:.3f}"
+                      .format(state.rate, expected))
+    for _ in range(100):
+        scheduler.success(URL)
+    if abs(state.rate - 2. * rate) > EPSILON:
+        errors.append("rate {:.3f} after many successes instead of the "
+                      "max {:.3f}".format(state.rate, 2. * rate))
+    for _ in range(100):
+        scheduler.failure(URL, "captcha")
+    if abs(state.rate - 0.01) > EPSILON:
+        errors.append("rate {:.3f} after many failures instead of the "
+                      "min 0.01".format(state.rate))
+    return errors
+
+
+def check_backoff(rate, backoff_base, backoff_max):
+    """
+    Check that the next request after n failures in a row waits for
+    backoff_base * 2 ** (n - 1) seconds, at most backoff_max, and that
+    a success resets the backoff. The backoff has to be longer than
+    the spacing of the tokens.
+
+    :param rate: float requests per second at the start
+    :param backoff_base: float seconds of the first backoff
+    :param backoff_max: float max seconds of a backoff
+    :return: list of str errors
+    """
+    scheduler = new_scheduler(rate, backoff_base=backoff_base,
+                              backoff_max=backoff_max, increase=0.,
+                              decrease=1.)
+    errors = []
+    scheduler.acquire(URL)
+    for failures in list(range(1, 8)) + ["reset"]:
+        if failures == "reset":
+            scheduler.success(URL)
+            failures = 1
+        expected = min(backoff_max, backoff_base * 2 ** (failures - 1))
+        scheduler.failure(URL, "empty")
+        waited = scheduler.acquire(URL)
+        if abs(waited - expected) > EPSILON:
+            errors.append("waited {:.1f} s after {} failure(s) instead of "
+                          "{:.1f} s".format(waited, failures, expected))
+    return errors
+
+
+def run_benchmark(rate, n_requests):
+    """
+    Send requests that all succeed and measure the navigations per
+    minute reached on the simulated clock, the rate growing after
+    every success.
+
+    :param rate: float requests per second at the start
+    :param n_requests: int number of requests
+    :return: float requests per simulated minute
+    """
+    scheduler = new_scheduler(rate)
+    for _ in range(n_requests):
+        scheduler.acquire(URL)
+        scheduler.success(URL)
+    return 60. * n_requests / max(scheduler.clock.now(), EPSILON)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description=("Check the rate scheduler on a simulated clock " +
+                     "and fail on errors"))
+    argparser.add_argument('--rate', type=float, default=1.,
+                           help='Requests per second at the start')
+    argparser.add_argument('--requests', type=int, default=1000,
+                           help='Number of requests of the benchmark')
+    args = argparser.parse_args()
+    failed = False
+    checks = {"spacing": check_spacing(args.rate, 1),
+              "burst": check_spacing(args.rate, 3),
+              "aimd": check_aimd(args.rate),
+              "backoff": check_backoff(args.rate, 5., 60.)}
+    for name, errors in sorted(checks.items()):
+        for error in errors:
+            print("ERROR :: Check " + name + " failed: " + error)
+            failed = True
+    print("INFO :: {:.1f} navigations per simulated minute at a start "
+          "rate of {} req/s".format(run_benchmark(args.rate, args.requests),
+                                    args.rate))
+    if failed:
+        sys.exit(1)
+    print("INFO :: All checks passed")
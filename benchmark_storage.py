@@ -0,0 +1,118 @@
+"""
+Benchmark the storage backends of open_storage() on synthetic records.
+For each backend report the throughput of writing the records through
+the BulkWriter, the time taken to look up which URLs have already been
+stored and the size on disk of the local backends.
+
+"""
+from classes.BulkWriter import BulkWriter
+from classes.Storage import open_storage, STORAGE_BACKENDS
+from utils import load_config
+from time import perf_counter
+import argparse
+import os
+import shutil
+import tempfile
+
+
+def make_records(n_records):
+    """
+    Build profile-like records with distinct URLs.
+
+    :param n_records: int number of records
+    :return: list of dict records
+    """
+    return [{"URL": "https://www.linkedin.com/in/user-" + str(i),
+             "name": "User " + str(i),
+             "job_title": "Data Scientist",
+             "location": "Milano",
+             "degree": "Laurea in Fisica",
+             "skills": ["Python", "SQL", "Machine Learning"][:i % 4],
+             "languages": ["Italiano", "Inglese"],
+             "query": "site:it.linkedin.com/in/ AND \"fisica\""}
+            for i in range(n_records)]
+
+
+def directory_size(path):
+    """
+    Get the size in bytes of the files in a directory tree.
+
+    :param path: str path of the directory
+    :return: int bytes
+    """
+    size = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            size += os.path.getsize(os.path.join(root, name))
+    return size
+
+
+def benchmark_storage(parameters, credentials, records, batch_size):
+    """
+    Write the records to a new storage through the BulkWriter, then look
+    up their URLs together with as many never stored ones.
+    Return the records written per second and the lookup time in ms.
+
+    :param parameters: dict "parameters" of the config file
+    :param credentials: dict "credentials" of the config file
+    :param records: list of dict records
+    :param batch_size: int max number of records per bulk write
+    :return: tuple (float records per second, float lookup ms)
+    """
+    storage = open_storage(parameters, credentials, "benchmark")
+    try:
+        writer = BulkWriter(storage, batch_size, max_queue=10 * batch_size)
+        start = perf_counter()
+        for record in records:
+            writer.write(record)
+        writer.close()
+        write_seconds = perf_counter() - start
+        urls = [record["URL"] for record in records]
+        urls += [url + "-unseen" for url in urls]
+        start = perf_counter()
+        storage.get_seen_urls(urls)
+        lookup_seconds = perf_counter() - start
+    finally:
+        storage.close()
+    return len(records) / write_seconds, 1000. * lookup_seconds
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Benchmark the storage backends on synthetic records")
+    argparser.add_argument('-n', '--records', type=int, default=10000,
+                           help='Number of records written per backend')
+    argparser.add_argument('-s', '--batch-size', type=int, default=100,
+                           help='Max number of records per bulk write')
+    argparser.add_argument('-b', '--backends', nargs='+',
+                           choices=STORAGE_BACKENDS,
+                           default=["sqlite", "jsonl", "parquet"],
+                           help='Storage backends to benchmark')
+    argparser.add_argument('-c', '--conf', type=str, default=None,
+                           help=('Path of the configuration file, '
+                                 'needed by the mongo backend'))
+    args = argparser.parse_args()
+    conf = load_config(args.conf) if args.conf else\
+        {"parameters": {}, "credentials": {}}
+    synthetic_records = make_records(args.records)
+    print("INFO :: Writing " + str(args.records) + " record(s) " +
+          "in batches of " + str(args.batch_size) + " per backend")
+    print("{:<10} {:>14} {:>14} {:>14}".format(
+        "backend", "records/s", "lookup ms", "disk KiB"))
+    for backend in args.backends:
+        path = tempfile.mkdtemp(prefix="storage-")
+        parameters = dict(conf["parameters"],
+                          STORAGE={"BACKEND": backend, "PATH": path})
+        try:
+            records_per_second, lookup_ms = benchmark_storage(
+                parameters, conf["credentials"], synthetic_records,
+                args.batch_size)
+        except ImportError as e:
+            print("{:<10} skipped: {}".format(backend, e))
+            continue
+        finally:
+            disk_kib = directory_size(path) / 1024.
+            shutil.rmtree(path)
+        print("{:<10} {:>14.0f} {:>14.1f} {:>14}".format(
+            backend, records_per_second, lookup_ms,
+            "-" if backend == "mongo" else "{:.1f}".format(disk_kib)))
@@ -0,0 +1,164 @@
+"""
+Check and benchmark the work queue shared by several hosts: worker
+processes claim synthetic URLs in batches, "scrape" each of them for a
+while and mark them done, some workers dying while holding leases.
+The queue is an in-memory collection served to the processes, or the
+Mongo DB of the config file. Check that every URL has been marked done
+exactly once, and report the URLs done per second, the URLs scraped
+again after a worker died and the leases reclaimed.
+
+"""
+from classes.WorkQueue import WorkQueue, serve_memory_collection,\
+    connect_memory_collection, PENDING, LEASED
+from utils import load_config, connect_mongo
+from multiprocessing import Process, Queue
+from collections import Counter
+from time import perf_counter, sleep
+import argparse
+import queue
+import os
+import sys
+
+
+KIND = "benchmark"
+COLLECTION = "benchmark_queue"
+
+
+def open_collection(address, conf_path):
+    """
+    Open the collection of the queue in a worker process.
+
+    :param address: tuple address of the in-memory collection,
+        None to use Mongo DB
+    :param conf_path: str path of the config file, for Mongo DB
+    :return: collection object
+    """
+    if address is not None:
+        return connect_memory_collection(address)
+    conf = load_config(conf_path)
+    client = connect_mongo(conf["parameters"]["HOST"],
+                           conf["credentials"]["MONGOUSER"],
+                           conf["credentials"]["MONGOPWD"])
+    return client["linkedin"][COLLECTION]
+
+
+def run_worker(index, address, conf_path, lease, batch_size, work_seconds,
+               crash_after, events):
+    """
+    Worker process: claim and scrape URLs until none is pending or
+    leased, reporting every URL scraped and marked done to the events
+    queue, or exit abruptly, holding its leases, after crash_after URLs.
+
+    :param index: int index of the worker
+    :param address: tuple address of the in-memory collection, or None
+    :param conf_path: str path of the config file, or None
+    :param lease: float seconds of the leases
+    :param batch_size: int URLs claimed at once
+    :param work_seconds: float seconds spent on every URL
+    :param crash_after: int URLs scraped before dying, None to never die
+    :param events: multiprocessing Queue of tuples (event, URL, worker)
+    :return: None
+    """
+    collection = open_collection(address, conf_path)
+    work_queue = WorkQueue(collection, lease, owner="worker-" + str(index))
+    work_queue.start_heartbeat(lease / 3.)
+    n_scraped = 0
+    while True:
+        claimed = work_queue.claim(KIND, batch_size)
+        if not claimed:
+            if collection.count_documents(
+                    {"kind": KIND, "state": {"$in": [PENDING, LEASED]}}):
+                # leases of other workers, alive or not, are running
+                sleep(lease / 4.)
+                continue
+            break
+        for _, url in claimed:
+            sleep(work_seconds)
+            events.put(("scraped", url, index))
+            n_scraped += 1
+            if crash_after is not None and n_scraped >= crash_after:
+                events.close()
+                events.join_thread()
+                os._exit(1)
+            if work_queue.complete([url]):
+                events.put(("done", url, index))
+    work_queue.stop()
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Check and benchmark the work queue with several " +
+                    "worker processes")
+    argparser.add_argument('-n', '--urls', type=int, default=500,
+                           help='Number of URLs in the queue')
+    argparser.add_argument('-w', '--workers', type=int, default=4,
+                           help='Number of worker processes')
+    argparser.add_argument('-k', '--crashes', type=int, default=1,
+                           help='Number of workers dying with their leases')
+    argparser.add_argument('-b', '--batch-size', type=int, default=5,
+                           help='URLs claimed at once')
+    argparser.add_argument('-l', '--lease', type=float, default=2.,
+                           help='Seconds of the leases')
+    argparser.add_argument('-s', '--work-seconds', type=float, default=0.01,
+                           help='Seconds spent on every URL')
+    argparser.add_argument('-c', '--conf', type=str, default=None,
+                           help=('Path of the configuration file, to use '
+                                 'its Mongo DB instead of memory'))
+    args = argparser.parse_args()
+    manager = None
+    collection_address = None
+    if args.conf is None:
+        manager, collection_address = serve_memory_collection()
+    main_collection = open_collection(collection_address, args.conf)
+    if args.conf is not None:
+        main_collection.delete_many({"kind": KIND})
+    urls = ["https://www.linkedin.com/in/user-" + str(i)
+            for i in range(args.urls)]
+    WorkQueue(main_collection).add(KIND, "benchmark", urls)
+    event_queue = Queue()
+    start = perf_counter()
+    processes = [Process(target=run_worker, args=(
+        i, collection_address, args.conf, args.lease, args.batch_size,
+        args.work_seconds, 10 * args.batch_size if i < args.crashes
+        else None, event_queue)) for i in range(args.workers)]
+    for process in processes:
+        process.start()
+    # the events are read while the workers run: a worker cannot exit
+    # before the events it has put in the queue have been read
+    events = []
+    while True:
+        try:
+            events.append(event_queue.get(timeout=0.1))
+        except queue.Empty:
+            if not any(process.is_alive() for process in processes):
+                break
+    for process in processes:
+        process.join()
+    seconds = perf_counter() - start
+    while True:
+        try:
+            events.append(event_queue.get(timeout=0.1))
+        except queue.Empty:
+            break
+    scraped = Counter(url for event, url, _ in events if event == "scraped")
+    done = Counter(url for event, url, _ in events if event == "done")
+    counts = WorkQueue(main_collection).counts(KIND)
+    print("INFO :: " + str(args.urls) + " URL(s), " + str(args.workers) +
+          " worker(s) of which " + str(args.crashes) + " died, " +
+          "{:.1f} seconds, {:.0f} URLs/s".format(
+              seconds, len(done) / seconds))
+    print("INFO :: Scraped again after a worker died: " +
+          str(sum(scraped.values()) - len(scraped)) + " URL(s)")
+    print("INFO :: Queue: " + ", ".join(
+        str(count) + " " + state for state, count in counts.items()))
+    not_done = [url for url in urls if done[url] == 0]
+    done_twice = [url for url in urls if done[url] > 1]
+    if args.conf is not None:
+        main_collection.delete_many({"kind": KIND})
+    if manager is not None:
+        manager.shutdown()
+    if not_done or done_twice:
+        print("ERROR :: " + str(len(not_done)) + " URL(s) never done, " +
+              str(len(done_twice)) + " done more than once")
+        sys.exit(1)
+    print("INFO :: Every URL has been done exactly once")
@@ -0,0 +1,154 @@
+"""
+A class to write the scraped records to a storage backend in the
+background, by batching them into bulk upserts keyed on their URL
+
+"""
+from classes.Metrics import METRICS
+from threading import Thread, Lock
+from time import monotonic
+import queue
+
+
+class BulkWriter(object):
+    def __init__(self, storage, batch_size=100, flush_interval=5.,
+                 max_queue=1000, on_written=None, on_failed=None):
+        """
+        Initialize the class and start the writer thread.
+        Records are flushed once "batch_size" of them are waiting or
+        "flush_interval" seconds after the oldest waiting one was queued.
+        write() blocks while "max_queue" records are waiting, so that
+        scraping slows down instead of piling up records in memory
+        when the database cannot keep up.
+
+        :param storage: Storage object
+        :param batch_size: int max number of records per bulk write
+        :param flush_interval: float max seconds a record waits
+        :param max_queue: int max number of records waiting
+        :param on_written: callable(urls) called from the writer thread
+            with the URLs of the records of each batch once written
+        :param on_failed: callable(urls, str error) called from the
+            writer thread with the URLs of the records of a batch that
+            could not be written, e.g. to scrape them again
+        """
+        self.storage = storage
+        self.on_written = on_written
+        self.on_failed = on_failed
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.records = queue.Queue(maxsize=max_queue)
+        self.lock = Lock()
+        self.closed = False
+        self.stats = {"written": 0, "upserted": 0, "modified": 0,
+                      "errors": 0, "batches": 0}
+        self.thread = Thread(target=self._run, name="bulk-writer",
+                             daemon=True)
+        self.thread.start()
+
+    def write(self, record):
+        """
+        Queue a record to be written, blocking while the queue is full.
+
+        :param record: dict record with a "URL" key
+        :return: None
+        """
+        if self.closed:
+            raise ValueError("Cannot write to a closed BulkWriter")
+        self.records.put(record)
+
+    def _run(self):
+        """
+        Writer loop: collect the queued records and flush them on
+        size or time, until the end-of-input marker is received.
+
+        :return: None
+        """
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None\
+                else max(0., deadline - monotonic())
+            try:
+                record = self.records.get(timeout=timeout)
+            except queue.Empty:
+                record = False
+            if record is None:
+                self._flush(batch)
+                return
+            if record:
+                if not batch:
+                    deadline = monotonic() + self.flush_interval
+                batch.append(record)
+            if len(batch) >= self.batch_size or\
+               (batch and monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+                deadline = None
+
+    def _flush(self, batch):
+        """
+        Upsert a batch of records with a single bulk write,
+        replacing the stored record with the same URL if any.
+        The URLs of the records written and of the ones that failed
+        are passed to their callbacks, the others of the batch being
+        reported as written when only some of them failed.
+
+        :param batch: list of dict records
+        :return: None
+        """
+        if not batch:
+            return
+        latest = {}
+        for record in batch:
+            latest[record["URL"]] = record
+        records = list(latest.values())
+        try:
+            with METRICS.timer("storage_write"):
+                result = self.storage.write_batch(records)
+            error = "the storage refused the record"
+        except Exception as e:
+            print("ERROR :: Could not write " + str(len(records)) +
+                  " record(s) to the storage: " + repr(e))
+            result = {"errors": len(records), "failed_urls": list(latest)}
+            error = repr(e)
+        failed_urls = set(result.get("failed_urls", []))
+        written_urls = [url for url in latest if url not in failed_urls]
+        if self.on_written is not None and written_urls:
+            self._call(self.on_written, written_urls)
+        if self.on_failed is not None and failed_urls:
+            self._call(self.on_failed, sorted(failed_urls), error)
+        with self.lock:
+            self.stats["batches"] += 1
+            self.stats["written"] += len(written_urls)
+            self.stats["upserted"] += result.get("upserted", 0)
+            self.stats["modified"] += result.get("modified", 0)
+            self.stats["errors"] += len(failed_urls)
+        METRICS.inc("records_written_total", len(written_urls))
+        if failed_urls:
+            METRICS.inc("write_errors_total", len(failed_urls))
+
+    @staticmethod
+    def _call(callback, *arguments):
+        try:
+            callback(*arguments)
+        except Exception as e:
+            print("ERROR :: Could not run the callback of a bulk " +
+                  "write: " + repr(e))
+
+    def close(self):
+        """
+        Flush the records still queued and stop the writer thread.
+        Calling it more than once has no effect.
+
+        :return: None
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.records.put(None)
+        self.thread.join()
+        print("INFO :: Written " + str(self.stats["written"]) +
+              " record(s) in " + str(self.stats["batches"]) +
+              " bulk write(s): " + str(self.stats["upserted"]) +
+              " new, " + str(self.stats["modified"]) + " updated, " +
+              str(self.stats["errors"]) + " failed")
@@ -0,0 +1,281 @@
+"""
+A class to scrape URLs with a pool of selenium drivers fed
+from a shared queue, each driver being owned by its own worker thread
+
+"""
+from selenium.common.exceptions import WebDriverException
+from classes.Metrics import METRICS
+from threading import Thread, Lock
+from time import perf_counter
+import queue
+
+
+class DriverPool(object):
+    def __init__(self, factory, handler, size=1, max_attempts=3,
+                 max_restarts=5, max_pages=None, on_quit=None):
+        """
+        Initialize the class
+
+        :param factory: callable() returning a new driver, logged in
+        :param handler: callable(driver, item) scraping an item
+            with the given driver and returning its result
+        :param size: int number of drivers, i.e. of worker threads
+        :param max_attempts: int times an item is tried again
+            when its driver crashes
+        :param max_restarts: int times in a row a worker restarts its
+            driver before giving up, counted again from 0 once the
+            driver has handled an item without crashing
+        :param max_pages: int items a driver handles before it is
+            replaced by a new one, to free the memory the browser
+            accumulates, None to keep it as long as it works
+        :param on_quit: callable(driver) called from the thread of a
+            worker once its driver has been quit, e.g. to release what
+            has been kept for the driver
+        """
+        self.factory = factory
+        self.handler = handler
+        self.size = size
+        self.max_attempts = max_attempts
+        self.max_restarts = max_restarts
+        self.max_pages = max_pages
+        self.on_quit = on_quit
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.workers = []
+        self.drivers = {}
+        self.recycle_requests = {}
+        self.lock = Lock()
+        self.submitted = 0
+        self.done = 0
+        self.alive = 0
+
+    def start(self):
+        """
+        Start the worker threads, each creating its own driver and
+        logging it in before taking its first item from the queue, so
+        that the drivers warm up while the items are being discovered.
+
+        :return: None
+        """
+        for index in range(self.size):
+            worker = Thread(target=self._work, args=(index,),
+                            name="driver-" + str(index), daemon=True)
+            self.workers.append(worker)
+            with self.lock:
+                self.alive += 1
+            worker.start()
+
+    def submit(self, item, callback=None):
+        """
+        Put an item in the shared queue. Its result is yielded by
+        drain(), or passed to the callback if one is given.
+
+        :param item: item passed to the handler
+        :param callback: callable(result, error) called from the thread
+            of the worker once the item has been handled, error being
+            None if the handler succeeded
+        :return: None
+        """
+        with self.lock:
+            self.submitted += 1
+        self.tasks.put((item, 1, callback))
+        with self.lock:
+            alive = self.alive
+        if self.workers and alive == 0:
+            self._fail_queued("no driver left in the pool")
+
+    def drain(self):
+        """
+        Yield the results of all the items submitted so far,
+        in order of completion, as tuples (item, result, error),
+        error being None if the handler succeeded.
+        If every worker has given up, the items left in the queue
+        are yielded with an error.
+
+        :return: generator of tuples
+        """
+        while True:
+            with self.lock:
+                if self.done == self.submitted:
+                    return
+                alive = self.alive
+            try:
+                yield self.results.get(timeout=0.5)
+            except queue.Empty:
+                if alive == 0:
+                    self._fail_queued("no driver left in the pool")
+                continue
+            with self.lock:
+                self.done += 1
+
+    def _complete(self, item, callback, result, error):
+        if callback is None:
+            self.results.put((item, result, error))
+            return
+        with self.lock:
+            self.done += 1
+        callback(result, error)
+
+    def _fail_queued(self, reason):
+        while True:
+            try:
+                task = self.tasks.get_nowait()
+            except queue.Empty:
+                return
+            if task is None:
+                self.tasks.put(None)
+                return
+            item, _, callback = task
+            self._complete(item, callback, None, reason)
+
+    @staticmethod
+    def is_alive(driver):
+        """
+        Check whether a driver still responds.
+
+        :param driver: selenium chrome driver object
+        :return: bool
+        """
+        try:
+            driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def recycle(self, index, reason):
+        """
+        Ask a worker to replace its driver by a new one once it has
+        handled its current item, e.g. when the browser takes too much
+        memory. The items in the queue keep their order.
+
+        :param index: int index of the worker
+        :param reason: str logged with the recycling
+        :return: None
+        """
+        with self.lock:
+            if index in self.drivers:
+                self.recycle_requests[index] = reason
+
+    def _recycle_reason(self, index, pages):
+        with self.lock:
+            reason = self.recycle_requests.pop(index, None)
+        if reason is None and self.max_pages is not None and\
+           pages >= self.max_pages:
+            reason = str(pages) + " pages"
+        return reason
+
+    def _new_driver(self, index):
+        start = perf_counter()
+        with METRICS.timer("driver_startup"):
+            driver = self.factory()
+        print("INFO :: Driver of worker " + str(index) +
+              " ready in {:.1f} seconds".format(perf_counter() - start))
+        with self.lock:
+            self.drivers[index] = driver
+            self.recycle_requests.pop(index, None)
+        return driver
+
+    def _quit_driver(self, index):
+        with self.lock:
+            driver = self.drivers.pop(index, None)
+        if driver is None:
+            return
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        if self.on_quit is not None:
+            try:
+                self.on_quit(driver)
+            except Exception as e:
+                print("ERROR :: Could not release the driver of worker " +
+                      str(index) + ": " + repr(e))
+
+    def _work(self, index):
+        """
+        Worker loop: take an item from the queue and scrape it with the
+        driver of the worker. An error raised by the handler only fails
+        its own item; if the driver has crashed, it is restarted and
+        the item is put back in the queue. The worker gives up after
+        more than max_restarts restarts without handling an item in
+        between, i.e. in a crash loop. A driver that has handled
+        max_pages items, or that has been asked to be recycled, is
+        replaced before the worker takes its next item.
+
+        :param index: int index of the worker
+        :return: None
+        """
+        restarts = 0
+        driver = None
+        pages = 0
+        try:
+            while True:
+                if driver is None:
+                    try:
+                        driver = self._new_driver(index)
+                    except Exception as e:
+                        restarts += 1
+                        print("ERROR :: Worker " + str(index) +
+                              " could not start a driver: " + repr(e))
+                        if restarts > self.max_restarts:
+                            return
+                        continue
+                    pages = 0
+                task = self.tasks.get()
+                if task is None:
+                    return
+                item, attempt, callback = task
+                error = None
+                try:
+                    result = self.handler(driver, item)
+                except WebDriverException as e:
+                    if self.is_alive(driver):
+                        self._complete(item, callback, None, repr(e))
+                    else:
+                        error = e
+                except Exception as e:
+                    self._complete(item, callback, None, repr(e))
+                else:
+                    self._complete(item, callback, result, None)
+                if error is None:
+                    restarts = 0
+                    pages += 1
+                    reason = self._recycle_reason(index, pages)
+                    if reason is not None:
+                        print("INFO :: Recycling the driver of worker " +
+                              str(index) + ": " + reason)
+                        METRICS.inc("driver_recycles_total")
+                        self._quit_driver(index)
+                        driver = None
+                    continue
+                print("WARNING :: Driver of worker " + str(index) +
+                      " crashed, restarting it: " + repr(error))
+                self._quit_driver(index)
+                driver = None
+                restarts += 1
+                if attempt < self.max_attempts:
+                    self.tasks.put((item, attempt + 1, callback))
+                else:
+                    self._complete(item, callback, None, repr(error))
+                if restarts > self.max_restarts:
+                    print("ERROR :: Worker " + str(index) + " gave up " +
+                          "after " + str(restarts) + " driver restarts")
+                    return
+        finally:
+            self._quit_driver(index)
+            with self.lock:
+                self.alive -= 1
+                alive = self.alive
+            if alive == 0:
+                self._fail_queued("no driver left in the pool")
+
+    def close(self):
+        """
+        Stop the workers once the queue is empty and quit their drivers.
+
+        :return: None
+        """
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
@@ -0,0 +1,216 @@
+"""
+A class to extract a set of fields from a web page, either by walking
+its parsed tree only once or by running the same rules inside the browser
+"""
+from bs4.element import Tag
+import json
+
+
+# arguments: list of rules without their "clean" callable;
+# return an object mapping the position of each rule found to its value
+EXTRACT_SCRIPT = """
+var rules = arguments[0], found = {};
+function strippedText(tag) {
+    var walker = document.createTreeWalker(tag, NodeFilter.SHOW_TEXT),
+        parts = [], node;
+    while ((node = walker.nextNode())) {
+        var text = node.nodeValue.trim();
+        if (text) { parts.push(text); }
+    }
+    return parts.join('');
+}
+function read(tag, rule) {
+    var mode = rule.text || 'strip';
+    if (mode === 'strip') { return strippedText(tag); }
+    if (mode === 'raw') { return tag.textContent; }
+    if (mode === 'line') {
+        var line = tag.textContent.split('\\n')[rule.line];
+        return line === undefined ? '' : line;
+    }
+    return Array.prototype.map.call(tag.getElementsByTagName('li'),
+        function (li) { return li.textContent; });
+}
+rules.forEach(function (rule, position) {
+    var tags = Array.prototype.filter.call(
+        document.getElementsByClassName(rule['class']),
+        function (tag) { return !rule.id || tag.id === rule.id; });
+    if (!tags.length) { return; }
+    found[position] = rule.many ? tags.map(function (tag) {
+        return read(tag, rule);
+    }) : read(tags[0], rule);
+});
+return found;
+"""
+
+
+class FieldExtractor(object):
+    def __init__(self, rules):
+        """
+        Initialize the class by compiling the given table of rules
+        into an index keyed on the HTML class each rule looks for.
+
+        Every rule is a dictionary with the keys:
+            "field": str name of the output field
+            "class": str HTML class of the tag to look for
+            "id": str id the tag must have (optional)
+            "text": str how to read the tag (optional, default "strip"),
+                "strip" for get_text(strip=True), "raw" for get_text(),
+                "line" for the "line"-th line of get_text(),
+                "items" for the list of the texts of the "li" children
+            "line": int line number used by the "line" text mode
+            "many": bool collect all the matching tags (optional)
+            "clean": callable applied to each extracted value (optional)
+
+        More than one rule can fill the same field: they are tried
+        in the order of the table and the first non-empty value wins.
+
+        :param rules: list of dict rules
+        """
+        self.rules = rules
+        self.script_rules = [
+            dict((key, value) for key, value in rule.items()
+                 if key != "clean")
+            for rule in rules]
+        self.fields = list(dict.fromkeys(rule["field"] for rule in rules))
+        self.index = {}
+        for position, rule in enumerate(rules):
+            self.index.setdefault(rule["class"], []).append(
+                (position, rule))
+
+    @property
+    def classes(self):
+        """
+        Get the HTML classes the rules look for.
+
+        :return: list of str HTML classes
+        """
+        return list(self.index)
+
+    @staticmethod
+    def default(rule):
+        """
+        Get the value of a field whose tag has not been found.
+
+        :param rule: dict rule
+        :return: empty list or empty string
+        """
+        if rule.get("many") or rule.get("text") == "items":
+            return []
+        return ""
+
+    @staticmethod
+    def read(tag, rule):
+        """
+        Read the value of a tag according to the text mode of the rule.
+
+        :param tag: bs4 Tag
+        :param rule: dict rule
+        :return: str or list of str
+        """
+        mode = rule.get("text", "strip")
+        if mode == "strip":
+            value = tag.get_text(strip=True)
+        elif mode == "raw":
+            value = tag.get_text()
+        elif mode == "line":
+            try:
+                value = tag.get_text().split('\n')[rule["line"]]
+            except IndexError:
+                value = ""
+        elif mode == "items":
+            return [li.get_text() for li in tag.find_all("li")]
+        else:
+            raise ValueError("Unknown text mode: " + str(mode))
+        return FieldExtractor.clean(value, rule)
+
+    @staticmethod
+    def clean(value, rule):
+        """
+        Apply the "clean" callable of the rule, if any, to a value.
+
+        :param value: str
+        :param rule: dict rule
+        :return: str
+        """
+        clean = rule.get("clean")
+        if clean is not None:
+            value = clean(value)
+        return value
+
+    def resolve(self, found):
+        """
+        Build the output dictionary from the values collected for
+        each rule, falling back on the next rule of a field if the
+        value of the previous one is empty.
+
+        :param found: dict rule position -> value
+        :return: dict field -> value
+        """
+        data = {}
+        for position, rule in enumerate(self.rules):
+            field = rule["field"]
+            if data.get(field):
+                continue
+            if position in found:
+                data[field] = found[position]
+            elif field not in data:
+                data[field] = self.default(rule)
+        return data
+
+    def extract(self, soup):
+        """
+        Walk the tree once and fill every field of the rules.
+        Stop walking as soon as every rule that only needs
+        the first matching tag has been satisfied, unless a rule
+        needs all the matching tags.
+
+        :param soup: BeautifulSoup object
+        :return: dict field -> value
+        """
+        found = {}
+        pending = set(position for position, rule in enumerate(self.rules)
+                      if not rule.get("many"))
+        needs_full_walk = len(pending) != len(self.rules)
+        for tag in soup.descendants:
+            if not isinstance(tag, Tag):
+                continue
+            tag_classes = tag.get("class")
+            if not tag_classes:
+                continue
+            for tag_class in tag_classes:
+                for position, rule in self.index.get(tag_class, ()):
+                    if "id" in rule and tag.get("id") != rule["id"]:
+                        continue
+                    if rule.get("many"):
+                        found.setdefault(position, []).append(
+                            self.read(tag, rule))
+                    elif position in pending:
+                        found[position] = self.read(tag, rule)
+                        pending.discard(position)
+            if not pending and not needs_full_walk:
+                break
+        return self.resolve(found)
+
+    def extract_in_page(self, driver):
+        """
+        Fill every field of the rules by running them inside the page
+        through a single script, so that only the extracted values,
+        rather than the whole page source, are sent over the wire.
+        Return the fields and the size in bytes of the values received.
+
+        :param driver: selenium chrome driver object
+        :return: tuple (dict field -> value, int bytes)
+        """
+        raw = driver.execute_script(EXTRACT_SCRIPT, self.script_rules) or {}
+        n_bytes = len(json.dumps(raw, ensure_ascii=False).encode('utf-8'))
+        found = {}
+        for key, value in raw.items():
+            position = int(key)
+            rule = self.rules[position]
+            if rule.get("text") == "items":
+                found[position] = value
+            elif rule.get("many"):
+                found[position] = [self.clean(item, rule) for item in value]
+            else:
+                found[position] = self.clean(value, rule)
+        return self.resolve(found), n_bytes
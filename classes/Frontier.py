@@ -0,0 +1,320 @@
+"""
+A class to keep the crawl frontier on disk: the URLs discovered by each
+query with their state, and the results pages and queries already
+discovered, so that a new run resumes where the previous one stopped
+
+"""
+from threading import Lock
+from time import time
+import json
+import sqlite3
+
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+
+
+class Frontier(object):
+    def __init__(self, path, ttl=86400., max_attempts=3):
+        """
+        Initialize the class by opening, or creating, the frontier
+        database. The URLs left in flight by a run that has been
+        interrupted are made pending again.
+
+        The database holds four tables:
+            urls: URL, kind of page, first query that found it, state
+                (one of PENDING, IN_FLIGHT, DONE and FAILED), number of
+                attempts, time of the last change and last error
+            url_queries: every query that has found each URL, in the
+                order they have been found
+            pages: URLs found on each results page of a search, with
+                the number of results read on the first page and the
+                URL of the next page if the search gives it
+            queries: time the discovery of a query has been completed
+                and time all its URLs have been scraped
+        Pages and queries older than the TTL are discovered again.
+
+        :param path: str path of the SQLite database file
+        :param ttl: float seconds a discovered page or query is kept
+        :param max_attempts: int times a URL is tried before
+            it is marked as FAILED
+        """
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS urls (URL TEXT PRIMARY KEY, " +
+                "kind TEXT NOT NULL, query TEXT NOT NULL, " +
+                "state TEXT NOT NULL, attempts INTEGER NOT NULL, " +
+                "updated_at REAL NOT NULL, error TEXT)")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS urls_kind_query_state " +
+                "ON urls (kind, query, state)")
+            has_url_queries = self.connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' " +
+                "AND name = 'url_queries'").fetchone() is not None
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS url_queries (" +
+                "kind TEXT NOT NULL, query TEXT NOT NULL, " +
+                "URL TEXT NOT NULL, PRIMARY KEY (kind, query, URL))")
+            if not has_url_queries:
+                # frontier of a version keeping only the first query
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO url_queries " +
+                    "SELECT kind, query, URL FROM urls ORDER BY rowid")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS pages (kind TEXT NOT NULL, " +
+                "search TEXT NOT NULL, offset INTEGER NOT NULL, " +
+                "urls TEXT NOT NULL, n_results INTEGER, " +
+                "fetched_at REAL NOT NULL, next_url TEXT, " +
+                "PRIMARY KEY (kind, search, offset))")
+            columns = [row[1] for row in self.connection.execute(
+                "PRAGMA table_info(pages)")]
+            if "next_url" not in columns:
+                self.connection.execute(
+                    "ALTER TABLE pages ADD COLUMN next_url TEXT")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS queries (kind TEXT NOT NULL, " +
+                "query TEXT NOT NULL, discovered_at REAL, " +
+                "finished_at REAL, PRIMARY KEY (kind, query))")
+            recovered = self.connection.execute(
+                "UPDATE urls SET state = ? WHERE state = ?",
+                (PENDING, IN_FLIGHT)).rowcount
+        if recovered:
+            print("INFO :: " + str(recovered) + " URL(s) left in flight " +
+                  "by the previous run are pending again")
+
+    def _fresh(self, timestamp):
+        return timestamp is not None and time() - timestamp < self.ttl
+
+    def get_page(self, kind, search, offset):
+        """
+        Get the URLs found on a results page, if it has been
+        discovered within the TTL.
+
+        :param kind: str kind of page, e.g. "profile" or "job"
+        :param search: str URL or query of the search
+        :param offset: int offset or number of the results page
+        :return: tuple (list of URLs, int number of results or None,
+            str URL of the next page or None), None if the page has to
+            be discovered again
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT urls, n_results, fetched_at, next_url FROM pages " +
+                "WHERE kind = ? AND search = ? AND offset = ?",
+                (kind, search, offset)).fetchone()
+        if row is None or not self._fresh(row[2]):
+            return None
+        return json.loads(row[0]), row[1], row[3]
+
+    def save_page(self, kind, search, offset, urls, n_results=None,
+                  next_url=None):
+        """
+        Record the URLs found on a results page.
+
+        :param kind: str kind of page, e.g. "profile" or "job"
+        :param search: str URL or query of the search
+        :param offset: int offset or number of the results page
+        :param urls: list of URLs
+        :param n_results: int number of results of the search, if read
+        :param next_url: str URL of the next results page, if given
+            by the page
+        :return: None
+        """
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO pages (kind, search, offset, " +
+                    "urls, n_results, fetched_at, next_url) " +
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (kind, search, offset, json.dumps(urls), n_results,
+                     time(), next_url))
+
+    def _query_times(self, kind, query):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT discovered_at, finished_at FROM queries " +
+                "WHERE kind = ? AND query = ?", (kind, query)).fetchone()
+        return row if row is not None else (None, None)
+
+    def is_discovered(self, kind, query):
+        """
+        Check whether the URLs of a query have been discovered
+        within the TTL.
+
+        :param kind: str kind of page
+        :param query: str
+        :return: bool
+        """
+        return self._fresh(self._query_times(kind, query)[0])
+
+    def is_finished(self, kind, query):
+        """
+        Check whether all the URLs of a query discovered within
+        the TTL have been scraped or have failed.
+
+        :param kind: str kind of page
+        :param query: str
+        :return: bool
+        """
+        discovered_at, finished_at = self._query_times(kind, query)
+        return self._fresh(discovered_at) and finished_at is not None
+
+    def add_urls(self, kind, query, urls, discovered=True):
+        """
+        Add the URLs discovered by a query as pending, leaving the
+        URLs already in the frontier unchanged but recording that the
+        query has found them too, and mark the discovery of the query
+        as completed unless told otherwise, e.g. while its URLs are
+        still being added page by page.
+
+        :param kind: str kind of page
+        :param query: str
+        :param urls: list of URLs
+        :param discovered: bool the query has no more URLs to add
+        :return: int number of new URLs
+        """
+        now = time()
+        with self.lock:
+            with self.connection:
+                before = self.connection.total_changes
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO urls " +
+                    "VALUES (?, ?, ?, ?, 0, ?, NULL)",
+                    [(url, kind, query, PENDING, now) for url in urls])
+                added = self.connection.total_changes - before
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO url_queries VALUES (?, ?, ?)",
+                    [(kind, query, url) for url in urls])
+                if discovered:
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO queries " +
+                        "VALUES (?, ?, ?, NULL)", (kind, query, now))
+        return added
+
+    def get_urls(self, kind, query, state=PENDING):
+        """
+        Get the URLs found by a query in the given state, whichever
+        query found them first, in the order the query found them.
+
+        :param kind: str kind of page
+        :param query: str
+        :param state: str state of the URLs
+        :return: list of URLs
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT urls.URL FROM url_queries JOIN urls " +
+                "ON urls.URL = url_queries.URL " +
+                "WHERE url_queries.kind = ? AND url_queries.query = ? " +
+                "AND urls.state = ? ORDER BY url_queries.rowid",
+                (kind, query, state))
+            return [row[0] for row in rows]
+
+    def _set_state(self, urls, state, attempt=0, error=None):
+        with self.lock:
+            with self.connection:
+                self.connection.executemany(
+                    "UPDATE urls SET state = ?, attempts = attempts + ?, " +
+                    "updated_at = ?, error = ? WHERE URL = ?",
+                    [(state, attempt, time(), error, url) for url in urls])
+
+    def mark_in_flight(self, urls):
+        """
+        Mark URLs as being scraped, counting an attempt for each.
+
+        :param urls: list of URLs
+        :return: None
+        """
+        self._set_state(urls, IN_FLIGHT, attempt=1)
+
+    def mark_done(self, urls):
+        """
+        Mark URLs as scraped, e.g. once their records have been written.
+
+        :param urls: list of URLs
+        :return: None
+        """
+        self._set_state(urls, DONE)
+
+    def mark_failed(self, url, error):
+        """
+        Put a URL that could not be scraped back in the pending ones,
+        or mark it as FAILED once it has been tried max_attempts times.
+
+        :param url: str URL
+        :param error: str description of the error
+        :return: str new state of the URL
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT attempts FROM urls WHERE URL = ?", (url,)).fetchone()
+        attempts = row[0] if row is not None else self.max_attempts
+        state = FAILED if attempts >= self.max_attempts else PENDING
+        self._set_state([url], state, error=error)
+        return state
+
+    def finish_query(self, kind, query):
+        """
+        Mark a query as finished if none of its URLs is left
+        pending or in flight.
+
+        :param kind: str kind of page
+        :param query: str
+        :return: bool the query has been marked as finished
+        """
+        with self.lock:
+            left = self.connection.execute(
+                "SELECT COUNT(*) FROM url_queries JOIN urls " +
+                "ON urls.URL = url_queries.URL " +
+                "WHERE url_queries.kind = ? AND url_queries.query = ? " +
+                "AND urls.state IN (?, ?)",
+                (kind, query, PENDING, IN_FLIGHT)).fetchone()[0]
+            if left:
+                return False
+            with self.connection:
+                self.connection.execute(
+                    "UPDATE queries SET finished_at = ? " +
+                    "WHERE kind = ? AND query = ?", (time(), kind, query))
+        return True
+
+    def counts(self, kind):
+        """
+        Get the number of URLs of a kind of page in each state.
+
+        :param kind: str kind of page
+        :return: dict state -> int
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT state, COUNT(*) FROM urls WHERE kind = ? " +
+                "GROUP BY state", (kind,))
+            return dict(rows.fetchall())
+
+    def report(self, kind):
+        """
+        Print the number of URLs of a kind of page in each state.
+
+        :param kind: str kind of page
+        :return: None
+        """
+        counts = self.counts(kind)
+        print("INFO :: Frontier of " + kind + " URLs: " + ", ".join(
+            str(counts.get(state, 0)) + " " + state
+            for state in (PENDING, IN_FLIGHT, DONE, FAILED)))
+
+    def close(self):
+        """
+        Close the database.
+
+        :return: None
+        """
+        with self.lock:
+            self.connection.close()
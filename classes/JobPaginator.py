@@ -0,0 +1,255 @@
+"""
+A class to collect the job URLs of every results page of a query
+on LinkedIn, by loading the pages in a bounded set of tabs of the same
+logged-in driver
+
+"""
+from selenium.common.exceptions import TimeoutException
+from classes.SessionRecorder import OPEN_TAB_SCRIPT
+from classes.RateScheduler import RateScheduler
+from classes.Waiter import Waiter
+from classes.Metrics import METRICS
+from utils import make_soup, get_job_urls, get_n_results, scroll_job_panel,\
+    JOB_SEARCH_CLASSES
+from collections import deque
+
+
+class JobPaginator(object):
+    def __init__(self, driver, parser="html.parser", waiter=None, n_tabs=4,
+                 max_attempts=3, page_size=25, frontier=None,
+                 scheduler=None):
+        """
+        Initialize the class
+
+        :param driver: selenium chrome driver object, logged in
+        :param parser: str parser backend used by make_soup()
+        :param waiter: Waiter object, one with the default
+            deadlines if not given
+        :param n_tabs: int max number of results pages loading at once
+        :param max_attempts: int times a results page is loaded
+            before giving up on it
+        :param page_size: int number of results per page, i.e. the step
+            of the "&start=" offset
+        :param frontier: Frontier object where the results pages are
+            checkpointed, none if not given
+        :param scheduler: RateScheduler object pacing the navigations,
+            one with the default rates if not given
+        """
+        self.driver = driver
+        self.parser = parser
+        self.waiter = waiter if waiter is not None else Waiter(driver)
+        self.n_tabs = max(1, n_tabs)
+        self.max_attempts = max_attempts
+        self.page_size = page_size
+        self.frontier = frontier
+        self.scheduler = scheduler if scheduler is not None \
+            else RateScheduler()
+        self.tabs = []
+        # results pages loaded by the driver, to recycle it
+        self.pages_read = 0
+
+    def read_page(self, url):
+        """
+        Wait for the results page loaded in the current tab to settle,
+        scroll its panel to the end and parse it.
+        Raise TimeoutException if the page has not settled in time,
+        recording the timeout in the scheduler.
+
+        :param url: str URL of the results page
+        :return: BeautifulSoup object
+        """
+        self.pages_read += 1
+        with METRICS.timer("page_load", kind="results"):
+            settled = self.waiter.until_dom_quiet("search_load")
+        if not settled:
+            self.scheduler.failure(url, "timeout")
+            raise TimeoutException("The results page has not settled")
+        with METRICS.timer("scroll", kind="results"):
+            scroll_job_panel(self.driver, self.waiter)
+        with METRICS.timer("parse", kind="results"):
+            return make_soup(self.driver.page_source, self.parser,
+                             JOB_SEARCH_CLASSES)
+
+    def read_first_page(self, search_url):
+        """
+        Load the first results page in the current tab and get the
+        number of results with its job URLs, trying again up to
+        max_attempts times.
+
+        :param search_url: str URL of the query
+        :return: tuple (int number of results, list of job URLs),
+            None if the page could not be read
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                with METRICS.timer("navigate", kind="results"):
+                    self.scheduler.navigate(self.driver, search_url)
+                soup = self.read_page(search_url)
+                n_results, urls = get_n_results(soup), get_job_urls(soup)
+                soup.decompose()
+                return n_results, urls
+            except TimeoutException:
+                METRICS.inc("retries_total", kind="results")
+                print("\nINFO :: TimeoutException raised while getting " +
+                      "URL\n" + search_url + "\nAttempt n." + str(attempt) +
+                      " of " + str(self.max_attempts))
+        return None
+
+    def set_driver(self, driver):
+        """
+        Search with a new driver, e.g. once the previous one has been
+        recycled, counting its pages from 0. Call between two searches.
+
+        :param driver: selenium chrome driver object, logged in
+        :return: None
+        """
+        self.driver = driver
+        self.waiter.driver = driver
+        self.tabs = []
+        self.pages_read = 0
+
+    def open_tabs(self, n_tabs):
+        """
+        Open new tabs until n_tabs tabs, including the current one,
+        are available for loading the results pages.
+
+        :param n_tabs: int number of tabs needed
+        :return: None
+        """
+        if not self.tabs:
+            self.tabs = [self.driver.current_window_handle]
+        while len(self.tabs) < n_tabs:
+            known = set(self.driver.window_handles)
+            self.driver.execute_script(OPEN_TAB_SCRIPT)
+            new_handles = [handle for handle in self.driver.window_handles
+                           if handle not in known]
+            if not new_handles:
+                break
+            self.tabs.append(new_handles[0])
+
+    def close_tabs(self):
+        """
+        Close the tabs opened by open_tabs() and switch back to the
+        first one.
+
+        :return: None
+        """
+        for handle in self.tabs[1:]:
+            self.driver.switch_to.window(handle)
+            self.driver.close()
+        if self.tabs:
+            self.driver.switch_to.window(self.tabs[0])
+        self.tabs = []
+
+    def checkpoint(self, search_url, offset):
+        """
+        Get a results page from the frontier, if any.
+
+        :param search_url: str URL of the query
+        :param offset: int offset of the results page
+        :return: tuple (list of job URLs, int number of results or None),
+            None if the page has to be loaded
+        """
+        if self.frontier is None:
+            return None
+        page = self.frontier.get_page("job", search_url, offset)
+        return page[:2] if page is not None else None
+
+    def get_job_urls(self, search_url):
+        """
+        Get the job URLs of every results page of a query.
+        Load the first page to get the number of results, then work out
+        the offsets of the other pages and keep up to n_tabs of them
+        loading at once: every tab starts loading its page without
+        waiting, then the tabs are read in the order they were started,
+        so that the other pages load while one is being scrolled.
+        Every page is loaded once allowed by the scheduler, which backs
+        off after a page that times out, hits a captcha or has no
+        results. Such a page is queued again until it has been tried
+        max_attempts times.
+        If a frontier has been given, the pages it holds are not loaded
+        again and every page read is saved to it.
+        Return the job URLs without repetitions, in the order of the
+        results pages.
+
+        :param search_url: str URL of the query
+        :return: list of linkedin-job URLs
+        """
+        checkpoint = self.checkpoint(search_url, 0)
+        if checkpoint is not None:
+            first_urls, n_results = checkpoint
+        else:
+            first_page = self.read_first_page(search_url)
+            if first_page is None:
+                return []
+            n_results, first_urls = first_page
+            if self.frontier is not None:
+                self.frontier.save_page("job", search_url, 0, first_urls,
+                                        n_results)
+        pages = {0: first_urls}
+        pending = deque()
+        for offset in range(self.page_size, n_results, self.page_size):
+            checkpoint = self.checkpoint(search_url, offset)
+            if checkpoint is None:
+                pending.append((offset, 1))
+            else:
+                pages[offset] = checkpoint[0]
+        if len(pages) > 1:
+            print("INFO :: Resuming " + search_url + " from " +
+                  str(len(pages)) + " checkpointed results page(s)")
+        if pending:
+            self.open_tabs(min(self.n_tabs, len(pending)))
+        free_tabs = deque(self.tabs)
+        loading = deque()
+        failed = []
+        try:
+            while pending or loading:
+                while pending and free_tabs:
+                    offset, attempt = pending.popleft()
+                    handle = free_tabs.popleft()
+                    self.driver.switch_to.window(handle)
+                    self.scheduler.navigate(
+                        self.driver, search_url + "&start=" + str(offset),
+                        wait=False)
+                    loading.append((handle, offset, attempt))
+                handle, offset, attempt = loading.popleft()
+                self.driver.switch_to.window(handle)
+                page_url = search_url + "&start=" + str(offset)
+                try:
+                    soup = self.read_page(page_url)
+                    self.scheduler.check(self.driver, page_url)
+                    urls = get_job_urls(soup)
+                    soup.decompose()
+                    if not urls:
+                        METRICS.inc("pages_total", kind="results",
+                                    outcome="empty")
+                        self.scheduler.failure(page_url, "empty")
+                        raise TimeoutException("No results on the page")
+                    METRICS.inc("pages_total", kind="results",
+                                outcome="scraped")
+                    pages[offset] = urls
+                    if self.frontier is not None:
+                        self.frontier.save_page("job", search_url, offset,
+                                                urls)
+                except TimeoutException:
+                    METRICS.inc("retries_total", kind="results")
+                    print("\nINFO :: TimeoutException raised while " +
+                          "getting URL\n" + page_url +
+                          "\nAttempt n." + str(attempt) +
+                          " of " + str(self.max_attempts))
+                    if attempt < self.max_attempts:
+                        pending.append((offset, attempt + 1))
+                    else:
+                        failed.append(offset)
+                free_tabs.append(handle)
+        finally:
+            self.close_tabs()
+        if failed:
+            print("WARNING :: Skipped " + str(len(failed)) +
+                  " results page(s) after " + str(self.max_attempts) +
+                  " attempts, at offsets " +
+                  ", ".join(str(offset) for offset in sorted(failed)))
+        job_urls = []
+        for offset in sorted(pages):
+            job_urls.extend(pages[offset])
+        return list(dict.fromkeys(job_urls))
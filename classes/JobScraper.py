@@ -1,9 +1,29 @@
 """
 A class to define the methods to scrape LinkedIn job web pages
 """
+from classes.FieldExtractor import FieldExtractor
+from classes.Metrics import METRICS
+
+
+# same fields as the get* methods of JobScraper, in a form that can also
+# be run inside the browser by FieldExtractor.extract_in_page()
+JOB_RULES = [
+    {"field": "skills", "class": "jobs-ppc-criteria__value",
+     "text": "raw", "many": True},
+    {"field": "job_title", "class": "jobs-top-card__job-title",
+     "text": "raw"},
+    {"field": "location", "class": "jobs-top-card__exact-location",
+     "text": "raw", "clean": str.strip},
+    {"field": "location", "class": "jobs-top-card__bullet",
+     "text": "raw", "clean": str.strip}
+]
+JOB_EXTRACTOR = FieldExtractor(JOB_RULES)
 
 
 class JobScraper(object):
+    # HTML classes of the subtrees read by the get* methods
+    PAGE_CLASSES = JOB_EXTRACTOR.classes
+
     def __init__(self, soup, url, query):
         """
         Initialize the class
@@ -81,15 +101,41 @@ class JobScraper(object):
 
         :return: dict job data
         """
-        skills = self.get_job_skills()
-        if len(skills) == 0:
-            return {}
-        else:
-            job_data = {
-                "URL": self.url,
-                "query": self.query,
-                "job_title": self.get_job_title(),
-                "location": self.get_job_location(),
-                "skills": skills
-            }
-            return job_data
+        with METRICS.timer("extract", kind="job"):
+            skills = self.get_job_skills()
+            if len(skills) == 0:
+                return {}
+            else:
+                job_data = {
+                    "URL": self.url,
+                    "query": self.query,
+                    "job_title": self.get_job_title(),
+                    "location": self.get_job_location(),
+                    "skills": skills
+                }
+                return job_data
+
+    @staticmethod
+    def get_job_data_in_page(driver, url, query):
+        """
+        Get the job data of the page loaded in the driver by running
+        JOB_RULES inside the page instead of parsing its source.
+        Return the same dictionary get_job_data() would give, and the
+        size in bytes of the values received from the browser.
+
+        :param driver: selenium chrome driver object
+        :param url: str job URL being scraped
+        :param query: str query performed
+        :return: tuple (dict job data, int bytes)
+        """
+        fields, n_bytes = JOB_EXTRACTOR.extract_in_page(driver)
+        if len(fields["skills"]) == 0:
+            return {}, n_bytes
+        job_data = {
+            "URL": url,
+            "query": query,
+            "job_title": fields["job_title"],
+            "location": fields["location"],
+            "skills": fields["skills"]
+        }
+        return job_data, n_bytes
@@ -0,0 +1,326 @@
+"""
+A class to watch the memory of a long run: the resident memory of the
+process tree of every browser, i.e. chromedriver, Chrome and its
+renderers, and the resident memory and heap of the Python process,
+logged and exported as gauges every interval, asking the DriverPool to
+recycle the drivers whose browser has grown above a limit, and telling
+the caller which of its other drivers are above it
+
+"""
+from classes.Metrics import METRICS
+from threading import Thread, Event, Lock
+import tracemalloc
+import sys
+import os
+try:
+    import psutil
+except ImportError:
+    # the process tree is read from /proc instead
+    psutil = None
+
+
+MIB = 1024. * 1024.
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _proc_children():
+    """
+    Map every process to its children by reading /proc.
+
+    :return: dict int pid -> list of int pids
+    """
+    children = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open("/proc/" + name + "/stat", 'rb') as stat_file:
+                stat = stat_file.read()
+        except OSError:
+            continue
+        # the name of the command, between parentheses, may hold spaces;
+        # the state and the parent pid follow it
+        fields = stat[stat.rindex(b")") + 2:].split()
+        children.setdefault(int(fields[1]), []).append(int(name))
+    return children
+
+
+def _proc_rss(pid):
+    try:
+        with open("/proc/" + str(pid) + "/statm", 'r') as statm_file:
+            return int(statm_file.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def process_rss(pid):
+    """
+    Get the resident memory of a process, without its children.
+
+    :param pid: int process ID
+    :return: int bytes, None if it cannot be read on this system
+    """
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return 0
+    if not os.path.isdir("/proc"):
+        return None
+    return _proc_rss(pid)
+
+
+def process_tree_rss(pid):
+    """
+    Get the resident memory of a process and of all its descendants,
+    with psutil if installed, otherwise from /proc.
+
+    :param pid: int process ID
+    :return: int bytes, None if it cannot be read on this system
+    """
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            processes = [process] + process.children(recursive=True)
+        except psutil.Error:
+            return 0
+        rss = 0
+        for process in processes:
+            try:
+                rss += process.memory_info().rss
+            except psutil.Error:
+                continue
+        return rss
+    if not os.path.isdir("/proc"):
+        return None
+    children = _proc_children()
+    rss = 0
+    pids = [pid]
+    while pids:
+        pid = pids.pop()
+        rss += _proc_rss(pid)
+        pids.extend(children.get(pid, []))
+    return rss
+
+
+def driver_pid(driver):
+    """
+    Get the process ID of the chromedriver of a driver, the parent of
+    its browser processes.
+
+    :param driver: selenium chrome driver object, possibly wrapped
+        in a SessionRecorder
+    :return: int process ID, None if the driver has no local process,
+        e.g. a ReplayDriver
+    """
+    service = getattr(driver, "service", None)
+    process = getattr(service, "process", None)
+    return getattr(process, "pid", None)
+
+
+def driver_rss(driver):
+    """
+    Get the resident memory of the process tree of a driver.
+
+    :param driver: selenium chrome driver object
+    :return: int bytes, None if it cannot be measured
+    """
+    pid = driver_pid(driver)
+    if pid is None:
+        return None
+    return process_tree_rss(pid)
+
+
+class MemoryWatchdog(object):
+    def __init__(self, pool=None, drivers=None, interval=60.,
+                 rss_limit=None, trace_heap=False):
+        """
+        Initialize the class
+
+        :param pool: DriverPool object whose drivers are watched and
+            recycled above the limit, None to watch the drivers only
+        :param drivers: dict name -> driver watched but recycled by the
+            caller, e.g. the driver searching the queries, when
+            is_over_limit() tells it to
+        :param interval: float seconds between two samples
+        :param rss_limit: float MiB of the process tree of a driver of
+            the pool above which it is recycled, None for no limit
+        :param trace_heap: bool trace the Python allocations with
+            tracemalloc to report the heap, which slows the run down;
+            the number of allocated blocks is reported otherwise
+        """
+        self.pool = pool
+        self.drivers = drivers or {}
+        self.interval = interval
+        self.rss_limit = rss_limit
+        if trace_heap and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread = None
+        self.samples = 0
+        # resident memory of every driver at the last sample
+        self.last_rss = {}
+        self.peaks = {"browsers": 0, "python_rss": 0, "python_heap": 0}
+
+    def _watched_drivers(self):
+        # name, index in the pool or None, driver
+        with self.lock:
+            drivers = [(name, None, driver)
+                       for name, driver in self.drivers.items()]
+        if self.pool is not None:
+            with self.pool.lock:
+                drivers.extend(("worker-" + str(index), index, driver)
+                               for index, driver in self.pool.drivers.items())
+        return drivers
+
+    def sample(self):
+        """
+        Measure the memory of every watched driver and of the Python
+        process, export it as gauges and ask the pool to recycle the
+        drivers above the limit.
+
+        :return: dict with the "browsers" dict name -> int bytes,
+            "python_rss" int bytes or None, "python_heap" int bytes
+            traced, None if not traced, and "python_blocks" int
+            number of blocks allocated by Python
+        """
+        browsers = {}
+        for name, index, driver in self._watched_drivers():
+            rss = driver_rss(driver)
+            if rss is None:
+                continue
+            browsers[name] = rss
+            METRICS.set("browser_rss_bytes", rss, driver=name)
+            if index is not None and self.rss_limit is not None and\
+               rss > self.rss_limit * MIB:
+                self.pool.recycle(index, "rss of {:.0f} MiB".format(
+                    rss / MIB))
+        python_rss = process_rss(os.getpid())
+        python_heap = tracemalloc.get_traced_memory()[0]\
+            if tracemalloc.is_tracing() else None
+        memory = {"browsers": browsers, "python_rss": python_rss,
+                  "python_heap": python_heap,
+                  "python_blocks": sys.getallocatedblocks()}
+        if python_rss is not None:
+            METRICS.set("python_rss_bytes", python_rss)
+        if python_heap is not None:
+            METRICS.set("python_heap_bytes", python_heap)
+        with self.lock:
+            self.last_rss = browsers
+            self.samples += 1
+            self.peaks["browsers"] = max(self.peaks["browsers"],
+                                         sum(browsers.values()))
+            self.peaks["python_rss"] = max(self.peaks["python_rss"],
+                                           python_rss or 0)
+            self.peaks["python_heap"] = max(self.peaks["python_heap"],
+                                            python_heap or 0)
+        return memory
+
+    def watch(self, name, driver):
+        """
+        Watch a driver under a name, in place of the driver watched
+        under it so far, e.g. once the caller has recycled it.
+
+        :param name: str name of the driver
+        :param driver: selenium chrome driver object
+        :return: None
+        """
+        with self.lock:
+            self.drivers[name] = driver
+            self.last_rss.pop(name, None)
+
+    def is_over_limit(self, name):
+        """
+        Check whether the browser of a driver watched under a name was
+        above the limit at the last sample.
+
+        :param name: str name of the driver
+        :return: bool
+        """
+        with self.lock:
+            rss = self.last_rss.get(name)
+        return self.rss_limit is not None and rss is not None and\
+            rss > self.rss_limit * MIB
+
+    @staticmethod
+    def format(memory):
+        """
+        Format a sample on one line, in MiB.
+
+        :param memory: dict returned by sample()
+        :return: str
+        """
+        browsers = memory["browsers"]
+        parts = []
+        if browsers:
+            parts.append("browsers {:.0f} MiB (".format(
+                sum(browsers.values()) / MIB) + ", ".join(
+                name + " {:.0f}".format(rss / MIB)
+                for name, rss in sorted(browsers.items())) + ")")
+        if memory["python_rss"] is not None:
+            parts.append("Python {:.0f} MiB".format(
+                memory["python_rss"] / MIB))
+        if memory["python_heap"] is not None:
+            parts.append("heap {:.0f} MiB".format(
+                memory["python_heap"] / MIB))
+        else:
+            parts.append(str(memory["python_blocks"]) + " blocks")
+        return ", ".join(parts)
+
+    def log(self):
+        """
+        Sample the memory and print it.
+
+        :return: dict returned by sample()
+        """
+        memory = self.sample()
+        print("INFO :: Memory: " + self.format(memory))
+        return memory
+
+    def start(self):
+        """
+        Log the memory every interval seconds in a thread,
+        until stopped.
+
+        :return: None
+        """
+        def run():
+            while not self.stopped.wait(self.interval):
+                try:
+                    self.log()
+                except Exception as e:
+                    print("WARNING :: Could not measure the memory: " +
+                          repr(e))
+        self.log()
+        self.thread = Thread(target=run, name="memory-watchdog",
+                             daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the thread, if started. Calling it more than once
+        has no effect.
+
+        :return: None
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def report(self):
+        """
+        Print the peaks of the memory measured over the run.
+
+        :return: None
+        """
+        with self.lock:
+            peaks = dict(self.peaks)
+            samples = self.samples
+        line = "INFO :: Memory peaks over " + str(samples) + \
+            " sample(s): browsers {:.0f} MiB, Python {:.0f} MiB".format(
+                peaks["browsers"] / MIB, peaks["python_rss"] / MIB)
+        if peaks["python_heap"]:
+            line += ", heap {:.0f} MiB".format(peaks["python_heap"] / MIB)
+        print(line)
@@ -0,0 +1,346 @@
+"""
+A class to collect the counters, gauges and latency histograms of every
+stage of a run, and to export them as Prometheus text over HTTP or as a
+periodic JSON summary, cheaply enough to be left on
+
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+from threading import Thread, Lock, Event
+from bisect import bisect_left
+from time import perf_counter, time
+import json
+import os
+
+
+# upper bounds in seconds of the buckets of the latency histograms
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5.,
+                   10., 30., 60.)
+PREFIX = "scraper_"
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(
+        name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"') +
+        '"' for name, value in pairs) + "}"
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        """
+        Initialize the class: the number of observations per bucket,
+        their sum and their maximum.
+
+        :param buckets: tuple of float upper bounds, sorted
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """
+        Estimate a quantile as the upper bound of the bucket
+        holding it, or the maximum for the last bucket.
+
+        :param q: float between 0 and 1
+        :return: float
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Initialize the class
+
+        :param buckets: tuple of float upper bounds in seconds
+            of the buckets of the histograms
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.lock = Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.watched = {}
+        self.histograms = {}
+        self.server = None
+        self.stopped = Event()
+        self.summary_thread = None
+
+    def inc(self, name, value=1, **labels):
+        """
+        Add a value to a counter.
+
+        :param name: str name of the counter
+        :param value: int or float added
+        :param labels: str label values
+        :return: None
+        """
+        key = (name, _labels_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """
+        Set the value of a gauge.
+
+        :param name: str name of the gauge
+        :param value: int or float
+        :param labels: str label values
+        :return: None
+        """
+        with self.lock:
+            self.gauges[(name, _labels_key(labels))] = value
+
+    def watch(self, name, function, **labels):
+        """
+        Make a gauge read its value from a function every time the
+        metrics are exported, e.g. the size of a queue.
+
+        :param name: str name of the gauge
+        :param function: callable() returning an int or float
+        :param labels: str label values
+        :return: None
+        """
+        with self.lock:
+            self.watched[(name, _labels_key(labels))] = function
+
+    def observe(self, name, value, **labels):
+        """
+        Add an observation to a histogram.
+
+        :param name: str name of the histogram
+        :param value: float observed, e.g. seconds
+        :param labels: str label values
+        :return: None
+        """
+        key = (name, _labels_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        """
+        Time the block of a with statement and add its duration to the
+        "stage_seconds" histogram of the stage, even if it raises.
+
+        :param stage: str name of the stage
+        :param labels: str other label values, e.g. kind of page
+        :return: context manager
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_seconds", perf_counter() - start,
+                         stage=stage, **labels)
+
+    def _read_gauges(self):
+        with self.lock:
+            gauges = dict(self.gauges)
+            watched = list(self.watched.items())
+        for key, function in watched:
+            try:
+                gauges[key] = function()
+            except Exception:
+                continue
+        return gauges
+
+    def snapshot(self):
+        """
+        Get the current value of every metric.
+
+        :return: dict with the counters, gauges and histograms,
+            each a list of dict with the name, labels and values
+        """
+        gauges = self._read_gauges()
+        with self.lock:
+            counters = [{"name": name, "labels": dict(key), "value": value}
+                        for (name, key), value
+                        in sorted(self.counters.items())]
+            histograms = [
+                {"name": name, "labels": dict(key), "count": h.count,
+                 "sum": h.sum, "max": h.max, "p50": h.quantile(0.5),
+                 "p95": h.quantile(0.95)}
+                for (name, key), h in sorted(self.histograms.items())]
+        return {"time": time(), "counters": counters,
+                "gauges": [{"name": name, "labels": dict(key),
+                            "value": value}
+                           for (name, key), value in sorted(gauges.items())],
+                "histograms": histograms}
+
+    def prometheus_text(self):
+        """
+        Get every metric in the Prometheus text exposition format.
+
+        :return: str
+        """
+        gauges = self._read_gauges()
+        lines = []
+        typed = set()
+
+        def add_type(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE " + PREFIX + name + " " + kind)
+        with self.lock:
+            for (name, key), value in sorted(self.counters.items()):
+                add_type(name, "counter")
+                lines.append(PREFIX + name + _format_labels(key) + " " +
+                             repr(float(value)))
+            for (name, key), value in sorted(gauges.items()):
+                add_type(name, "gauge")
+                lines.append(PREFIX + name + _format_labels(key) + " " +
+                             repr(float(value)))
+            for (name, key), h in sorted(self.histograms.items()):
+                add_type(name, "histogram")
+                cumulative = 0
+                for bound, count in zip(self.buckets, h.counts):
+                    cumulative += count
+                    lines.append(PREFIX + name + "_bucket" + _format_labels(
+                        key, [("le", repr(bound))]) + " " + str(cumulative))
+                lines.append(PREFIX + name + "_bucket" + _format_labels(
+                    key, [("le", "+Inf")]) + " " + str(h.count))
+                lines.append(PREFIX + name + "_sum" + _format_labels(key) +
+                             " " + repr(h.sum))
+                lines.append(PREFIX + name + "_count" + _format_labels(key) +
+                             " " + str(h.count))
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        Serve the metrics in the Prometheus text format at /metrics
+        from a background thread.
+
+        :param port: int port, 0 for any free one
+        :param host: str address to listen on
+        :return: int port listened on
+        """
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type",
+                                 "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        Thread(target=self.server.serve_forever, name="metrics-server",
+               daemon=True).start()
+        port = self.server.server_address[1]
+        print("INFO :: Serving metrics at http://" + host + ":" +
+              str(port) + "/metrics")
+        return port
+
+    def start_summary(self, path, interval=60.):
+        """
+        Append a JSON line with a snapshot of the metrics to a file
+        every interval seconds, and once more when stopped.
+
+        :param path: str path of the JSON-lines file
+        :param interval: float seconds between two snapshots
+        :return: None
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        def run():
+            while not self.stopped.wait(interval):
+                self.write_summary(path)
+            self.write_summary(path)
+        self.summary_thread = Thread(target=run, name="metrics-summary",
+                                     daemon=True)
+        self.summary_thread.start()
+
+    def write_summary(self, path):
+        """
+        Append a JSON line with a snapshot of the metrics to a file.
+
+        :param path: str path of the JSON-lines file
+        :return: None
+        """
+        with open(path, 'a', encoding='utf-8') as summary_file:
+            summary_file.write(json.dumps(self.snapshot()) + "\n")
+
+    def stop(self):
+        """
+        Stop the server and the summary thread, if started,
+        writing a last summary. Calling it more than once has no effect.
+
+        :return: None
+        """
+        self.stopped.set()
+        if self.summary_thread is not None:
+            self.summary_thread.join()
+            self.summary_thread = None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def report(self):
+        """
+        Print, for each stage, how many times it has run, the total,
+        mean, median, 95th percentile and maximum time it took,
+        followed by the counters.
+
+        :return: None
+        """
+        snapshot = self.snapshot()
+        print("INFO :: Time spent per stage")
+        print("{:<24} {:>7} {:>10} {:>8} {:>8} {:>8} {:>8}".format(
+            "stage", "runs", "total s", "mean s", "p50 s", "p95 s",
+            "max s"))
+        for h in snapshot["histograms"]:
+            if h["name"] != "stage_seconds" or h["count"] == 0:
+                continue
+            labels = dict(h["labels"])
+            stage = labels.pop("stage")
+            if labels:
+                stage += "/" + "/".join(str(labels[name])
+                                        for name in sorted(labels))
+            print("{:<24} {:>7} {:>10.1f} {:>8.3f} {:>8.3f} {:>8.3f} "
+                  "{:>8.3f}".format(
+                      stage, h["count"], h["sum"], h["sum"] / h["count"],
+                      h["p50"], h["p95"], h["max"]))
+        for counter in snapshot["counters"]:
+            labels = _format_labels(sorted(counter["labels"].items()))
+            print("INFO :: " + counter["name"] + labels + " = " +
+                  str(counter["value"]))
+
+
+# registry shared by every module of a run
+METRICS = Metrics()
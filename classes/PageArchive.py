@@ -0,0 +1,139 @@
+"""
+A class to archive the source of every fetched page, so that the
+pages can be extracted again offline without fetching them again
+
+"""
+from threading import Lock
+from time import time
+import gzip
+import hashlib
+import os
+import sqlite3
+
+
+INDEX_FILE = "index.sqlite"
+
+
+class PageArchive(object):
+    def __init__(self, path):
+        """
+        Initialize the class by opening, or creating, the archive
+        in the given directory.
+
+        An archive is a directory containing the gzipped page sources,
+        named after the SHA-1 of their content so that a page fetched
+        again unchanged is stored only once, and an index.sqlite
+        database with a row per fetch: URL, fetch time, SHA-1 of the
+        page source, kind of page (e.g. "profile" or "job") and query.
+
+        :param path: str path of the archive directory
+        """
+        self.path = path
+        self.lock = Lock()
+        os.makedirs(os.path.join(path, "blobs"), exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(path, INDEX_FILE),
+                                          check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS pages (URL TEXT NOT NULL, " +
+            "fetched_at REAL NOT NULL, digest TEXT NOT NULL, " +
+            "kind TEXT NOT NULL, query TEXT)")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS pages_kind_URL " +
+            "ON pages (kind, URL, fetched_at)")
+        self.connection.commit()
+
+    @staticmethod
+    def blob_path(path, digest):
+        """
+        Get the path of the file holding a page source.
+
+        :param path: str path of the archive directory
+        :param digest: str SHA-1 of the page source
+        :return: str path
+        """
+        return os.path.join(path, "blobs", digest[:2], digest + ".html.gz")
+
+    def store(self, url, page_source, kind, query=None):
+        """
+        Archive a fetched page source.
+
+        :param url: str URL of the page
+        :param page_source: str HTML code of the page
+        :param kind: str kind of page, e.g. "profile" or "job"
+        :param query: str query the URL was found with
+        :return: str SHA-1 of the page source
+        """
+        data = page_source.encode('utf-8')
+        digest = hashlib.sha1(data).hexdigest()
+        blob_path = self.blob_path(self.path, digest)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            tmp_path = blob_path + "." + str(os.getpid()) + ".tmp"
+            with open(tmp_path, 'wb') as blob_file:
+                blob_file.write(gzip.compress(data, mtime=0))
+            os.replace(tmp_path, blob_path)
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    "INSERT INTO pages VALUES (?, ?, ?, ?, ?)",
+                    (url, time(), digest, kind, query))
+        return digest
+
+    @staticmethod
+    def load(path, digest):
+        """
+        Read an archived page source. Being static, it can be called
+        from other processes without opening the index.
+
+        :param path: str path of the archive directory
+        :param digest: str SHA-1 of the page source
+        :return: str HTML code of the page
+        """
+        with open(PageArchive.blob_path(path, digest), 'rb') as blob_file:
+            return gzip.decompress(blob_file.read()).decode('utf-8')
+
+    def iter_pages(self, kind, latest=True):
+        """
+        Yield the archived fetches of a kind of page as tuples
+        (URL, fetched_at, digest, query), reading the index in chunks.
+
+        :param kind: str kind of page, e.g. "profile" or "job"
+        :param latest: bool only yield the last fetch of each URL
+        :return: generator of tuples
+        """
+        if latest:
+            sql = ("SELECT URL, MAX(fetched_at), digest, query FROM pages " +
+                   "WHERE kind = ? GROUP BY URL")
+        else:
+            sql = ("SELECT URL, fetched_at, digest, query FROM pages " +
+                   "WHERE kind = ? ORDER BY fetched_at")
+        with self.lock:
+            rows = self.connection.execute(sql, (kind,))
+            chunk = rows.fetchmany(1000)
+        while chunk:
+            for row in chunk:
+                yield row
+            with self.lock:
+                chunk = rows.fetchmany(1000)
+
+    def count(self, kind):
+        """
+        Get the number of archived URLs of a kind of page.
+
+        :param kind: str kind of page
+        :return: int
+        """
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(DISTINCT URL) FROM pages WHERE kind = ?",
+                (kind,)).fetchone()[0]
+
+    def close(self):
+        """
+        Close the index.
+
+        :return: None
+        """
+        with self.lock:
+            self.connection.close()
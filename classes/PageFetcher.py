@@ -0,0 +1,175 @@
+"""
+A class to fetch pages with a pooled, keep-alive HTTP session carrying
+the cookies of a logged-in selenium driver, and to load them with a
+driver only when the HTTP response lacks the expected markup
+
+"""
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from urllib3.util.retry import Retry
+from threading import Lock
+import csv
+import re
+import requests
+
+
+SCRIPT_PATTERN = re.compile(r"<script\b.*?</script>",
+                            re.IGNORECASE | re.DOTALL)
+# status codes of the responses sent instead of the page when a domain
+# is rate limiting the scraper (999 is LinkedIn's)
+THROTTLED_STATUS = (429, 999)
+
+
+class PageFetcher(object):
+    def __init__(self, required_class="jobs-top-card", pool_size=10,
+                 timeout=10., max_retries=2, scheduler=None):
+        """
+        Initialize the class
+
+        :param required_class: str HTML class a page fetched over HTTP
+            must contain to be used, otherwise it is loaded by the driver
+        :param pool_size: int max number of connections kept alive
+            per host, i.e. of pages fetched at once
+        :param timeout: float seconds to wait for a response
+        :param max_retries: int times a request is tried again on
+            connection errors and 502, 503 and 504 responses
+        :param scheduler: RateScheduler object pacing the requests and
+            the navigations of the driver, none if not given
+        """
+        self.required = re.compile(
+            r'class="([^"]*\s)?' + re.escape(required_class))
+        self.timeout = timeout
+        self.scheduler = scheduler
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size,
+            max_retries=Retry(total=max_retries, backoff_factor=0.5,
+                              status_forcelist=(502, 503, 504)))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = Lock()
+        self.paths = {}
+        self.stats = {"http": 0, "driver": 0}
+
+    def load_session(self, driver):
+        """
+        Copy the cookies and the user agent of a logged-in driver
+        to the HTTP session.
+
+        :param driver: selenium chrome driver object
+        :return: None
+        """
+        for cookie in driver.get_cookies():
+            self.session.cookies.set(
+                cookie["name"], cookie["value"],
+                domain=cookie.get("domain"), path=cookie.get("path", "/"),
+                secure=cookie.get("secure", False))
+        user_agent = driver.execute_script("return navigator.userAgent")
+        if user_agent:
+            self.session.headers["User-Agent"] = user_agent
+
+    def has_markup(self, page_source):
+        """
+        Check whether a tag of the page has the required HTML class,
+        or a class starting with it. The scripts of the page are left
+        out, as the markup they would render is not in the page yet.
+
+        :param page_source: str HTML code of the page
+        :return: bool
+        """
+        return self.required.search(
+            SCRIPT_PATTERN.sub("", page_source)) is not None
+
+    def fetch_http(self, url):
+        """
+        Fetch a page over HTTP.
+        Return its HTML code, or None if the request failed or the page
+        lacks the required markup, e.g. because it is rendered by
+        scripts or the session has been logged out.
+        If a scheduler has been given, the request is sent once allowed
+        by it and a throttled response makes it back off.
+
+        :param url: str URL of the page
+        :return: str HTML code of the page or None
+        """
+        if self.scheduler is not None:
+            self.scheduler.acquire(url)
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+        except RequestException as e:
+            print("WARNING :: HTTP fetch failed for URL\n" + url + "\n" +
+                  repr(e))
+            return None
+        if self.scheduler is not None:
+            if response.status_code in THROTTLED_STATUS:
+                self.scheduler.failure(url, "captcha")
+            else:
+                self.scheduler.success(url)
+        if response.status_code != 200:
+            return None
+        page_source = response.text
+        if not self.has_markup(page_source):
+            return None
+        return page_source
+
+    def fetch(self, url, driver):
+        """
+        Get a page over HTTP if possible, otherwise load it with the
+        driver, and record which path has been used for the URL.
+        Return the HTML code of the page fetched over HTTP, or None if
+        the page has been loaded by the driver, from which it can then
+        be read or extracted in place.
+        Raise TimeoutException if the driver times out or is blocked.
+
+        :param url: str URL of the page
+        :param driver: selenium chrome driver object
+        :return: tuple (str HTML code or None, str "http" or "driver")
+        """
+        page_source = self.fetch_http(url)
+        path = "driver" if page_source is None else "http"
+        if page_source is None:
+            if self.scheduler is not None:
+                self.scheduler.navigate(driver, url)
+            else:
+                driver.get(url)
+        with self.lock:
+            self.paths[url] = path
+            self.stats[path] += 1
+        return page_source, path
+
+    def report(self):
+        """
+        Print how many pages have been fetched over HTTP and how many
+        have been loaded by a driver.
+
+        :return: None
+        """
+        total = sum(self.stats.values())
+        if total == 0:
+            return
+        print("INFO :: Fetched " + str(self.stats["http"]) + " page(s) " +
+              "over HTTP and " + str(self.stats["driver"]) + " with the " +
+              "driver ({:.0f}% over HTTP)".format(
+                  100. * self.stats["http"] / total))
+
+    def save_paths(self, path):
+        """
+        Write the path used for each URL to a CSV file.
+
+        :param path: str path of the CSV file
+        :return: None
+        """
+        with self.lock:
+            paths = sorted(self.paths.items())
+        with open(path, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["URL", "path"])
+            writer.writerows(paths)
+
+    def close(self):
+        """
+        Close the connections of the HTTP session.
+
+        :return: None
+        """
+        self.session.close()
@@ -0,0 +1,249 @@
+"""
+A class to run the stages of a scrape, e.g. discovery, fetching, parsing
+and storage, concurrently on an asyncio event loop, with bounded queues
+between the stages, the blocking work of every stage running in a thread
+executor or in a DriverPool, and to report how busy every stage has been
+and how long its queue has grown
+
+"""
+from concurrent.futures import ThreadPoolExecutor
+from classes.Metrics import METRICS
+from time import perf_counter
+import asyncio
+
+
+# put in the queue of a stage once there is nothing left to handle
+DONE = object()
+
+
+class PoolError(Exception):
+    """
+    Error reported by a DriverPool for an item it has handled
+    """
+
+
+class Stage(object):
+    def __init__(self, name, function=None, workers=1, queue_size=100,
+                 pool=None, expand=False, on_error=None):
+        """
+        Initialize the class
+
+        :param name: str name of the stage
+        :param function: callable(item) doing the work of the stage in a
+            thread of the executor and returning the item passed to the
+            next stage, None to pass nothing
+        :param workers: int number of items handled at once
+        :param queue_size: int max number of items waiting for the stage
+        :param pool: DriverPool whose handler does the work of the stage
+            instead of a function, handling up to its size items at once
+        :param expand: bool the function returns an iterable of items,
+            each passed to the next stage as soon as it is produced
+        :param on_error: callable(item, str error) called in a thread of
+            the executor when the work of an item raises an exception,
+            the error being printed if not given
+        """
+        if (function is None) == (pool is None):
+            raise ValueError("Stage " + name + " needs either a function " +
+                             "or a pool")
+        self.name = name
+        self.function = function
+        self.pool = pool
+        self.workers = pool.size if pool is not None else workers
+        self.queue_size = queue_size
+        self.expand = expand
+        self.on_error = on_error
+        self.queue = None
+        self.items_in = 0
+        self.items_out = 0
+        self.errors = 0
+        self.busy = 0.
+        self.blocked = 0.
+        self.max_backlog = 0
+
+
+def _settle(future, result, error):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(PoolError(error))
+    else:
+        future.set_result(result)
+
+
+class Pipeline(object):
+    def __init__(self, stages):
+        """
+        Initialize the class
+
+        :param stages: list of Stage objects, in the order the items
+            go through them
+        """
+        self.stages = stages
+        self.elapsed = 0.
+
+    def run(self, items):
+        """
+        Feed the items to the first stage and run every stage until all
+        the items, and the items they have produced, have been handled.
+
+        :param items: iterable of items of the first stage
+        :return: None
+        """
+        start = perf_counter()
+        try:
+            asyncio.run(self._run(items))
+        finally:
+            self.elapsed = perf_counter() - start
+
+    async def _run(self, items):
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(
+            max_workers=sum(stage.workers for stage in self.stages),
+            thread_name_prefix="pipeline"))
+        for stage in self.stages:
+            stage.queue = asyncio.Queue(stage.queue_size)
+            METRICS.watch("queue_depth", stage.queue.qsize, queue=stage.name)
+        tasks = [self._feed(items)]
+        for index, stage in enumerate(self.stages):
+            next_stage = self.stages[index + 1]\
+                if index + 1 < len(self.stages) else None
+            tasks.append(self._run_stage(stage, next_stage))
+        await asyncio.gather(*tasks)
+
+    async def _feed(self, items):
+        first = self.stages[0]
+        for item in items:
+            await self._put(None, first, item)
+        for _ in range(first.workers):
+            await first.queue.put(DONE)
+
+    async def _run_stage(self, stage, next_stage):
+        """
+        Run the workers of a stage, then tell every worker of the next
+        stage that nothing is left once they have all ended.
+
+        :param stage: Stage object
+        :param next_stage: Stage object, None for the last stage
+        :return: None
+        """
+        await asyncio.gather(*[self._work(stage, next_stage)
+                               for _ in range(stage.workers)])
+        if next_stage is not None:
+            for _ in range(next_stage.workers):
+                await next_stage.queue.put(DONE)
+
+    async def _work(self, stage, next_stage):
+        """
+        Worker loop: take an item from the queue of the stage, do the
+        work of the stage and put what it returns in the queue of the
+        next stage, waiting while that queue is full.
+
+        :param stage: Stage object
+        :param next_stage: Stage object, None for the last stage
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await stage.queue.get()
+            if item is DONE:
+                return
+            stage.items_in += 1
+            METRICS.inc("stage_items_total", stage=stage.name)
+            try:
+                output = await self._call(loop, stage, stage.function,
+                                          item)
+                if not stage.expand:
+                    await self._put(stage, next_stage, output)
+                    continue
+                outputs = iter(output)
+                while True:
+                    output = await self._call(loop, stage, next, outputs,
+                                              DONE)
+                    if output is DONE:
+                        break
+                    await self._put(stage, next_stage, output)
+            except Exception as e:
+                stage.errors += 1
+                METRICS.inc("stage_errors_total", stage=stage.name)
+                error = str(e) if isinstance(e, PoolError) else repr(e)
+                if stage.on_error is not None:
+                    await loop.run_in_executor(None, stage.on_error, item,
+                                               error)
+                else:
+                    print("ERROR :: Stage " + stage.name + " failed on " +
+                          repr(item) + "\n" + error)
+
+    async def _call(self, loop, stage, function, *arguments):
+        """
+        Run a function in the executor, or hand an item to the pool of
+        the stage if no function is given, and add the time it takes
+        to the busy time of the stage.
+
+        :param loop: running event loop
+        :param stage: Stage object
+        :param function: callable, None to use the pool of the stage
+        :param arguments: arguments of the function, or the item
+            handed to the pool
+        :return: result
+        """
+        start = perf_counter()
+        try:
+            if function is not None:
+                return await loop.run_in_executor(None, function,
+                                                  *arguments)
+            future = loop.create_future()
+            stage.pool.submit(arguments[0], lambda result, error:
+                              loop.call_soon_threadsafe(_settle, future,
+                                                        result, error))
+            return await future
+        finally:
+            busy = perf_counter() - start
+            stage.busy += busy
+            METRICS.inc("stage_busy_seconds_total", busy, stage=stage.name)
+
+    async def _put(self, stage, next_stage, output):
+        """
+        Put an item in the queue of the next stage, adding the time
+        spent waiting for room to the blocked time of the stage.
+
+        :param stage: Stage object putting the item, None for the feed
+        :param next_stage: Stage object, None to drop the item
+        :param output: item, dropped if None
+        :return: None
+        """
+        if output is None or next_stage is None:
+            return
+        start = perf_counter()
+        await next_stage.queue.put(output)
+        next_stage.max_backlog = max(next_stage.max_backlog,
+                                     next_stage.queue.qsize())
+        if stage is not None:
+            stage.items_out += 1
+            stage.blocked += perf_counter() - start
+
+    def report(self):
+        """
+        Print, for each stage, its workers, the items it has taken,
+        passed on and failed, the share of the time of its workers spent
+        working and waiting for room in the next queue, the mean time
+        per item and the longest its queue has been. The stage busy
+        nearly all the time, with the stages before it blocked, is the
+        bottleneck.
+
+        :return: None
+        """
+        print("INFO :: Pipeline stages over {:.1f} seconds".format(
+            self.elapsed))
+        print("{:<12} {:>7} {:>7} {:>7} {:>7} {:>7} {:>9} {:>8} "
+              "{:>9}".format("stage", "workers", "in", "out", "errors",
+                             "busy %", "blocked %", "mean s", "max queue"))
+        for stage in self.stages:
+            capacity = max(stage.workers * self.elapsed, 1e-9)
+            print("{:<12} {:>7} {:>7} {:>7} {:>7} {:>7.1f} {:>9.1f} "
+                  "{:>8.3f} {:>9}".format(
+                      stage.name, stage.workers, stage.items_in,
+                      stage.items_out, stage.errors,
+                      100. * stage.busy / capacity,
+                      100. * stage.blocked / capacity,
+                      stage.busy / max(stage.items_in, 1),
+                      stage.max_backlog))
@@ -0,0 +1,342 @@
+"""
+A class to profile the first URLs or the first seconds of a run, with
+cProfile or by sampling the stacks of every thread, while tracing the
+memory allocations, and to write the profile, the collapsed stacks and
+the top allocation sites of the run with a report of its hottest
+functions in utils, classes and bs4
+
+"""
+from threading import Thread, Lock, Event, local, get_ident,\
+    enumerate as threads
+from collections import Counter
+from functools import lru_cache
+from time import perf_counter, strftime
+import cProfile
+import pstats
+import io
+import os
+import sys
+import tracemalloc
+
+
+PROFILE_MODES = ("cprofile", "sampling")
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@lru_cache(maxsize=None)
+def in_scope(filename):
+    """
+    Check whether a source file belongs to the modules reported on:
+    utils.py, the classes package and bs4.
+
+    :param filename: str path of the source file
+    :return: bool
+    """
+    path = os.path.abspath(filename)
+    if os.sep + "bs4" + os.sep in path:
+        return True
+    return path == os.path.join(REPO_DIRECTORY, "utils.py") or\
+        path.startswith(os.path.join(REPO_DIRECTORY, "classes") + os.sep)
+
+
+@lru_cache(maxsize=None)
+def short_filename(filename):
+    """
+    Shorten the path of a source file to the part after the repository
+    or the site-packages directory, if any.
+
+    :param filename: str path of the source file
+    :return: str
+    """
+    path = os.path.abspath(filename)
+    if path.startswith(REPO_DIRECTORY + os.sep):
+        return os.path.relpath(path, REPO_DIRECTORY)
+    marker = "site-packages" + os.sep
+    if marker in path:
+        return path.split(marker, 1)[1]
+    return filename
+
+
+class RunProfiler(object):
+    def __init__(self, directory, mode="cprofile", max_urls=None,
+                 seconds=None, interval=0.005, trace_memory=True, top=20,
+                 threads=1):
+        """
+        Initialize the class.
+        The profile covers the calls made through wrap() until max_urls
+        URLs have been handled or seconds have passed since start(),
+        whichever comes first, or the whole run if neither is given.
+        With mode "cprofile" each thread has its own profiler, merged
+        at the end; with mode "sampling" the stacks of every thread are
+        read every interval seconds. From Python 3.12, where only one
+        profiler can be enabled at a time, mode "cprofile" falls back
+        to "sampling" when more than one thread calls the functions
+        wrapped.
+
+        :param directory: str directory where a subdirectory of
+            artefacts is written for the run
+        :param mode: str one of PROFILE_MODES
+        :param max_urls: int number of URLs profiled, all if not given
+        :param seconds: float seconds profiled, all if not given
+        :param interval: float seconds between two samples
+        :param trace_memory: bool trace the allocations with tracemalloc
+        :param top: int number of functions and allocation sites reported
+        :param threads: int number of threads calling the functions
+            wrapped at the same time, e.g. the drivers of the pool
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError("Unknown profile mode " + repr(mode) +
+                             ", expected one of " + ", ".join(PROFILE_MODES))
+        if mode == "cprofile" and threads > 1 and\
+           sys.version_info >= (3, 12):
+            # cProfile is built on sys.monitoring, which refuses a
+            # second profiler while one is enabled
+            print("WARNING :: cProfile cannot profile " + str(threads) +
+                  " threads at once from Python 3.12, sampling instead")
+            mode = "sampling"
+        self.directory = os.path.join(directory, strftime("%Y%m%d-%H%M%S"))
+        self.mode = mode
+        self.max_urls = max_urls
+        self.seconds = seconds
+        self.interval = interval
+        self.trace_memory = trace_memory
+        self.top = top
+        self.lock = Lock()
+        self.local = local()
+        self.profiles = []
+        self.stacks = Counter()
+        self.memory_snapshot = None
+        self.n_urls = 0
+        self.profiled_urls = 0
+        self.n_samples = 0
+        self.started_at = None
+        self.active = False
+        self.ended = Event()
+        self.closed = False
+        self.sampler = None
+
+    def start(self):
+        """
+        Start profiling.
+
+        :return: None
+        """
+        if self.trace_memory:
+            tracemalloc.start(10)
+        self.started_at = perf_counter()
+        self.active = True
+        if self.mode == "sampling":
+            self.sampler = Thread(target=self._sample, name="profiler",
+                                  daemon=True)
+            self.sampler.start()
+        print("INFO :: Profiling with " + self.mode +
+              (" the first " + str(self.max_urls) + " URL(s)"
+               if self.max_urls else "") +
+              (" for " + str(self.seconds) + " seconds"
+               if self.seconds else "") +
+              ", writing to " + self.directory)
+
+    def _in_window(self):
+        if not self.active:
+            return False
+        if self.max_urls is not None and self.n_urls >= self.max_urls:
+            self._end_window()
+            return False
+        if self.seconds is not None and\
+           perf_counter() - self.started_at >= self.seconds:
+            self._end_window()
+            return False
+        return True
+
+    def _end_window(self):
+        """
+        Stop profiling new calls and take the memory snapshot,
+        once, from whichever thread notices the window has ended.
+
+        :return: None
+        """
+        with self.lock:
+            if not self.active:
+                return
+            self.active = False
+            self.profiled_urls = self.n_urls
+            self.ended.set()
+            if self.trace_memory and tracemalloc.is_tracing():
+                self.memory_snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+        print("INFO :: Profiling window ended after " +
+              str(self.profiled_urls) +
+              " URL(s) and {:.1f} seconds".format(
+                  perf_counter() - self.started_at))
+
+    def wrap(self, function, count=False):
+        """
+        Wrap a function so that its calls are profiled while the window
+        is open, e.g. the handler of a DriverPool.
+
+        :param function: callable
+        :param count: bool count every call as a URL handled
+        :return: callable with the same arguments and result
+        """
+        def profiled(*args, **kwargs):
+            try:
+                if self.mode != "cprofile" or not self._in_window():
+                    return function(*args, **kwargs)
+                return self._profile().runcall(function, *args, **kwargs)
+            finally:
+                if count:
+                    with self.lock:
+                        self.n_urls += 1
+        return profiled
+
+    def _profile(self):
+        profile = getattr(self.local, "profile", None)
+        if profile is None:
+            profile = self.local.profile = cProfile.Profile()
+            with self.lock:
+                self.profiles.append(profile)
+        return profile
+
+    def _sample(self):
+        """
+        Sampler loop: add the stack of every other thread to the
+        collapsed stacks until the window ends.
+
+        :return: None
+        """
+        own = get_ident()
+        while self._in_window():
+            names = {thread.ident: thread.name for thread in threads()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(short_filename(code.co_filename) + ":" +
+                                 code.co_name)
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.n_samples += 1
+            self.ended.wait(self.interval)
+
+    def close(self):
+        """
+        End the window if still open and write the artefacts of the run
+        to its directory: profile.pstats (cprofile) or stacks.collapsed
+        (sampling), allocations.txt (if tracing memory) and report.txt,
+        which is printed as well. Calling it more than once has no
+        effect.
+
+        :return: None
+        """
+        with self.lock:
+            if self.closed or self.started_at is None:
+                return
+            self.closed = True
+        self._end_window()
+        if self.sampler is not None:
+            self.sampler.join()
+        os.makedirs(self.directory, exist_ok=True)
+        if self.mode == "cprofile":
+            report = self._write_pstats()
+        else:
+            report = self._write_stacks()
+        if self.memory_snapshot is not None:
+            report += self._write_allocations()
+        with open(os.path.join(self.directory, "report.txt"), 'w',
+                  encoding='utf-8') as report_file:
+            report_file.write(report)
+        print(report)
+
+    def _write_pstats(self):
+        """
+        Merge the profiles of every thread into profile.pstats.
+
+        :return: str report of the hottest functions in scope
+        """
+        profiles = [profile for profile in self.profiles
+                    if profile.getstats()]
+        if not profiles:
+            return "INFO :: No call has been profiled\n"
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(os.path.join(self.directory, "profile.pstats"))
+        rows = [(function, stat) for function, stat in stats.stats.items()
+                if in_scope(function[0])]
+        lines = ["INFO :: Hottest functions of utils, classes and bs4 " +
+                 "over " + str(self.profiled_urls) + " URL(s)",
+                 "{:<56} {:>9} {:>9} {:>9}".format(
+                     "function", "calls", "self s", "total s")]
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in\
+                sorted(rows, key=lambda row: -row[1][2])[:self.top]:
+            lines.append("{:<56} {:>9} {:>9.3f} {:>9.3f}".format(
+                (short_filename(filename) + ":" + str(line) + ":" +
+                 name)[-56:], calls, tottime, cumtime))
+        return "\n".join(lines) + "\n"
+
+    def _write_stacks(self):
+        """
+        Write the collapsed stacks, one "frame;frame;... count" line
+        per stack, as read by flamegraph.pl and speedscope.
+
+        :return: str report of the hottest functions in scope
+        """
+        with open(os.path.join(self.directory, "stacks.collapsed"), 'w',
+                  encoding='utf-8') as stacks_file:
+            for stack, count in self.stacks.most_common():
+                stacks_file.write(stack + " " + str(count) + "\n")
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if frames:
+                own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        n_stacks = max(sum(self.stacks.values()), 1)
+        lines = ["INFO :: Hottest functions of utils, classes and bs4 " +
+                 "over " + str(self.n_samples) + " sample(s)",
+                 "{:<56} {:>9} {:>9}".format("function", "self %",
+                                             "total %")]
+        in_scope_frames = [frame for frame in total if in_scope(
+            os.path.join(REPO_DIRECTORY, frame.rsplit(":", 1)[0]))]
+        for frame in sorted(in_scope_frames,
+                            key=lambda frame: -total[frame])[:self.top]:
+            lines.append("{:<56} {:>9.1f} {:>9.1f}".format(
+                frame[-56:], 100. * own[frame] / n_stacks,
+                100. * total[frame] / n_stacks))
+        return "\n".join(lines) + "\n"
+
+    def _write_allocations(self):
+        """
+        Write the top allocation sites, by line and by traceback,
+        of the memory still allocated when the window ended.
+
+        :return: str report of the top allocation sites
+        """
+        by_line = self.memory_snapshot.statistics("lineno")
+        by_traceback = self.memory_snapshot.statistics("traceback")
+        output = io.StringIO()
+        output.write("Top allocation sites by line\n")
+        for stat in by_line[:self.top]:
+            output.write(str(stat) + "\n")
+        output.write("\nTop allocation sites by traceback\n")
+        for stat in by_traceback[:self.top]:
+            output.write("{:.1f} KiB in {} block(s)\n".format(
+                stat.size / 1024., stat.count))
+            for line in stat.traceback.format():
+                output.write(line + "\n")
+        with open(os.path.join(self.directory, "allocations.txt"), 'w',
+                  encoding='utf-8') as allocations_file:
+            allocations_file.write(output.getvalue())
+        lines = ["INFO :: Top allocation sites",
+                 "{:<56} {:>10} {:>9}".format("line", "KiB", "blocks")]
+        for stat in by_line[:self.top]:
+            frame = stat.traceback[0]
+            lines.append("{:<56} {:>10.1f} {:>9}".format(
+                (short_filename(frame.filename) + ":" +
+                 str(frame.lineno))[-56:], stat.size / 1024., stat.count))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,300 @@
+"""
+A class to pace the navigations of every driver and HTTP session with a
+token bucket per target domain, whose rate adapts to the responses of
+the domain, and to back off after timeouts, captchas and empty results
+
+"""
+from selenium.common.exceptions import TimeoutException
+from classes.SessionRecorder import NAVIGATE_SCRIPT
+from classes.Metrics import METRICS
+from threading import Lock
+from urllib.parse import urlparse
+import random
+import time
+
+
+# requests per second allowed at the start of a run for each domain,
+# and for the domains not listed
+DEFAULT_RATES = {
+    "google.com": 0.2,
+    "linkedin.com": 1.
+}
+DEFAULT_RATE = 1.
+# parts of the URL of the pages shown instead of the requested one
+# when a domain is blocking the scraper
+BLOCKED_URL_MARKERS = ("/sorry/", "/checkpoint/challenge", "/authwall",
+                       "captcha")
+FAILURE_REASONS = ("timeout", "captcha", "empty")
+
+
+class SystemClock(object):
+    """
+    Clock used by the scheduler in real runs.
+    """
+
+    @staticmethod
+    def now():
+        return time.monotonic()
+
+    @staticmethod
+    def sleep(seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class SimulatedClock(object):
+    def __init__(self, start=0.):
+        """
+        Initialize the class: a clock whose sleep() returns at once
+        after moving the time forward, to test the scheduler without
+        waiting.
+
+        :param start: float initial time in seconds
+        """
+        self.time = start
+        self.lock = Lock()
+        self.slept = 0.
+
+    def now(self):
+        with self.lock:
+            return self.time
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        with self.lock:
+            self.time += seconds
+            self.slept += seconds
+
+
+class DomainState(object):
+    def __init__(self, rate, max_rate, burst, now):
+        """
+        Initialize the class: the token bucket and backoff state
+        of a domain. The bucket is kept as the time the next request
+        would be due at the current rate if no burst were allowed
+        (generic cell rate algorithm), so that waiting requests are
+        given successive slots.
+
+        :param rate: float requests per second
+        :param max_rate: float max requests per second
+        :param burst: int max requests sent at once after idling
+        :param now: float current time of the clock
+        """
+        self.rate = rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.due_at = now
+        self.backoff_until = now
+        self.failures = 0
+        self.stats = {"requests": 0, "waited": 0.}
+        self.stats.update((reason, 0) for reason in FAILURE_REASONS)
+
+    def reserve(self, now):
+        """
+        Reserve the next slot for a request.
+
+        :param now: float current time of the clock
+        :return: float time the request can be sent at
+        """
+        due_at = max(self.due_at, now)
+        start = max(due_at - (self.burst - 1) / self.rate, now,
+                    self.backoff_until)
+        self.due_at = max(due_at, start) + 1. / self.rate
+        return start
+
+
+class RateScheduler(object):
+    def __init__(self, rates=None, burst=1, min_rate=0.01, max_factor=2.,
+                 increase=0.05, decrease=0.5, backoff_base=5.,
+                 backoff_max=300., jitter=0.5, clock=None, seed=None):
+        """
+        Initialize the class.
+        The rate of a domain grows by "increase" requests per second
+        after every successful request and is multiplied by "decrease"
+        after every failure (AIMD), between min_rate and max_factor
+        times its rate at the start. After n failures in a row, requests
+        to the domain wait for an exponential backoff of
+        backoff_base * 2 ** (n - 1) seconds, at most backoff_max,
+        randomised by +/- jitter of its value.
+
+        :param rates: dict domain -> float requests per second at the
+            start, overriding the DEFAULT_RATES
+        :param burst: int max requests sent at once after idling
+        :param min_rate: float min requests per second of a domain
+        :param max_factor: float max rate of a domain, as a multiple
+            of its rate at the start
+        :param increase: float requests per second added on success
+        :param decrease: float factor applied to the rate on failure
+        :param backoff_base: float seconds of the first backoff
+        :param backoff_max: float max seconds of a backoff
+        :param jitter: float fraction of the backoff randomised
+        :param clock: object with now() and sleep(seconds) methods,
+            a SystemClock if not given
+        :param seed: int seed of the random jitter
+        """
+        self.rates = dict(DEFAULT_RATES)
+        self.rates.update(rates or {})
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_factor = max_factor
+        self.increase = increase
+        self.decrease = decrease
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.clock = clock if clock is not None else SystemClock()
+        self.random = random.Random(seed)
+        self.lock = Lock()
+        self.domains = {}
+
+    def domain(self, url):
+        """
+        Get the domain a URL is paced under: the configured domain it
+        belongs to, e.g. "linkedin.com" for "it.linkedin.com",
+        otherwise its host name.
+
+        :param url: str URL
+        :return: str domain
+        """
+        host = urlparse(url).hostname or url
+        for domain in self.rates:
+            if host == domain or host.endswith("." + domain):
+                return domain
+        return host
+
+    def _state(self, domain):
+        if domain not in self.domains:
+            rate = self.rates.get(domain, DEFAULT_RATE)
+            self.domains[domain] = DomainState(
+                rate, self.max_factor * rate, self.burst, self.clock.now())
+        return self.domains[domain]
+
+    def acquire(self, url):
+        """
+        Wait until a request to the domain of the URL is allowed by its
+        token bucket and by its backoff, if any.
+        Concurrent callers are given successive tokens, so that they
+        wait one after the other.
+
+        :param url: str URL about to be requested
+        :return: float seconds waited
+        """
+        with self.lock:
+            now = self.clock.now()
+            state = self._state(self.domain(url))
+            wait = state.reserve(now) - now
+            state.stats["requests"] += 1
+            state.stats["waited"] += wait
+        METRICS.observe("stage_seconds", wait, stage="rate_wait")
+        self.clock.sleep(wait)
+        return wait
+
+    def success(self, url):
+        """
+        Record a successful request: raise the rate of its domain
+        and reset its backoff.
+
+        :param url: str URL requested
+        :return: None
+        """
+        with self.lock:
+            state = self._state(self.domain(url))
+            state.rate = min(state.max_rate, state.rate + self.increase)
+            state.failures = 0
+
+    def failure(self, url, reason):
+        """
+        Record a failed request: lower the rate of its domain and
+        make the next requests to the domain wait for a backoff.
+
+        :param url: str URL requested
+        :param reason: str one of FAILURE_REASONS
+        :return: float seconds of the backoff
+        """
+        with self.lock:
+            now = self.clock.now()
+            state = self._state(self.domain(url))
+            state.rate = max(self.min_rate, state.rate * self.decrease)
+            state.failures += 1
+            state.stats[reason] = state.stats.get(reason, 0) + 1
+            backoff = min(self.backoff_max,
+                          self.backoff_base * 2 ** (state.failures - 1))
+            backoff *= 1. + self.jitter * (2. * self.random.random() - 1.)
+            state.backoff_until = max(state.backoff_until, now + backoff)
+        METRICS.inc("throttled_total", domain=self.domain(url),
+                    reason=reason)
+        print("WARNING :: " + reason + " on " + self.domain(url) +
+              ", backing off for {:.1f} seconds".format(backoff))
+        return backoff
+
+    @staticmethod
+    def is_blocked(driver):
+        """
+        Check whether the driver has been sent to a captcha or login
+        wall instead of the requested page.
+
+        :param driver: selenium chrome driver object
+        :return: bool
+        """
+        current_url = (driver.current_url or "").lower()
+        return any(marker in current_url for marker in BLOCKED_URL_MARKERS)
+
+    def navigate(self, driver, url, wait=True):
+        """
+        Load a URL in the driver once allowed by the scheduler, and
+        record the outcome: a timeout or a captcha is a failure.
+        Raise TimeoutException in both cases.
+        Call with wait=False to start loading the URL in the current
+        tab through a script without waiting for it, in which case the
+        outcome has to be recorded by the caller.
+
+        :param driver: selenium chrome driver object
+        :param url: str URL to load
+        :param wait: bool wait for the page to load
+        :return: None
+        """
+        self.acquire(url)
+        if not wait:
+            driver.execute_script(NAVIGATE_SCRIPT, url)
+            return
+        try:
+            driver.get(url)
+        except TimeoutException:
+            self.failure(url, "timeout")
+            raise
+        self.check(driver, url)
+
+    def check(self, driver, url):
+        """
+        Record the outcome of a navigation to a URL from the page the
+        driver is showing. Raise TimeoutException if it is a captcha.
+
+        :param driver: selenium chrome driver object
+        :param url: str URL requested
+        :return: None
+        """
+        if self.is_blocked(driver):
+            self.failure(url, "captcha")
+            raise TimeoutException("Blocked by a captcha at " +
+                                   str(driver.current_url))
+        self.success(url)
+
+    def report(self):
+        """
+        Print the current rate, the requests, the time waited
+        and the failures of every domain.
+
+        :return: None
+        """
+        print("INFO :: Requests paced per domain")
+        print("{:<16} {:>8} {:>9} {:>10} {:>8} {:>8} {:>6}".format(
+            "domain", "req/s", "requests", "waited s", "timeout",
+            "captcha", "empty"))
+        with self.lock:
+            for domain, state in sorted(self.domains.items()):
+                print("{:<16} {:>8.2f} {:>9} {:>10.1f} {:>8} {:>8} "
+                      "{:>6}".format(
+                          domain, state.rate, state.stats["requests"],
+                          state.stats["waited"], state.stats["timeout"],
+                          state.stats["captcha"], state.stats["empty"]))
@@ -0,0 +1,299 @@
+"""
+A class to replay offline a browsing session recorded by SessionRecorder,
+by implementing the subset of the selenium driver API used by the scrapers
+
+"""
+from selenium.webdriver.common.by import By
+from selenium.common.exceptions import NoSuchElementException,\
+    WebDriverException
+from classes.SessionRecorder import SESSION_FILE, NAVIGATE_SCRIPT,\
+    OPEN_TAB_SCRIPT
+from urllib.parse import urljoin
+from lxml import html as lxml_html
+from time import sleep, monotonic
+import json
+import os
+
+
+# attributes of the driver that belong to its current tab
+TAB_STATE = ("visit", "observation", "script_calls", "current_url",
+             "ready_at")
+
+
+class ReplayElement(object):
+    def __init__(self, driver, node):
+        """
+        Initialize the class
+
+        :param driver: ReplayDriver object
+        :param node: lxml HtmlElement
+        """
+        self.driver = driver
+        self.node = node
+
+    @property
+    def text(self):
+        return " ".join(self.node.text_content().split())
+
+    @property
+    def tag_name(self):
+        return self.node.tag
+
+    def get_attribute(self, name):
+        value = self.node.get(name)
+        if value is not None and name in ("href", "src"):
+            value = urljoin(self.driver.current_url or "", value)
+        return value
+
+    def send_keys(self, *value):
+        pass
+
+    def click(self):
+        pass
+
+    def is_displayed(self):
+        return True
+
+    def find_element(self, by=By.ID, value=None):
+        return self.driver.find_element(by, value, root=self.node)
+
+    def find_elements(self, by=By.ID, value=None):
+        return self.driver.find_elements(by, value, root=self.node)
+
+
+class ReplayDriver(object):
+    def __init__(self, path, latency=0., script_latency=0.):
+        """
+        Initialize the class by loading the session recorded in the
+        given directory, or the sessions recorded in its subdirectories
+        by the drivers of a DriverPool.
+        Each get() serves the next recorded visit of the URL; within a
+        visit, page_source and find_element* calls serve the recorded
+        snapshots in order, and each script returns its recorded values
+        in order. The last snapshot and value are repeated once the
+        recorded ones have been used.
+        Tabs are opened with OPEN_TAB_SCRIPT and navigated with
+        NAVIGATE_SCRIPT, which does not wait: the latency of the tab
+        is waited by the first call that reads it, so that the latencies
+        of tabs loading at the same time overlap.
+
+        :param path: str path of the session directory
+        :param latency: float seconds waited by every get()
+        :param script_latency: float seconds waited by every script
+        """
+        self.path = path
+        self.latency = latency
+        self.script_latency = script_latency
+        visits = []
+        if os.path.exists(os.path.join(path, SESSION_FILE)):
+            session_dirs = [path]
+        else:
+            session_dirs = sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if os.path.exists(os.path.join(path, name, SESSION_FILE)))
+        for session_dir in session_dirs:
+            with open(os.path.join(session_dir, SESSION_FILE), 'r') as session:
+                for visit in json.load(session)["visits"]:
+                    visit["dir"] = session_dir
+                    visits.append(visit)
+        self.visits = {}
+        for visit in visits:
+            self.visits.setdefault(visit["url"], []).append(visit)
+        self.visit_counts = {}
+        self.visit = visits[0] if visits and visits[0]["url"] is None\
+            else {"url": None, "observations": [], "scripts": {}, "dir": path}
+        self.observation = 0
+        self.script_calls = {}
+        self.trees = {}
+        self.current_url = None
+        self.ready_at = 0.
+        self.current_window_handle = "replay-0"
+        self.window_handles = [self.current_window_handle]
+        self.tabs = {}
+        self.n_tabs = 1
+
+    def _load(self, url):
+        if url not in self.visits:
+            raise WebDriverException("No recorded visit for URL " + url)
+        count = self.visit_counts.get(url, 0)
+        self.visit_counts[url] = count + 1
+        visits = self.visits[url]
+        self.visit = visits[min(count, len(visits) - 1)]
+        self.observation = 0
+        self.script_calls = {}
+        self.current_url = url
+
+    def _wait_ready(self):
+        delay = self.ready_at - monotonic()
+        if delay > 0:
+            sleep(delay)
+
+    def get(self, url):
+        self._load(url)
+        sleep(self.latency)
+        self.ready_at = 0.
+
+    @property
+    def switch_to(self):
+        return ReplaySwitchTo(self)
+
+    def _switch_window(self, handle):
+        if handle not in self.window_handles:
+            raise WebDriverException("No such window: " + str(handle))
+        if self.current_window_handle in self.window_handles:
+            self.tabs[self.current_window_handle] = dict(
+                (name, getattr(self, name)) for name in TAB_STATE)
+        for name, value in self.tabs.pop(handle).items():
+            setattr(self, name, value)
+        self.current_window_handle = handle
+
+    def _open_tab(self):
+        handle = "replay-" + str(self.n_tabs)
+        self.n_tabs += 1
+        self.window_handles.append(handle)
+        self.tabs[handle] = {
+            "visit": {"url": None, "observations": [], "scripts": {},
+                      "dir": self.path},
+            "observation": 0, "script_calls": {}, "current_url": None,
+            "ready_at": 0.}
+
+    def close(self):
+        self.window_handles.remove(self.current_window_handle)
+
+    def refresh(self):
+        self.get(self.current_url)
+
+    def _snapshot(self):
+        """
+        Get the digest of the snapshot to serve next.
+
+        :return: str digest or None if the visit has no snapshots
+        """
+        self._wait_ready()
+        observations = self.visit["observations"]
+        if not observations:
+            return None
+        digest = observations[min(self.observation, len(observations) - 1)]
+        self.observation += 1
+        return digest
+
+    def _read(self, digest):
+        if digest is None:
+            return "<html><head></head><body></body></html>"
+        with open(os.path.join(self.visit["dir"], digest + ".html"), 'r',
+                  encoding='utf-8') as snapshot:
+            return snapshot.read()
+
+    def _tree(self):
+        digest = self._snapshot()
+        if digest not in self.trees:
+            self.trees = {digest: lxml_html.fromstring(self._read(digest))}
+        return self.trees[digest]
+
+    @property
+    def page_source(self):
+        return self._read(self._snapshot())
+
+    @property
+    def title(self):
+        titles = self._tree().xpath("//title")
+        return titles[0].text_content() if titles else ""
+
+    def execute_script(self, script, *args):
+        if script == NAVIGATE_SCRIPT:
+            self._load(args[0])
+            self.ready_at = monotonic() + self.latency
+            return None
+        if script == OPEN_TAB_SCRIPT:
+            self._open_tab()
+            return None
+        self._wait_ready()
+        sleep(self.script_latency)
+        values = self.visit["scripts"].get(script)
+        if not values:
+            return None
+        call = self.script_calls.get(script, 0)
+        self.script_calls[script] = call + 1
+        return values[min(call, len(values) - 1)]
+
+    def execute_async_script(self, script, *args):
+        return self.execute_script(script, *args)
+
+    def set_script_timeout(self, time_to_wait):
+        pass
+
+    def find_elements(self, by=By.ID, value=None, root=None):
+        if root is None:
+            root = self._tree()
+        if by == By.ID:
+            nodes = root.xpath(".//*[@id=$value]", value=value)
+        elif by == By.NAME:
+            nodes = root.xpath(".//*[@name=$value]", value=value)
+        elif by == By.XPATH:
+            nodes = root.xpath(value)
+        elif by == By.TAG_NAME:
+            nodes = root.xpath(".//" + value)
+        elif by == By.CLASS_NAME:
+            nodes = root.xpath(
+                ".//*[contains(concat(' ', normalize-space(@class), ' '), " +
+                "$value)]", value=" " + value + " ")
+        elif by == By.CSS_SELECTOR:
+            nodes = root.cssselect(value)
+        elif by == By.LINK_TEXT:
+            nodes = root.xpath(".//a[normalize-space(.)=$value]",
+                               value=value)
+        elif by == By.PARTIAL_LINK_TEXT:
+            nodes = root.xpath(".//a[contains(., $value)]", value=value)
+        else:
+            raise WebDriverException("Unsupported locator: " + str(by))
+        return [ReplayElement(self, node) for node in nodes]
+
+    def find_element(self, by=By.ID, value=None, root=None):
+        elements = self.find_elements(by, value, root)
+        if not elements:
+            raise NoSuchElementException(
+                "Unable to locate element: " + str(value))
+        return elements[0]
+
+    def find_element_by_id(self, id_):
+        return self.find_element(By.ID, id_)
+
+    def find_element_by_name(self, name):
+        return self.find_element(By.NAME, name)
+
+    def find_element_by_xpath(self, xpath):
+        return self.find_element(By.XPATH, xpath)
+
+    def find_element_by_tag_name(self, name):
+        return self.find_element(By.TAG_NAME, name)
+
+    def find_element_by_class_name(self, name):
+        return self.find_element(By.CLASS_NAME, name)
+
+    def find_element_by_css_selector(self, css_selector):
+        return self.find_element(By.CSS_SELECTOR, css_selector)
+
+    def find_elements_by_class_name(self, name):
+        return self.find_elements(By.CLASS_NAME, name)
+
+    def find_elements_by_css_selector(self, css_selector):
+        return self.find_elements(By.CSS_SELECTOR, css_selector)
+
+    def get_cookies(self):
+        return []
+
+    def quit(self):
+        self.trees = {}
+
+
+class ReplaySwitchTo(object):
+    def __init__(self, driver):
+        """
+        Initialize the class
+
+        :param driver: ReplayDriver object
+        """
+        self.driver = driver
+
+    def window(self, window_name):
+        self.driver._switch_window(window_name)
@@ -0,0 +1,262 @@
+"""
+A class to keep on disk the IDs of the LinkedIn pages already scraped,
+whatever the form of the URLs they have been found under, in front of a
+Bloom filter answering for most of the new URLs without reading the
+database, so that a URL is checked before it enters the frontier or the
+work queue
+
+"""
+from classes.Metrics import METRICS
+from utils import canonical_id
+from threading import Lock
+from time import time
+from hashlib import blake2b
+import math
+import sqlite3
+
+
+class BloomFilter(object):
+    def __init__(self, capacity, error_rate=0.01, bits=None, count=0):
+        """
+        Initialize the class with the number of bits and of hashes giving
+        the error rate once capacity keys have been added.
+
+        :param capacity: int number of keys expected
+        :param error_rate: float share of the keys never added
+            reported as added once the capacity is reached
+        :param bits: bytes of a saved filter, empty if not given
+        :param count: int number of keys added to the saved filter
+        """
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.n_bits = max(int(math.ceil(
+            -self.capacity * math.log(error_rate) / math.log(2) ** 2)), 8)
+        self.n_hashes = max(int(round(self.n_bits / self.capacity *
+                                      math.log(2))), 1)
+        n_bytes = (self.n_bits + 7) // 8
+        if bits is not None and len(bits) != n_bytes:
+            raise ValueError("Saved Bloom filter of " + str(len(bits)) +
+                             " bytes instead of " + str(n_bytes))
+        self.bits = bytearray(bits) if bits is not None\
+            else bytearray(n_bytes)
+        self.count = count
+
+    def _positions(self, key):
+        digest = blake2b(key.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.n_bits
+                for i in range(self.n_hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+    def is_full(self):
+        return self.count > self.capacity
+
+
+class SeenIndex(object):
+    def __init__(self, path, capacity=1000000, error_rate=0.01):
+        """
+        Initialize the class by opening, or creating, the database of
+        the IDs and loading the Bloom filter saved with them. The filter
+        is built again from the IDs if it has not been saved by the last
+        run, and with twice the capacity once it holds more IDs than it
+        has been sized for.
+
+        The database holds three tables:
+            ids: kind of page and ID returned by canonical_id
+            bloom: bits of the filter, its capacity and error rate, and
+                the number of IDs it holds
+            backfills: storages whose URLs have all been recorded,
+                with the time of the backfill
+        The filter takes about 1.2 bytes per ID of capacity for an error
+        rate of 1%.
+
+        :param path: str path of the SQLite database file
+        :param capacity: int number of IDs the filter is sized for
+        :param error_rate: float share of the unseen IDs the filter
+            sends to the database
+        """
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS ids (kind TEXT NOT NULL, " +
+                "id TEXT NOT NULL, PRIMARY KEY (kind, id)) WITHOUT ROWID")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS bloom (" +
+                "name TEXT PRIMARY KEY, capacity INTEGER NOT NULL, " +
+                "error_rate REAL NOT NULL, count INTEGER NOT NULL, " +
+                "bits BLOB NOT NULL)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS backfills (" +
+                "name TEXT PRIMARY KEY, backfilled_at REAL NOT NULL)")
+        self.filter = self._load_filter(capacity, error_rate)
+        self.lookups = {"passed": 0, "seen": 0, "false_positive": 0}
+
+    def _count(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM ids").fetchone()[0]
+
+    def _load_filter(self, capacity, error_rate):
+        """
+        Load the saved Bloom filter if it holds every ID of the
+        database, otherwise build it again from the IDs.
+
+        :param capacity: int number of IDs the filter is sized for
+        :param error_rate: float
+        :return: BloomFilter object
+        """
+        count = self._count()
+        row = self.connection.execute(
+            "SELECT capacity, error_rate, count, bits FROM bloom " +
+            "WHERE name = 'ids'").fetchone()
+        if row is not None and row[2] == count and row[0] >= count and\
+           row[0] >= capacity and row[1] == error_rate:
+            return BloomFilter(row[0], row[1], row[3], row[2])
+        return self._build_filter(max(capacity, 2 * count), error_rate)
+
+    def _build_filter(self, capacity, error_rate):
+        bloom = BloomFilter(capacity, error_rate)
+        for kind, page_id in self.connection.execute(
+                "SELECT kind, id FROM ids"):
+            bloom.add(kind + ":" + page_id)
+        print("INFO :: Seen index filter built for " + str(bloom.count) +
+              " ID(s), sized for " + str(bloom.capacity))
+        return bloom
+
+    def add(self, urls):
+        """
+        Record the IDs of scraped URLs, the URLs that are not the ones
+        of a profile or a job offer being left out.
+
+        :param urls: list of URLs
+        :return: int number of IDs that were not recorded yet
+        """
+        keys = set(key for key in map(canonical_id, urls) if key is not None)
+        n_added = 0
+        with self.lock:
+            with self.connection:
+                for key in sorted(keys):
+                    if self.connection.execute(
+                            "INSERT OR IGNORE INTO ids VALUES (?, ?)",
+                            key).rowcount:
+                        self.filter.add(key[0] + ":" + key[1])
+                        n_added += 1
+            if self.filter.is_full():
+                self.filter = self._build_filter(2 * self.filter.capacity,
+                                                 self.filter.error_rate)
+        return n_added
+
+    def backfill(self, storage, name, batch_size=10000):
+        """
+        Record the IDs of every URL of a storage the first time the index
+        is opened with it, so that the records stored before the index
+        existed, under any form of their URL, are not scraped again.
+
+        :param storage: Storage object
+        :param name: str name of the storage, e.g. "users"
+        :param batch_size: int URLs recorded at once
+        :return: int number of IDs recorded, 0 if already backfilled
+        """
+        with self.lock:
+            if self.connection.execute(
+                    "SELECT 1 FROM backfills WHERE name = ?",
+                    (name,)).fetchone() is not None:
+                return 0
+        n_added = 0
+        batch = []
+        for url in storage.iter_urls():
+            batch.append(url)
+            if len(batch) >= batch_size:
+                n_added += self.add(batch)
+                batch = []
+        n_added += self.add(batch)
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO backfills VALUES (?, ?)",
+                    (name, time()))
+        print("INFO :: Seen index backfilled with " + str(n_added) +
+              " ID(s) of the " + name + " storage")
+        return n_added
+
+    def get_unseen_urls(self, urls):
+        """
+        Keep the URLs whose ID has not been recorded and which do not
+        point to the same page as a URL before them, in the order they
+        have been given. Only the IDs the filter may hold are looked up
+        in the database. The URLs without an ID are all kept.
+
+        :param urls: list of URLs
+        :return: list of unseen URLs
+        """
+        unseen_urls = []
+        candidates = {}
+        keys = set()
+        for url in urls:
+            key = canonical_id(url)
+            if key is None:
+                unseen_urls.append(url)
+                continue
+            if key in keys:
+                continue
+            keys.add(key)
+            unseen_urls.append(url)
+            if key[0] + ":" + key[1] in self.filter:
+                candidates[url] = key
+        seen = set()
+        with self.lock:
+            for url, key in candidates.items():
+                if self.connection.execute(
+                        "SELECT 1 FROM ids WHERE kind = ? AND id = ?",
+                        key).fetchone() is not None:
+                    seen.add(url)
+        results = {"passed": len(keys) - len(candidates),
+                   "seen": len(seen),
+                   "false_positive": len(candidates) - len(seen)}
+        for result, count in results.items():
+            self.lookups[result] += count
+            if count:
+                METRICS.inc("seen_index_lookups_total", count, result=result)
+        return [url for url in unseen_urls if url not in seen]
+
+    def report(self):
+        """
+        Print the number of IDs recorded and how the URLs checked
+        have been answered: passed as new by the filter alone, seen
+        in the database, or let through by the database after a
+        false positive of the filter.
+
+        :return: None
+        """
+        with self.lock:
+            count = self._count()
+        print("INFO :: Seen index: " + str(count) + " ID(s), " +
+              "{} URL(s) passed the Bloom filter, {} seen, "
+              "{} false positive(s)".format(
+                  self.lookups["passed"], self.lookups["seen"],
+                  self.lookups["false_positive"]))
+
+    def close(self):
+        """
+        Save the Bloom filter next to the IDs and close the database.
+
+        :return: None
+        """
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO bloom VALUES ('ids', ?, ?, ?, ?)",
+                    (self.filter.capacity, self.filter.error_rate,
+                     self._count(), bytes(self.filter.bits)))
+            self.connection.close()
@@ -0,0 +1,201 @@
+"""
+A class to record a browsing session of a selenium driver
+so that it can be replayed offline by ReplayDriver
+
+"""
+from selenium.common.exceptions import WebDriverException
+import hashlib
+import json
+import os
+
+
+SESSION_FILE = "session.json"
+# start loading a URL in the current tab without waiting for it to load,
+# marking the current document as stale until the new one replaces it
+NAVIGATE_SCRIPT = ("document.__scraperStale = true;" +
+                   "window.location.href = arguments[0];")
+# open a new blank tab
+OPEN_TAB_SCRIPT = "window.open('about:blank', '_blank');"
+
+
+def to_json_value(value):
+    """
+    Return the value if it can be stored in JSON, None otherwise,
+    e.g. when a script returns a web element.
+
+    :param value: value returned by a script
+    :return: value or None
+    """
+    try:
+        json.dumps(value)
+        return value
+    except (TypeError, ValueError):
+        return None
+
+
+class SessionRecorder(object):
+    def __init__(self, driver, path):
+        """
+        Initialize the class.
+        Every attribute not defined here is taken from the wrapped driver.
+
+        A session is a directory containing the HTML snapshots, named
+        after the SHA-1 of their content, and a session.json file
+        with the list of the visits. Each visit holds the URL passed to
+        get(), the snapshots observed by page_source and find_element*
+        calls in order, and the values returned by each script in order.
+        Each tab has its own current visit; a visit is also started
+        when a tab is navigated with NAVIGATE_SCRIPT.
+
+        :param driver: selenium chrome driver object
+        :param path: str path of the session directory
+        """
+        self.driver = driver
+        self.path = path
+        self.visits = []
+        self.tab_visits = {}
+        self.window_handle = None
+        os.makedirs(path, exist_ok=True)
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+    def _visit(self):
+        if self.window_handle in self.tab_visits:
+            return self.tab_visits[self.window_handle]
+        if not self.visits:
+            self._start_visit(None)
+        return self.visits[-1]
+
+    def _start_visit(self, url):
+        visit = {"url": url, "observations": [], "scripts": {}}
+        self.visits.append(visit)
+        self.tab_visits[self.window_handle] = visit
+
+    def _observe(self):
+        """
+        Store a snapshot of the current page and append it to
+        the observations of the current visit.
+
+        :return: str HTML code of the page
+        """
+        page_source = self.driver.page_source
+        digest = hashlib.sha1(page_source.encode('utf-8')).hexdigest()
+        snapshot_path = os.path.join(self.path, digest + ".html")
+        if not os.path.exists(snapshot_path):
+            with open(snapshot_path, 'w', encoding='utf-8') as snapshot:
+                snapshot.write(page_source)
+        self._visit()["observations"].append(digest)
+        return page_source
+
+    def save(self):
+        """
+        Write the list of the visits to the session file.
+
+        :return: None
+        """
+        with open(os.path.join(self.path, SESSION_FILE), 'w') as session:
+            json.dump({"visits": self.visits}, session, indent=1)
+
+    def get(self, url):
+        self._start_visit(url)
+        self.driver.get(url)
+        self.save()
+
+    @property
+    def switch_to(self):
+        return RecorderSwitchTo(self)
+
+    @property
+    def page_source(self):
+        return self._observe()
+
+    def _record_script(self, method, script, *args):
+        try:
+            value = method(script, *args)
+        except WebDriverException:
+            self._visit()["scripts"].setdefault(script, []).append(None)
+            raise
+        self._visit()["scripts"].setdefault(script, []).append(
+            to_json_value(value))
+        return value
+
+    def execute_script(self, script, *args):
+        if script == NAVIGATE_SCRIPT:
+            self._start_visit(args[0])
+            self.save()
+            return self.driver.execute_script(script, *args)
+        return self._record_script(self.driver.execute_script, script, *args)
+
+    def execute_async_script(self, script, *args):
+        return self._record_script(self.driver.execute_async_script,
+                                   script, *args)
+
+    def find_element(self, by, value=None):
+        self._observe()
+        return self.driver.find_element(by, value)
+
+    def find_elements(self, by, value=None):
+        self._observe()
+        return self.driver.find_elements(by, value)
+
+    def find_element_by_id(self, id_):
+        self._observe()
+        return self.driver.find_element_by_id(id_)
+
+    def find_element_by_name(self, name):
+        self._observe()
+        return self.driver.find_element_by_name(name)
+
+    def find_element_by_xpath(self, xpath):
+        self._observe()
+        return self.driver.find_element_by_xpath(xpath)
+
+    def find_element_by_tag_name(self, name):
+        self._observe()
+        return self.driver.find_element_by_tag_name(name)
+
+    def find_element_by_class_name(self, name):
+        self._observe()
+        return self.driver.find_element_by_class_name(name)
+
+    def find_element_by_css_selector(self, css_selector):
+        self._observe()
+        return self.driver.find_element_by_css_selector(css_selector)
+
+    def find_elements_by_class_name(self, name):
+        self._observe()
+        return self.driver.find_elements_by_class_name(name)
+
+    def find_elements_by_css_selector(self, css_selector):
+        self._observe()
+        return self.driver.find_elements_by_css_selector(css_selector)
+
+    def quit(self):
+        self.save()
+        self.driver.quit()
+
+
+class RecorderSwitchTo(object):
+    def __init__(self, recorder):
+        """
+        Initialize the class, wrapping the switch_to object of the
+        driver to keep track of the current tab of the recorder.
+
+        :param recorder: SessionRecorder object
+        """
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self.recorder.driver.switch_to, name)
+
+    def window(self, window_name):
+        recorder = self.recorder
+        if recorder.window_handle is None:
+            # the first tab is known by its handle from now on
+            recorder.window_handle = recorder.driver.current_window_handle
+            if None in recorder.tab_visits:
+                recorder.tab_visits[recorder.window_handle] =\
+                    recorder.tab_visits.pop(None)
+        recorder.driver.switch_to.window(window_name)
+        recorder.window_handle = window_name
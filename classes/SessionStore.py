@@ -0,0 +1,178 @@
+"""
+A class to save the authenticated LinkedIn session of a driver, i.e. its
+cookies and local storage, to disk and to restore it in new drivers, so
+that a run logs in only when no valid session has been saved
+
+"""
+from selenium.common.exceptions import WebDriverException,\
+    TimeoutException
+from classes.Metrics import METRICS
+from utils import login
+from threading import Lock
+from time import time
+import json
+import os
+
+
+HOME_URL = "https://www.linkedin.com"
+# page only shown to a logged-in user, used to check a session
+FEED_URL = "https://www.linkedin.com/feed/"
+# parts of the URL a logged-out user is redirected to
+LOGGED_OUT_URL_MARKERS = ("/login", "/uas/", "/authwall", "/checkpoint/")
+GET_LOCAL_STORAGE_SCRIPT = """
+var items = {};
+for (var i = 0; i < window.localStorage.length; i++) {
+    var key = window.localStorage.key(i);
+    items[key] = window.localStorage.getItem(key);
+}
+return items;
+"""
+SET_LOCAL_STORAGE_SCRIPT = """
+var items = arguments[0];
+for (var key in items) { window.localStorage.setItem(key, items[key]); }
+"""
+
+
+class SessionStore(object):
+    def __init__(self, path, max_age=7 * 86400., scheduler=None):
+        """
+        Initialize the class
+
+        :param path: str path of the JSON file holding the session
+        :param max_age: float seconds after which a saved session
+            is not restored any more
+        :param scheduler: RateScheduler object pacing the navigations,
+            none if not given
+        """
+        self.path = path
+        self.max_age = max_age
+        self.scheduler = scheduler
+        self.lock = Lock()
+
+    def _get(self, driver, url):
+        if self.scheduler is not None:
+            self.scheduler.acquire(url)
+        driver.get(url)
+
+    def load(self):
+        """
+        Read the saved session, if any and not older than max_age.
+
+        :return: dict with the "cookies", "local_storage" and
+            "saved_at" of the session, None if there is none
+        """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as session_file:
+                session = json.load(session_file)
+        except (OSError, ValueError):
+            return None
+        if time() - session.get("saved_at", 0) > self.max_age:
+            return None
+        return session
+
+    def save(self, driver):
+        """
+        Save the cookies and the local storage of a logged-in driver,
+        readable by the current user only.
+
+        :param driver: selenium chrome driver object on a LinkedIn page
+        :return: None
+        """
+        session = {"saved_at": time(),
+                   "cookies": driver.get_cookies(),
+                   "local_storage": driver.execute_script(
+                       GET_LOCAL_STORAGE_SCRIPT) or {}}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        descriptor = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                             0o600)
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as session_file:
+            json.dump(session, session_file)
+        os.replace(tmp_path, self.path)
+
+    def restore(self, driver, session):
+        """
+        Load the cookies and the local storage of a saved session into
+        a driver. The cookies already expired and the ones the browser
+        refuses are left out.
+
+        :param driver: selenium chrome driver object
+        :param session: dict returned by load()
+        :return: None
+        """
+        self._get(driver, HOME_URL)
+        now = time()
+        for cookie in session["cookies"]:
+            cookie = dict(cookie)
+            if "expiry" in cookie:
+                if cookie["expiry"] < now:
+                    continue
+                cookie["expiry"] = int(cookie["expiry"])
+            if cookie.get("sameSite") not in ("Strict", "Lax", "None"):
+                cookie.pop("sameSite", None)
+            try:
+                driver.add_cookie(cookie)
+            except WebDriverException:
+                continue
+        if session["local_storage"]:
+            driver.execute_script(SET_LOCAL_STORAGE_SCRIPT,
+                                  session["local_storage"])
+
+    def is_logged_in(self, driver):
+        """
+        Check whether the driver is logged in by loading the feed,
+        which redirects a logged-out user to a login page.
+
+        :param driver: selenium chrome driver object
+        :return: bool
+        """
+        try:
+            self._get(driver, FEED_URL)
+        except TimeoutException:
+            return False
+        current_url = (driver.current_url or "").lower()
+        return "linkedin.com" in current_url and not any(
+            marker in current_url for marker in LOGGED_OUT_URL_MARKERS)
+
+    def _try_restore(self, driver, session):
+        if session is None:
+            return False
+        self.restore(driver, session)
+        return self.is_logged_in(driver)
+
+    def ensure_login(self, driver, user, pwd):
+        """
+        Log a driver in by restoring the saved session if it is still
+        valid, otherwise by typing the credentials, then save the new
+        session. One driver at a time types the credentials: a driver
+        that has waited for another one tries the session the other
+        one has just saved before typing them.
+
+        :param driver: selenium chrome driver object
+        :param user: str username, email
+        :param pwd: str password
+        :return: bool the driver is logged in
+        """
+        session = self.load()
+        if self._try_restore(driver, session):
+            METRICS.inc("logins_total", outcome="restored")
+            return True
+        with self.lock:
+            saved = self.load()
+            if saved is not None and (session is None or saved["saved_at"] !=
+                                      session["saved_at"]) and\
+               self._try_restore(driver, saved):
+                METRICS.inc("logins_total", outcome="restored")
+                return True
+            print("INFO :: No valid saved session, logging in")
+            self._get(driver, HOME_URL)
+            login(driver, user, pwd)
+            if not self.is_logged_in(driver):
+                METRICS.inc("logins_total", outcome="failed")
+                print("WARNING :: Could not log in, LinkedIn might be " +
+                      "asking for a verification")
+                return False
+            self.save(driver)
+            METRICS.inc("logins_total", outcome="logged_in")
+        return True
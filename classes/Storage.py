@@ -0,0 +1,397 @@
+"""
+Classes to store the scraped records in Mongo DB or in local files,
+behind the same interface used by BulkWriter and get_unseen_urls()
+
+"""
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError, AutoReconnect
+from utils import connect_mongo, ensure_url_index, create_nonexistent_dir
+from threading import Lock
+from time import sleep
+from abc import ABC, abstractmethod
+import json
+import os
+import sqlite3
+
+
+STORAGE_BACKENDS = ("mongo", "sqlite", "jsonl", "parquet")
+
+
+class Storage(ABC):
+    """
+    Interface of the storage backends.
+    Records are dictionaries identified by their "URL" key; writing a
+    record whose URL is already stored replaces the stored one.
+    """
+
+    @abstractmethod
+    def write_batch(self, records):
+        """
+        Write a batch of records with distinct URLs.
+        Return how many of them were new, how many replaced a stored
+        record, and how many could not be written, with their URLs.
+
+        :param records: list of dict records
+        :return: dict with the keys "upserted", "modified", "errors"
+            and "failed_urls", the list of the URLs not written
+        """
+
+    @abstractmethod
+    def get_seen_urls(self, urls):
+        """
+        Get the given URLs that are already stored.
+
+        :param urls: list of str URLs
+        :return: set of str URLs
+        """
+
+    @abstractmethod
+    def iter_urls(self):
+        """
+        Iterate over the URLs of all the stored records.
+
+        :return: iterable of str URLs
+        """
+
+    def close(self):
+        """
+        Release the resources of the backend.
+
+        :return: None
+        """
+        pass
+
+
+class MongoStorage(Storage):
+    def __init__(self, collection, batch_size=1000, max_retries=3):
+        """
+        Initialize the class and make sure the collection has an index
+        on "URL".
+
+        :param collection: Mongo DB collection
+        :param batch_size: int number of URLs per lookup query
+        :param max_retries: int attempts of a bulk write on
+            connection errors
+        """
+        self.collection = collection
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        ensure_url_index(collection)
+
+    def write_batch(self, records):
+        requests = [ReplaceOne({"URL": record["URL"]}, record, upsert=True)
+                    for record in records]
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                details = self.collection.bulk_write(
+                    requests, ordered=False).bulk_api_result
+                break
+            except BulkWriteError as e:
+                details = e.details
+                print("ERROR :: " + str(len(details["writeErrors"])) +
+                      " record(s) of a bulk write failed: " +
+                      str(details["writeErrors"][0]["errmsg"]))
+                break
+            except AutoReconnect:
+                if attempt == self.max_retries:
+                    raise
+                sleep(2 ** attempt)
+        # the index of a write error is the one of its record
+        failed_urls = [records[error["index"]]["URL"]
+                       for error in details.get("writeErrors", [])]
+        return {"upserted": details.get("nUpserted", 0),
+                "modified": details.get("nModified", 0),
+                "errors": len(failed_urls), "failed_urls": failed_urls}
+
+    def get_seen_urls(self, urls):
+        seen_urls = set()
+        for i in range(0, len(urls), self.batch_size):
+            batch = urls[i:i + self.batch_size]
+            seen_urls.update(
+                entry["URL"] for entry in self.collection.find(
+                    {"URL": {"$in": batch}}, {"URL": 1, "_id": 0}))
+        return seen_urls
+
+    def iter_urls(self):
+        for entry in self.collection.find({}, {"URL": 1, "_id": 0},
+                                          batch_size=self.batch_size):
+            if "URL" in entry:
+                yield entry["URL"]
+
+
+class SQLiteStorage(Storage):
+    def __init__(self, path, table, batch_size=500):
+        """
+        Initialize the class by opening the database file and creating
+        the table, with the URL as primary key, if it does not exist.
+        Each record is stored as JSON next to its URL.
+
+        :param path: str path of the SQLite database file
+        :param table: str name of the table, e.g. "users"
+        :param batch_size: int number of URLs per lookup query,
+            below the SQLite limit on query parameters
+        """
+        self.table = table
+        self.batch_size = batch_size
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS " + table +
+            " (URL TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self.connection.commit()
+
+    def _seen(self, urls):
+        seen_urls = set()
+        for i in range(0, len(urls), self.batch_size):
+            batch = urls[i:i + self.batch_size]
+            rows = self.connection.execute(
+                "SELECT URL FROM " + self.table + " WHERE URL IN (" +
+                ",".join("?" * len(batch)) + ")", batch)
+            seen_urls.update(row[0] for row in rows)
+        return seen_urls
+
+    def write_batch(self, records):
+        with self.lock:
+            seen_urls = self._seen([record["URL"] for record in records])
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO " + self.table +
+                    " (URL, data) VALUES (?, ?)",
+                    [(record["URL"], json.dumps(record, ensure_ascii=False))
+                     for record in records])
+        return {"upserted": len(records) - len(seen_urls),
+                "modified": len(seen_urls), "errors": 0,
+                "failed_urls": []}
+
+    def get_seen_urls(self, urls):
+        with self.lock:
+            return self._seen(urls)
+
+    def iter_urls(self):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT URL FROM " + self.table).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class JSONLStorage(Storage):
+    def __init__(self, path):
+        """
+        Initialize the class by reading the URLs already in the file.
+        Records are appended to the file, one JSON document per line;
+        a record replacing a stored one is appended too, so the last
+        line with a given URL is the current record.
+
+        :param path: str path of the JSON-lines file
+        """
+        self.lock = Lock()
+        self.seen_urls = set()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as jsonl_file:
+                for line in jsonl_file:
+                    if line.strip():
+                        self.seen_urls.add(json.loads(line)["URL"])
+        self.jsonl_file = open(path, 'a', encoding='utf-8')
+
+    def write_batch(self, records):
+        lines = "".join(json.dumps(record, ensure_ascii=False) + "\n"
+                        for record in records)
+        with self.lock:
+            modified = sum(record["URL"] in self.seen_urls
+                           for record in records)
+            self.jsonl_file.write(lines)
+            self.jsonl_file.flush()
+            self.seen_urls.update(record["URL"] for record in records)
+        return {"upserted": len(records) - modified, "modified": modified,
+                "errors": 0, "failed_urls": []}
+
+    def get_seen_urls(self, urls):
+        with self.lock:
+            return self.seen_urls.intersection(urls)
+
+    def iter_urls(self):
+        with self.lock:
+            return list(self.seen_urls)
+
+    def close(self):
+        with self.lock:
+            self.jsonl_file.close()
+
+
+class ParquetStorage(Storage):
+    def __init__(self, path):
+        """
+        Initialize the class by reading the URLs already stored in the
+        directory. Every batch is written as a new Parquet file of the
+        directory, complete on disk before the batch is reported as
+        written, so the directory can be read as a single dataset at
+        any time; a record replacing a stored one is written too, so
+        the one in the most recent file is the current record.
+        The files of a run are compacted into one when it is closed.
+        Needs the optional pyarrow package.
+
+        :param path: str path of the directory of the Parquet files
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("The parquet storage backend needs pyarrow: " +
+                              "pip install pyarrow")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.lock = Lock()
+        create_nonexistent_dir(path)
+        self.seen_urls = set()
+        self.next_part = 0
+        for name in sorted(os.listdir(path)):
+            if name.endswith(".tmp"):
+                # file being written by a run that has been killed
+                os.remove(os.path.join(path, name))
+            elif name.endswith(".parquet"):
+                table = self.pq.read_table(os.path.join(path, name),
+                                           columns=["URL"])
+                self.seen_urls.update(table.column("URL").to_pylist())
+                if name.startswith("part-") and name[5:-8].isdigit():
+                    self.next_part = max(self.next_part,
+                                         int(name[5:-8]) + 1)
+        # files written by this run, compacted by close()
+        self.parts = []
+
+    def _to_table(self, records):
+        """
+        Convert the records to a table, typing as strings the columns
+        whose values are all empty in this batch.
+
+        :param records: list of dict records
+        :return: pyarrow Table
+        """
+        table = self.pa.Table.from_pylist(records)
+        fields = []
+        for field in table.schema:
+            if self.pa.types.is_null(field.type):
+                field = field.with_type(self.pa.string())
+            elif self.pa.types.is_list(field.type) and\
+                    self.pa.types.is_null(field.type.value_type):
+                field = field.with_type(self.pa.list_(self.pa.string()))
+            fields.append(field)
+        return table.cast(self.pa.schema(fields))
+
+    def _write_part(self, table):
+        """
+        Write a table to a new file of the directory, under a hidden
+        name until it is complete.
+
+        :param table: pyarrow Table
+        :return: str name of the file
+        """
+        name = "part-{:06d}.parquet".format(self.next_part)
+        self.next_part += 1
+        path = os.path.join(self.path, name)
+        self.pq.write_table(table, os.path.join(self.path,
+                                                "." + name + ".tmp"))
+        os.replace(os.path.join(self.path, "." + name + ".tmp"), path)
+        return name
+
+    def _compact(self):
+        """
+        Merge the files written by this run into a single file, the
+        records keeping their order. The files are left as they are if
+        a column has different types in two of them.
+
+        :return: None
+        """
+        tables = [self.pq.read_table(os.path.join(self.path, name))
+                  for name in self.parts]
+        names = list(dict.fromkeys(
+            name for table in tables for name in table.column_names))
+        try:
+            # the columns whose values are all empty in a file take the
+            # type they have in the other files
+            schema = self.pa.unify_schemas([
+                self.pa.schema([field for field in table.schema
+                                if table.column(field.name).null_count <
+                                table.num_rows])
+                for table in tables])
+            schema = self.pa.schema([
+                schema.field(name) if name in schema.names
+                else self.pa.field(name, self.pa.string())
+                for name in names])
+            table = self.pa.concat_tables([
+                self.pa.Table.from_arrays(
+                    [table.column(field.name)
+                     if field.name in table.column_names and
+                     table.column(field.name).null_count < table.num_rows
+                     else self.pa.nulls(table.num_rows, field.type)
+                     for field in schema],
+                    names=schema.names).cast(schema)
+                for table in tables])
+        except (self.pa.ArrowInvalid, self.pa.ArrowTypeError,
+                self.pa.ArrowNotImplementedError) as e:
+            print("WARNING :: Could not compact the Parquet files " +
+                  "of the run: " + str(e))
+            return
+        name = self._write_part(table)
+        for part in self.parts:
+            os.remove(os.path.join(self.path, part))
+        self.parts = [name]
+
+    def write_batch(self, records):
+        table = self._to_table(records)
+        with self.lock:
+            self.parts.append(self._write_part(table))
+            modified = sum(record["URL"] in self.seen_urls
+                           for record in records)
+            self.seen_urls.update(record["URL"] for record in records)
+        return {"upserted": len(records) - modified, "modified": modified,
+                "errors": 0, "failed_urls": []}
+
+    def get_seen_urls(self, urls):
+        with self.lock:
+            return self.seen_urls.intersection(urls)
+
+    def iter_urls(self):
+        with self.lock:
+            return list(self.seen_urls)
+
+    def close(self):
+        with self.lock:
+            if len(self.parts) > 1:
+                self._compact()
+
+
+def open_storage(parameters, credentials, name):
+    """
+    Open the storage backend chosen by the "STORAGE" parameter of the
+    config file for the given kind of records, e.g. "users" or "jobs".
+    "STORAGE" holds the "BACKEND", one of STORAGE_BACKENDS, and for the
+    local backends the "PATH" of the directory of the files.
+
+    :param parameters: dict "parameters" of the config file
+    :param credentials: dict "credentials" of the config file
+    :param name: str name of the collection, table or file
+    :return: Storage object
+    """
+    storage_conf = parameters.get("STORAGE", {})
+    backend = storage_conf.get("BACKEND", "mongo")
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError("Unknown storage backend: " + str(backend) +
+                         ". Choose one of " + ", ".join(STORAGE_BACKENDS))
+    if backend == "mongo":
+        client = connect_mongo(parameters["HOST"], credentials["MONGOUSER"],
+                               credentials["MONGOPWD"])
+        return MongoStorage(client["linkedin"][name])
+    path = storage_conf.get("PATH", "./data/")
+    create_nonexistent_dir(path)
+    if backend == "sqlite":
+        return SQLiteStorage(os.path.join(path, "linkedin.sqlite"), name)
+    if backend == "jsonl":
+        return JSONLStorage(os.path.join(path, name + ".jsonl"))
+    return ParquetStorage(os.path.join(path, name))
@@ -2,22 +2,64 @@
 A class to define the methods to scrape LinkedIn user-profile webpages
 
 """
-from selenium.webdriver.common.keys import Keys
 from selenium.common.exceptions import TimeoutException
-from utils import validate_field, scroll_profile_page, is_button_found,\
-    validate_user_data, filter_non_printable
-from time import sleep
-from bs4 import BeautifulSoup as bs
+from utils import validate_field, scroll_profile_page, scroll_until_stable,\
+    validate_user_data, filter_non_printable, make_soup, record_transfer,\
+    SKILLS_BUTTON_XPATH, EXTRACTION_MODES
+from time import perf_counter
+from classes.FieldExtractor import FieldExtractor
+from classes.Metrics import METRICS
+from classes.RateScheduler import RateScheduler
+from classes.Waiter import Waiter
+
+
+PROFILE_RULES = [
+    {"field": "name", "class": "pv-top-card-section__name"},
+    {"field": "job_title", "class": "pv-top-card-section__headline",
+     "clean": filter_non_printable},
+    {"field": "location", "class": "pv-top-card-section__location"},
+    {"field": "degree", "class": "pv-entity__degree-name",
+     "text": "line", "line": 2, "clean": validate_field},
+    {"field": "languages", "class": "pv-accomplishments-block__list-container",
+     "id": "languages-expandable-content", "text": "items"},
+    {"field": "skills", "class": "pv-skill-category-entity__name-text",
+     "many": True, "clean": validate_field}
+]
+PROFILE_EXTRACTOR = FieldExtractor(PROFILE_RULES)
 
 
 class UserScraper(object):
-    def __init__(self, driver):
+    def __init__(self, driver, parser="html.parser", waiter=None,
+                 extraction="soup", archive=None, scheduler=None):
         """
         Initialize the class
 
         :param driver: selenium chrome driver object
+        :param parser: str parser backend used by make_soup()
+        :param waiter: Waiter object, one with the default
+            deadlines if not given
+        :param extraction: str "soup" to parse the page source,
+            "in_page" to run the extraction rules inside the browser,
+            "compare" to do both and keep the "soup" result
+        :param archive: PageArchive object where the page sources are
+            archived, none if not given; in the "in_page" mode, it
+            makes the whole page source be transferred on top of the
+            fields, which is counted in the "in_page" statistics
+        :param scheduler: RateScheduler object pacing the navigations,
+            one with the default rates if not given
         """
+        if extraction not in EXTRACTION_MODES:
+            raise ValueError("Unknown extraction mode " + repr(extraction) +
+                             ", expected one of " +
+                             ", ".join(EXTRACTION_MODES))
         self.driver = driver
+        self.parser = parser
+        self.waiter = waiter if waiter is not None else Waiter(driver)
+        self.extraction = extraction
+        self.archive = archive
+        self.scheduler = scheduler if scheduler is not None \
+            else RateScheduler()
+        self.transfer_stats = {}
 
     @staticmethod
     def get_name(soup):
@@ -87,51 +129,41 @@ class UserScraper(object):
             degree = ''
         return degree
 
-    def get_skills(self):
+    @staticmethod
+    def get_skills(soup):
         """
         Get the skills of the user whose profile page is being scraped.
-        Scroll down the page by sending the PAGE_DOWN button
-        until either the "show more" button in the skills section
-        has been found, or the end of the page has been reached
-        Return a list of skills.
+        The skills section must have been expanded by expand_skills()
+        beforehand for the full list to be in the page.
 
+        :param soup: BeautifulSoup object
         :return: list: skills
         """
-        skills = []
-        button_found = False
-        endofpage_reached = False
-        attempt = 0
-        max_attempts = 3
-        delay = 3  # seconds
-        body = self.driver.find_element_by_tag_name("body")
-        last_height = self.driver.execute_script(
-            "return document.body.scrollHeight")
-        while not button_found:
-            body.send_keys(Keys.PAGE_DOWN)
-            sleep(2)
-            new_height = self.driver.execute_script(
-                "return document.body.scrollHeight")
-            button_found, showmore_button = is_button_found(
-                self.driver, delay)
-            if button_found:
-                self.driver.execute_script("arguments[0].click();",
-                                           showmore_button)
-                sleep(2)
-                soup = bs(self.driver.page_source, 'html.parser')
-                skills_tags = soup.find_all(
-                    class_="pv-skill-category-entity__name-text")
-                skills = [item.get_text(strip=True)
-                          for item in skills_tags]
-                skills = [validate_field(skill) for skill in skills]
-            if new_height == last_height:
-                attempt += 1
-                if attempt == max_attempts:
-                    endofpage_reached = True
-            else:
-                last_height = new_height
-            if button_found or endofpage_reached:
-                break
-        return skills
+        skills_tags = soup.find_all(
+            class_="pv-skill-category-entity__name-text")
+        skills = [item.get_text(strip=True) for item in skills_tags]
+        return [validate_field(skill) for skill in skills]
+
+    def expand_skills(self):
+        """
+        Expand the skills section of the profile page being scraped.
+        Scroll down the page with scroll_until_stable() until either
+        the "show more" button in the skills section has been found,
+        in which case it is clicked within the same script, or the end
+        of the page has been reached.
+        Return True if the section has been expanded, False otherwise.
+
+        :return: bool
+        """
+        timeout = self.waiter.deadline("skills_scroll")
+        result = scroll_until_stable(
+            self.driver, stop_xpath=SKILLS_BUTTON_XPATH, click_stop=True,
+            quiet=self.waiter.quiet_period, timeout=timeout)
+        self.waiter.record("skills_scroll", result["elapsed"],
+                           result["elapsed"] >= timeout)
+        if result["found"]:
+            self.waiter.until_dom_quiet("skills_expand")
+        return result["found"]
 
     @staticmethod
     def get_languages(soup):
@@ -156,16 +188,109 @@ class UserScraper(object):
                 pass
         return languages
 
+    @staticmethod
+    def extract_user_data(soup, url, query):
+        """
+        Get the user data from a parsed profile page by walking
+        its tree once with the compiled PROFILE_RULES.
+        Return a dictionary with the same keys and values the
+        get* methods of the class would give.
+
+        :param soup: BeautifulSoup object
+        :param url: str URL of the profile
+        :param query: str
+        :return: dict user data
+        """
+        return UserScraper.user_data_from_fields(
+            PROFILE_EXTRACTOR.extract(soup), url, query)
+
+    @staticmethod
+    def user_data_from_fields(fields, url, query):
+        """
+        Build the user data dictionary from the fields
+        extracted with PROFILE_RULES.
+
+        :param fields: dict field -> value
+        :param url: str URL of the profile
+        :param query: str
+        :return: dict user data
+        """
+        user_data = {
+            "URL": url,
+            "name": fields["name"],
+            "query": query,
+            "job_title": fields["job_title"],
+            "degree": fields["degree"],
+            "location": fields["location"],
+            "languages": fields["languages"],
+            "skills": fields["skills"]
+        }
+        return user_data
+
+    def extract_from_driver(self, url, query):
+        """
+        Get the user data of the profile loaded in the driver,
+        either from its parsed page source or by running PROFILE_RULES
+        inside the page, depending on the extraction mode, and record
+        the bytes received and the time spent.
+        Archive the page source if an archive has been given, which
+        in the "in_page" mode costs the transfer of the page source.
+
+        :param url: str URL of the profile
+        :param query: str
+        :return: dict user data
+        """
+        user_data = None
+        page_source = None
+        if self.extraction in ("in_page", "compare"):
+            start = perf_counter()
+            with METRICS.timer("in_page", kind="profile"):
+                fields, n_bytes = PROFILE_EXTRACTOR.extract_in_page(
+                    self.driver)
+                user_data = self.user_data_from_fields(fields, url, query)
+            record_transfer(self.transfer_stats, "in_page", n_bytes,
+                            perf_counter() - start)
+        if self.extraction in ("soup", "compare"):
+            start = perf_counter()
+            with METRICS.timer("page_source", kind="profile"):
+                page_source = self.driver.page_source
+            with METRICS.timer("parse", kind="profile"):
+                soup = make_soup(page_source, self.parser,
+                                 PROFILE_EXTRACTOR.classes)
+            with METRICS.timer("extract", kind="profile"):
+                soup_user_data = self.extract_user_data(soup, url, query)
+            # the values are copied out of the tree, which can be freed
+            # without waiting for the garbage collector
+            soup.decompose()
+            record_transfer(self.transfer_stats, "soup",
+                            len(page_source.encode('utf-8')),
+                            perf_counter() - start)
+            if user_data is not None and user_data != soup_user_data:
+                print("WARNING :: In-page and soup extraction differ " +
+                      "for URL\n" + url)
+            user_data = soup_user_data
+        if self.archive is not None:
+            if page_source is None:
+                # "in_page" mode: the page source is only transferred
+                # to be archived, and counted with the fields
+                start = perf_counter()
+                page_source = self.driver.page_source
+                record_transfer(self.transfer_stats, "in_page",
+                                len(page_source.encode('utf-8')),
+                                perf_counter() - start, pages=0)
+            self.archive.store(url, page_source, "profile", query)
+        return user_data
+
     def scrape_user(self, query, url):
         """
         Get the user data for a given query and linkedin URL.
-        Call get_name() and get_job_title() to get name and
-        job title, respectively. Scroll down the given URL
-        to make the skill-section HTML code appear;
-        call get_skills() and get_degree() to extract the user skills
-        and their degree, respectively. Scroll down the page until its
-        end to extract the user languages by calling
-        get_languages().
+        Scroll down the given URL to make the skill-section HTML code
+        appear and expand it by calling expand_skills(). Scroll down
+        the page until its end to make the "Accomplishments" section
+        appear, then extract every field at once by calling
+        extract_from_driver().
+        The URL is loaded once allowed by the scheduler, which backs
+        off after every attempt that times out or hits a captcha.
         Finally, return a dictionary with the extracted data.
 
         :param query: str
@@ -179,41 +304,31 @@ class UserScraper(object):
         while not success:
             try:
                 attempt += 1
-                self.driver.get(url)
-                sleep(2)
-                self.driver.execute_script(
-                    "document.body.style.zoom='50%'")
-                sleep(3)
-                skills = self.get_skills()
-                scroll_profile_page(self.driver)
-                soup = bs(self.driver.page_source, 'html.parser')
-                name = self.get_name(soup)
-                job_title = self.get_job_title(soup)
-                location = self.get_location(soup)
-                degree = self.get_degree(soup)
-                languages = self.get_languages(soup)
-                user_data = {
-                    "URL": url,
-                    "name": name,
-                    "query": query,
-                    "job_title": job_title,
-                    "degree": degree,
-                    "location": location,
-                    "languages": languages,
-                    "skills": skills
-                }
+                with METRICS.timer("navigate", kind="profile"):
+                    self.scheduler.navigate(self.driver, url)
+                with METRICS.timer("page_load", kind="profile"):
+                    self.waiter.until_dom_quiet("page_load")
+                with METRICS.timer("zoom", kind="profile"):
+                    self.driver.execute_script(
+                        "document.body.style.zoom='50%'")
+                    self.waiter.until_dom_quiet("zoom")
+                with METRICS.timer("expand_skills", kind="profile"):
+                    self.expand_skills()
+                with METRICS.timer("scroll", kind="profile"):
+                    scroll_profile_page(self.driver, self.waiter)
+                user_data = self.extract_from_driver(url, query)
                 success = True
             except TimeoutException:
+                METRICS.inc("retries_total", kind="profile")
                 print("\nINFO :: TimeoutException raised while " +
                       "getting URL\n" + url)
                 print("INFO :: Attempt n." + str(attempt) + " of " +
-                      str(max_attempts) +
-                      "\nNext attempt in 60 seconds")
-                sleep(60)
+                      str(max_attempts))
             if success:
                 break
             if attempt == max_attempts and not user_data:
                 print("INFO :: Max number of attempts reached. " +
                       "Skipping URL" +
                       "\nUser data will be empty.")
+                break
         return validate_user_data(user_data)
@@ -0,0 +1,184 @@
+"""
+A class to wait on the readiness of a page instead of sleeping
+for a fixed amount of time, and to report how long each wait took
+
+"""
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions
+from selenium.common.exceptions import TimeoutException
+from time import perf_counter
+
+
+# seconds each step is allowed to wait at most
+DEFAULT_DEADLINES = {
+    "page_load": 10,
+    "zoom": 5,
+    "scroll_step": 3,
+    "scroll_page": 60,
+    "scroll_panel": 30,
+    "skills_scroll": 30,
+    "skills_expand": 5,
+    "search_load": 10
+}
+BODY_HEIGHT_SCRIPT = "return document.body.scrollHeight"
+# install a MutationObserver on the page the first time it is called,
+# then return the milliseconds elapsed since the last DOM mutation,
+# or 0 while the document is still loading or is the one a navigation
+# started with NAVIGATE_SCRIPT has not replaced yet
+QUIET_TIME_SCRIPT = (
+    "if (document.__scraperStale) { return 0; }" +
+    "if (!document.__scraperLastMutation) {" +
+    "  document.__scraperLastMutation = Date.now();" +
+    "  new MutationObserver(function () {" +
+    "    document.__scraperLastMutation = Date.now();" +
+    "  }).observe(document, {childList: true, subtree: true," +
+    "                        attributes: true, characterData: true});" +
+    "}" +
+    "if (document.readyState === 'loading') { return 0; }" +
+    "return Date.now() - document.__scraperLastMutation;"
+)
+
+
+class Waiter(object):
+    def __init__(self, driver, deadlines=None, quiet_period=0.5, poll=0.1):
+        """
+        Initialize the class
+
+        :param driver: selenium chrome driver object
+        :param deadlines: dict step -> float seconds, overriding
+            the DEFAULT_DEADLINES
+        :param quiet_period: float seconds without DOM mutations or
+            scroll-height changes after which a page is settled
+        :param poll: float seconds between two checks of a condition
+        """
+        self.driver = driver
+        self.deadlines = dict(DEFAULT_DEADLINES)
+        self.deadlines.update(deadlines or {})
+        self.quiet_period = quiet_period
+        self.poll = poll
+        self.timings = {}
+        self.timeouts = {}
+
+    def deadline(self, step):
+        """
+        Get the deadline of a step.
+
+        :param step: str name of the step
+        :return: float seconds
+        """
+        return self.deadlines.get(step, max(self.deadlines.values()))
+
+    def until(self, step, condition):
+        """
+        Wait until the condition returns a truthy value or the deadline
+        of the step has passed, and record the time it took.
+
+        :param step: str name of the step
+        :param condition: callable(driver) returning a truthy value
+            when the page is ready
+        :return: value returned by the condition, None on timeout
+        """
+        start = perf_counter()
+        timed_out = False
+        try:
+            result = WebDriverWait(
+                self.driver, self.deadline(step), self.poll).until(condition)
+        except TimeoutException:
+            result = None
+            timed_out = True
+        self.record(step, perf_counter() - start, timed_out)
+        return result
+
+    def record(self, step, seconds, timed_out=False):
+        """
+        Record the time used by a wait performed elsewhere,
+        e.g. inside the page.
+
+        :param step: str name of the step
+        :param seconds: float seconds used
+        :param timed_out: bool the deadline has been reached
+        :return: None
+        """
+        self.timings.setdefault(step, []).append(seconds)
+        if timed_out:
+            self.timeouts[step] = self.timeouts.get(step, 0) + 1
+
+    def absorb(self, other):
+        """
+        Add the timings of another waiter to the ones of this waiter,
+        e.g. to report the waits of many drivers together.
+
+        :param other: Waiter object
+        :return: None
+        """
+        for step, timings in other.timings.items():
+            self.timings.setdefault(step, []).extend(timings)
+        for step, timeouts in other.timeouts.items():
+            self.timeouts[step] = self.timeouts.get(step, 0) + timeouts
+
+    def until_dom_quiet(self, step):
+        """
+        Wait until the document has been loaded and no DOM mutation
+        has happened for the quiet period.
+
+        :param step: str name of the step
+        :return: bool True if the page has settled before the deadline
+        """
+        quiet_ms = 1000 * self.quiet_period
+
+        def is_quiet(driver):
+            quiet_time = driver.execute_script(QUIET_TIME_SCRIPT)
+            return quiet_time is not None and quiet_time >= quiet_ms
+        return bool(self.until(step, is_quiet))
+
+    def until_height_stable(self, step, height_script=BODY_HEIGHT_SCRIPT):
+        """
+        Wait until the scroll height returned by the script has not
+        changed for the quiet period.
+
+        :param step: str name of the step
+        :param height_script: str script returning the scroll height
+        :return: int last scroll height read
+        """
+        last = {"height": None, "since": perf_counter()}
+
+        def is_stable(driver):
+            height = driver.execute_script(height_script)
+            now = perf_counter()
+            if height != last["height"]:
+                last["height"] = height
+                last["since"] = now
+                return False
+            return now - last["since"] >= self.quiet_period
+        self.until(step, is_stable)
+        return last["height"]
+
+    def until_present(self, step, by, value):
+        """
+        Wait until an element matching the locator is in the page.
+
+        :param step: str name of the step
+        :param by: str selenium locator strategy
+        :param value: str locator
+        :return: web element, None if not found before the deadline
+        """
+        return self.until(
+            step, expected_conditions.presence_of_element_located(
+                (by, value)))
+
+    def report(self):
+        """
+        Print, for each step, how many times it has waited, the total,
+        mean and maximum time actually used, and the timeouts.
+
+        :return: None
+        """
+        print("INFO :: Time spent waiting per step")
+        print("{:<16} {:>7} {:>10} {:>8} {:>8} {:>9}".format(
+            "step", "waits", "total s", "mean s", "max s", "timeouts"))
+        for step in sorted(self.timings):
+            timings = self.timings[step]
+            print("{:<16} {:>7} {:>10.1f} {:>8.2f} {:>8.2f} {:>9}".format(
+                step, len(timings), sum(timings),
+                sum(timings) / len(timings), max(timings),
+                self.timeouts.get(step, 0)))
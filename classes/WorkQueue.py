@@ -0,0 +1,464 @@
+"""
+A class to share the URLs to scrape between the workers of several
+hosts through a Mongo DB collection: every worker claims batches of
+URLs with a lease expiring unless renewed by its heartbeats, then marks
+them done or failed, and the leases of the workers that died are
+reclaimed, so that every URL is scraped once.
+MemoryCollection stands in for the Mongo DB collection in tests and
+benchmarks, and can be served to several processes.
+
+"""
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.results import UpdateResult, InsertManyResult
+from multiprocessing.managers import BaseManager
+from classes.Metrics import METRICS
+from utils import connect_mongo
+from threading import Thread, Lock, Event
+from time import time
+import copy
+import os
+import socket
+import uuid
+
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+STATES = (PENDING, LEASED, DONE, FAILED)
+
+
+class WorkQueue(object):
+    def __init__(self, collection, lease=300., max_attempts=3,
+                 owner=None, clock=time):
+        """
+        Initialize the class and make sure the collection has the
+        indexes the claims need.
+        Each URL is a document of the collection, with the URL as _id.
+        The leases are compared with the clock of every host, which
+        have to be in sync to well within the lease.
+
+        :param collection: Mongo DB collection, or any object with the
+            same API, e.g. a MemoryCollection
+        :param lease: float seconds a claimed URL stays leased to its
+            worker without a heartbeat
+        :param max_attempts: int times a URL is claimed before
+            being marked as failed
+        :param owner: str name of the worker in the leases,
+            host, process and a random suffix if not given
+        :param clock: callable() returning the current time in seconds
+        """
+        self.collection = collection
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.owner = owner or "{}:{}:{}".format(
+            socket.gethostname(), os.getpid(), uuid.uuid4().hex[:6])
+        self.clock = clock
+        self.lock = Lock()
+        self.held = set()
+        self.stopped = Event()
+        self.heartbeat_thread = None
+        self.collection.create_index([("kind", 1), ("state", 1),
+                                      ("added_at", 1)])
+        self.collection.create_index([("state", 1), ("lease_until", 1)])
+
+    def add(self, kind, query, urls):
+        """
+        Add URLs as pending, leaving the URLs already in the queue,
+        in any state, unchanged.
+
+        :param kind: str kind of page, e.g. "profile" or "job"
+        :param query: str query that found the URLs
+        :param urls: list of str URLs
+        :return: int number of new URLs
+        """
+        if not urls:
+            return 0
+        now = self.clock()
+        documents = [{"_id": url, "kind": kind, "query": query,
+                      "state": PENDING, "attempts": 0, "owner": None,
+                      "lease_until": None, "added_at": now + i * 1e-6,
+                      "error": None} for i, url in enumerate(urls)]
+        try:
+            return len(self.collection.insert_many(
+                documents, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            return e.details.get("nInserted", 0)
+
+    def reclaim(self):
+        """
+        Put back in the pending URLs the ones whose lease has expired,
+        i.e. whose worker has died or stalled, or mark them as failed
+        once they have been claimed max_attempts times.
+
+        :return: int number of URLs reclaimed
+        """
+        now = self.clock()
+        expired = {"state": LEASED, "lease_until": {"$lt": now}}
+        failed = self.collection.update_many(
+            dict(expired, attempts={"$gte": self.max_attempts}),
+            {"$set": {"state": FAILED, "owner": None, "updated_at": now,
+                      "error": "lease expired"}}).modified_count
+        reclaimed = self.collection.update_many(
+            expired, {"$set": {"state": PENDING, "owner": None,
+                               "lease_until": None,
+                               "updated_at": now}}).modified_count
+        if failed or reclaimed:
+            METRICS.inc("leases_expired_total", failed + reclaimed)
+            print("INFO :: Reclaimed " + str(reclaimed) +
+                  " expired lease(s), " + str(failed) +
+                  " URL(s) failed after " + str(self.max_attempts) +
+                  " attempts")
+        return reclaimed
+
+    def claim(self, kind, batch_size=10, query=None):
+        """
+        Lease up to batch_size pending URLs to this worker, the oldest
+        first, after reclaiming the expired leases. Every URL is leased
+        by an atomic update, so that two workers never hold it at once.
+
+        :param kind: str kind of page
+        :param batch_size: int max number of URLs claimed
+        :param query: str claim only the URLs of this query, if given
+        :return: list of tuples (str query, str URL)
+        """
+        self.reclaim()
+        selector = {"kind": kind, "state": PENDING}
+        if query is not None:
+            selector["query"] = query
+        claimed = []
+        for _ in range(batch_size):
+            now = self.clock()
+            document = self.collection.find_one_and_update(
+                selector,
+                {"$set": {"state": LEASED, "owner": self.owner,
+                          "lease_until": now + self.lease,
+                          "updated_at": now},
+                 "$inc": {"attempts": 1}},
+                sort=[("added_at", 1)],
+                return_document=ReturnDocument.AFTER)
+            if document is None:
+                break
+            claimed.append((document["query"], document["_id"]))
+        with self.lock:
+            self.held.update(url for _, url in claimed)
+        METRICS.inc("urls_claimed_total", len(claimed))
+        return claimed
+
+    def heartbeat(self):
+        """
+        Extend the leases of the URLs held by this worker.
+
+        :return: int number of URLs whose lease has been lost,
+            e.g. reclaimed by another worker after a long stall
+        """
+        with self.lock:
+            urls = list(self.held)
+        if not urls:
+            return 0
+        now = self.clock()
+        renewed = self.collection.update_many(
+            {"_id": {"$in": urls}, "state": LEASED, "owner": self.owner},
+            {"$set": {"lease_until": now + self.lease,
+                      "updated_at": now}}).modified_count
+        # the URLs marked done or failed meanwhile are not lost
+        with self.lock:
+            lost = max(len(self.held.intersection(urls)) - renewed, 0)
+        if lost:
+            print("WARNING :: " + str(lost) + " lease(s) of " + self.owner +
+                  " have been lost")
+        return lost
+
+    def start_heartbeat(self, interval=None):
+        """
+        Call heartbeat() every interval seconds from a background
+        thread, until stop() is called.
+
+        :param interval: float seconds, a third of the lease if not given
+        :return: None
+        """
+        interval = interval or self.lease / 3.
+
+        def run():
+            while not self.stopped.wait(interval):
+                try:
+                    self.heartbeat()
+                except Exception as e:
+                    print("WARNING :: Heartbeat of the work queue " +
+                          "failed: " + repr(e))
+        self.heartbeat_thread = Thread(target=run, name="lease-heartbeat",
+                                       daemon=True)
+        self.heartbeat_thread.start()
+
+    def complete(self, urls):
+        """
+        Mark URLs held by this worker as done.
+
+        :param urls: list of str URLs
+        :return: int number of URLs marked as done; a URL whose lease
+            has been lost to another worker is left to that worker
+        """
+        urls = list(urls)
+        if not urls:
+            return 0
+        with self.lock:
+            self.held.difference_update(urls)
+        return self.collection.update_many(
+            {"_id": {"$in": urls}, "state": LEASED, "owner": self.owner},
+            {"$set": {"state": DONE, "owner": None, "lease_until": None,
+                      "updated_at": self.clock()}}).modified_count
+
+    def fail(self, url, error):
+        """
+        Give back a URL held by this worker that could not be scraped:
+        put it back in the pending URLs, or mark it as failed once it
+        has been claimed max_attempts times.
+
+        :param url: str URL
+        :param error: str error message
+        :return: None
+        """
+        with self.lock:
+            self.held.discard(url)
+        now = self.clock()
+        mine = {"_id": url, "state": LEASED, "owner": self.owner}
+        self.collection.update_many(
+            dict(mine, attempts={"$gte": self.max_attempts}),
+            {"$set": {"state": FAILED, "owner": None, "lease_until": None,
+                      "updated_at": now, "error": error}})
+        self.collection.update_many(
+            mine, {"$set": {"state": PENDING, "owner": None,
+                            "lease_until": None, "updated_at": now,
+                            "error": error}})
+
+    def stop(self):
+        """
+        Stop the heartbeats and give back the URLs still held, so that
+        other workers can claim them without waiting for the leases
+        to expire. Calling it more than once has no effect.
+
+        :return: None
+        """
+        self.stopped.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+            self.heartbeat_thread = None
+        with self.lock:
+            urls = list(self.held)
+            self.held.clear()
+        if urls:
+            self.collection.update_many(
+                {"_id": {"$in": urls}, "state": LEASED,
+                 "owner": self.owner},
+                {"$set": {"state": PENDING, "owner": None,
+                          "lease_until": None, "updated_at": self.clock()},
+                 "$inc": {"attempts": -1}})
+
+    def counts(self, kind):
+        """
+        Get the number of URLs of a kind of page in each state.
+
+        :param kind: str kind of page
+        :return: dict state -> int
+        """
+        return {state: self.collection.count_documents(
+            {"kind": kind, "state": state}) for state in STATES}
+
+    def report(self, kind):
+        """
+        Print the number of URLs of a kind of page in each state.
+
+        :param kind: str kind of page
+        :return: None
+        """
+        counts = self.counts(kind)
+        print("INFO :: Work queue of " + kind + " URLs: " +
+              ", ".join(str(counts[state]) + " " + state
+                        for state in STATES))
+
+
+def _matches(document, selector):
+    for key, condition in selector.items():
+        value = document.get(key)
+        if not isinstance(condition, dict):
+            if value != condition:
+                return False
+            continue
+        for operator, operand in condition.items():
+            if operator == "$in":
+                matched = value in operand
+            elif operator == "$ne":
+                matched = value != operand
+            elif value is None:
+                matched = False
+            elif operator == "$lt":
+                matched = value < operand
+            elif operator == "$lte":
+                matched = value <= operand
+            elif operator == "$gt":
+                matched = value > operand
+            elif operator == "$gte":
+                matched = value >= operand
+            else:
+                raise ValueError("Unsupported operator " + operator)
+            if not matched:
+                return False
+    return True
+
+
+def _apply(document, update):
+    for operator, fields in update.items():
+        for key, operand in fields.items():
+            if operator == "$set":
+                document[key] = operand
+            elif operator == "$inc":
+                document[key] = document.get(key, 0) + operand
+            elif operator == "$unset":
+                document.pop(key, None)
+            else:
+                raise ValueError("Unsupported operator " + operator)
+
+
+class MemoryCollection(object):
+    def __init__(self):
+        """
+        Initialize the class: an in-memory stand-in for a Mongo DB
+        collection implementing, atomically, the part of its API that
+        WorkQueue uses, i.e. equality and $in, $ne, $lt, $lte, $gt, $gte
+        selectors and $set, $inc, $unset updates.
+        """
+        self.documents = {}
+        self.lock = Lock()
+
+    def create_index(self, keys, **kwargs):
+        return "_".join(key + "_" + str(direction)
+                        for key, direction in keys)
+
+    def insert_many(self, documents, ordered=True):
+        errors = []
+        inserted = []
+        with self.lock:
+            for index, document in enumerate(documents):
+                if document["_id"] in self.documents:
+                    errors.append({"index": index, "code": 11000,
+                                   "errmsg": "duplicate key " +
+                                   str(document["_id"])})
+                    if ordered:
+                        break
+                    continue
+                self.documents[document["_id"]] = copy.deepcopy(document)
+                inserted.append(document["_id"])
+        if errors:
+            raise BulkWriteError({"writeErrors": errors,
+                                  "nInserted": len(inserted)})
+        return InsertManyResult(inserted, True)
+
+    def insert_one(self, document):
+        with self.lock:
+            if document["_id"] in self.documents:
+                raise DuplicateKeyError("duplicate key " +
+                                        str(document["_id"]))
+            self.documents[document["_id"]] = copy.deepcopy(document)
+
+    def find(self, selector=None):
+        with self.lock:
+            return [copy.deepcopy(document)
+                    for document in self.documents.values()
+                    if _matches(document, selector or {})]
+
+    def count_documents(self, selector):
+        with self.lock:
+            return sum(_matches(document, selector)
+                       for document in self.documents.values())
+
+    def find_one_and_update(self, selector, update, sort=None,
+                            return_document=ReturnDocument.BEFORE):
+        with self.lock:
+            candidates = [document for document in self.documents.values()
+                          if _matches(document, selector)]
+            for key, direction in reversed(sort or []):
+                candidates.sort(key=lambda document: document.get(key),
+                                reverse=direction < 0)
+            if not candidates:
+                return None
+            document = candidates[0]
+            before = copy.deepcopy(document)
+            _apply(document, update)
+            return copy.deepcopy(document) if\
+                return_document == ReturnDocument.AFTER else before
+
+    def update_many(self, selector, update):
+        matched = 0
+        with self.lock:
+            for document in self.documents.values():
+                if _matches(document, selector):
+                    matched += 1
+                    _apply(document, update)
+        return UpdateResult({"n": matched, "nModified": matched}, True)
+
+
+# collection served by the process of a CollectionManager
+SHARED_COLLECTION = []
+
+
+def _shared_collection():
+    if not SHARED_COLLECTION:
+        SHARED_COLLECTION.append(MemoryCollection())
+    return SHARED_COLLECTION[0]
+
+
+class CollectionManager(BaseManager):
+    """
+    Manager serving a MemoryCollection to other processes
+    """
+
+
+CollectionManager.register("collection", callable=_shared_collection)
+
+
+def serve_memory_collection(address=("127.0.0.1", 0), authkey=b"queue"):
+    """
+    Serve a new MemoryCollection from a server process, so that workers
+    in other processes can share it through connect_memory_collection().
+
+    :param address: tuple (str host, int port), any free port if 0
+    :param authkey: bytes key the workers authenticate with
+    :return: tuple (started CollectionManager, tuple address)
+    """
+    manager = CollectionManager(address, authkey)
+    manager.start()
+    return manager, manager.address
+
+
+def connect_memory_collection(address, authkey=b"queue"):
+    """
+    Connect to a MemoryCollection served by serve_memory_collection().
+
+    :param address: tuple (str host, int port)
+    :param authkey: bytes key of the server
+    :return: proxy with the API of the MemoryCollection
+    """
+    manager = CollectionManager(address, authkey)
+    manager.connect()
+    return manager.collection()
+
+
+def open_work_queue(parameters, credentials, name):
+    """
+    Open the work queue shared by the hosts scraping a kind of records,
+    e.g. "users" or "jobs", in the "<name>_queue" collection of the
+    Mongo DB of the config file, if the "WORK_QUEUE" parameter is set.
+
+    :param parameters: dict "parameters" of the config file
+    :param credentials: dict "credentials" of the config file
+    :param name: str name of the kind of records
+    :return: WorkQueue object, None if not enabled
+    """
+    if not parameters.get("WORK_QUEUE"):
+        return None
+    client = connect_mongo(parameters["HOST"], credentials["MONGOUSER"],
+                           credentials["MONGOPWD"])
+    return WorkQueue(client["linkedin"][name + "_queue"],
+                     parameters.get("LEASE_SECONDS", 300.),
+                     parameters.get("URL_MAX_ATTEMPTS", 3))
@@ -0,0 +1,195 @@
+"""
+Serve the pages of the golden corpus over HTTP on localhost, under the
+path of their golden URL, to test and benchmark the fetchers and the
+browser profiles without network access.
+Pages can embed synthetic static assets (images, fonts, style sheets,
+scripts, videos) served by the same server, and third-party trackers
+served from "localhost" while the pages are on 127.0.0.1, so that they
+count as another host. A page rendered by a script,
+lacking the markup of the corpus pages, is served under
+/jobs/view/rendered to exercise the fallback to the driver.
+
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from urllib.parse import urlparse
+from time import sleep
+import argparse
+import json
+import os
+
+
+# extension of a synthetic asset -> (content type, HTML tag embedding it)
+ASSET_TYPES = {
+    "png": ("image/png", '<img src="{}">'),
+    "woff2": ("font/woff2",
+              '<link rel="preload" as="font" crossorigin href="{}">'),
+    "css": ("text/css", '<link rel="stylesheet" href="{}">'),
+    "js": ("application/javascript", '<script src="{}"></script>'),
+    "mp4": ("video/mp4", '<video src="{}" preload="auto"></video>')
+}
+TRACKER_TAG = '<img src="http://localhost:{}/collect/pixel-{}.gif">'
+TRACKER_KIB = 1
+RENDERED_PATH = "/jobs/view/rendered"
+RENDERED_PAGE = """<html><head><title>Job</title></head><body>
+<div id="app"></div>
+<script>
+document.getElementById('app').innerHTML =
+    '<div class="jobs-top-card"><h1 class="jobs-top-card__job-title">' +
+    'Rendered job</h1></div>';
+</script>
+</body></html>"""
+
+
+def load_fixtures(corpus_dir):
+    """
+    Map the path of the golden URL of each corpus page to its HTML code.
+
+    :param corpus_dir: str path of the corpus directory
+    :return: dict path -> str HTML code
+    """
+    with open(os.path.join(corpus_dir, "golden.json"), 'r',
+              encoding='utf-8') as golden_file:
+        golden = json.load(golden_file)
+    fixtures = {}
+    for path, entry in golden.items():
+        if "url" not in entry:
+            continue
+        with open(os.path.join(corpus_dir, path), 'r',
+                  encoding='utf-8') as page_file:
+            fixtures[urlparse(entry["url"]).path] = page_file.read()
+    fixtures[RENDERED_PATH] = RENDERED_PAGE
+    return fixtures
+
+
+def asset_tags(n_assets):
+    """
+    Get the HTML tags embedding n_assets synthetic assets,
+    cycling over the ASSET_TYPES.
+
+    :param n_assets: int number of assets
+    :return: str HTML code
+    """
+    extensions = sorted(ASSET_TYPES)
+    return "".join(
+        ASSET_TYPES[extensions[i % len(extensions)]][1].format(
+            "/static/asset-{}.{}".format(i, extensions[i % len(extensions)]))
+        for i in range(n_assets))
+
+
+def make_handler(fixtures, n_assets=0, asset_kib=32, delay=0.,
+                 n_trackers=0):
+    """
+    Build the request handler class serving the fixtures.
+    The class counts the requests and bytes served by kind of
+    response: "page", "asset" and "tracker".
+
+    :param fixtures: dict path -> str HTML code
+    :param n_assets: int number of assets embedded in every page
+    :param asset_kib: int size of every asset in KiB
+    :param delay: float seconds waited before every response
+    :param n_trackers: int number of third-party trackers
+        embedded in every page
+    :return: BaseHTTPRequestHandler subclass
+    """
+    tags = asset_tags(n_assets)
+    asset_body = b"\0" * (1024 * asset_kib)
+    tracker_body = b"\0" * (1024 * TRACKER_KIB)
+
+    class FixtureHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        requests_served = {"page": 0, "asset": 0, "tracker": 0}
+        bytes_served = {"page": 0, "asset": 0, "tracker": 0}
+        lock = Lock()
+
+        def send_body(self, kind, content_type, body):
+            with self.lock:
+                self.requests_served[kind] += 1
+                self.bytes_served[kind] += len(body)
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "max-age=3600")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            sleep(delay)
+            path = urlparse(self.path).path
+            if path.startswith("/static/"):
+                extension = path.rsplit(".", 1)[-1]
+                if extension in ASSET_TYPES:
+                    self.send_body("asset", ASSET_TYPES[extension][0],
+                                   asset_body)
+                    return
+            elif path.startswith("/collect/"):
+                self.send_body("tracker", "image/gif", tracker_body)
+                return
+            elif path.rstrip("/") in fixtures:
+                html = fixtures[path.rstrip("/")]
+                port = self.server.server_address[1]
+                trackers = "".join(TRACKER_TAG.format(port, i)
+                                   for i in range(n_trackers))
+                html = html.replace("</body>", tags + trackers + "</body>",
+                                    1)
+                self.send_body("page", "text/html; charset=utf-8",
+                               html.encode('utf-8'))
+                return
+            self.send_error(404)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FixtureHandler
+
+
+def start_fixture_server(corpus_dir="corpus", port=0, n_assets=0,
+                         asset_kib=32, delay=0., n_trackers=0):
+    """
+    Start serving the fixtures in a background thread.
+
+    :param corpus_dir: str path of the corpus directory
+    :param port: int port to listen on, any free port if 0
+    :param n_assets: int number of assets embedded in every page
+    :param asset_kib: int size of every asset in KiB
+    :param delay: float seconds waited before every response
+    :param n_trackers: int number of third-party trackers
+        embedded in every page
+    :return: tuple (ThreadingHTTPServer, str base URL)
+    """
+    handler = make_handler(load_fixtures(corpus_dir), n_assets, asset_kib,
+                           delay, n_trackers)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name="fixture-server",
+           daemon=True).start()
+    return server, "http://127.0.0.1:" + str(server.server_address[1])
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Serve the pages of the golden corpus on localhost")
+    argparser.add_argument('-p', '--port', type=int, default=8000,
+                           help='Port to listen on')
+    argparser.add_argument('--corpus', type=str, default="corpus",
+                           help='Path of the corpus directory')
+    argparser.add_argument('-a', '--assets', type=int, default=0,
+                           help='Number of static assets in every page')
+    argparser.add_argument('--asset-kib', type=int, default=32,
+                           help='Size of every static asset in KiB')
+    argparser.add_argument('-d', '--delay', type=float, default=0.,
+                           help='Seconds waited before every response')
+    argparser.add_argument('-t', '--trackers', type=int, default=0,
+                           help='Number of third-party trackers in every page')
+    args = argparser.parse_args()
+    fixture_server, base_url = start_fixture_server(
+        args.corpus, args.port, args.assets, args.asset_kib, args.delay,
+        args.trackers)
+    print("INFO :: Serving the corpus at " + base_url)
+    for fixture_path in sorted(load_fixtures(args.corpus)):
+        print(base_url + fixture_path)
+    try:
+        while True:
+            sleep(3600)
+    except KeyboardInterrupt:
+        fixture_server.shutdown()
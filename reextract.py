@@ -0,0 +1,106 @@
+"""
+Extract again offline the data of the pages archived by scrape_users.py
+and scrape_jobs.py, e.g. after a selector has been fixed, and write it
+to the storage backend of the config file, replacing the stored records.
+The pages are parsed on a pool of processes, without any browser.
+
+"""
+from classes.PageArchive import PageArchive
+from classes.JobScraper import JobScraper
+from classes.UserScraper import UserScraper, PROFILE_EXTRACTOR
+from classes.BulkWriter import BulkWriter
+from classes.Storage import open_storage
+from utils import load_config, make_soup, validate_user_data
+from multiprocessing import Pool
+from time import time
+import argparse
+import os
+
+
+# kind of page -> name of the storage collection of its records
+KIND_STORAGE = {"profile": "users", "job": "jobs"}
+
+
+def extract_page(task):
+    """
+    Extract the data of an archived page.
+    Run in the processes of the pool.
+
+    :param task: tuple (archive path, parser, kind, URL, digest, query)
+    :return: dict data, empty if the page could not be extracted
+    """
+    archive_path, parser, kind, url, digest, query = task
+    try:
+        page_source = PageArchive.load(archive_path, digest)
+    except (OSError, EOFError) as e:
+        print("ERROR :: Could not read the archived page of URL\n" +
+              url + "\n" + repr(e))
+        return {}
+    if kind == "profile":
+        soup = make_soup(page_source, parser, PROFILE_EXTRACTOR.classes)
+        data = validate_user_data(
+            UserScraper.extract_user_data(soup, url, query))
+    else:
+        soup = make_soup(page_source, parser, JobScraper.PAGE_CLASSES)
+        data = JobScraper(soup, url, query).get_job_data()
+    soup.decompose()
+    return data
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description=("Extract again the archived pages and write the " +
+                     "data to the storage of the conf file"))
+    argparser.add_argument('-c', '--conf', type=str, metavar='',
+                           required=True,
+                           help='Specify the path of the configuration file')
+    argparser.add_argument('-a', '--archive', type=str, metavar='',
+                           default=None,
+                           help=('Path of the archive, '
+                                 'ARCHIVE_PATH if not given'))
+    argparser.add_argument('-k', '--kinds', nargs='+',
+                           choices=sorted(KIND_STORAGE),
+                           default=sorted(KIND_STORAGE),
+                           help='Kinds of pages to extract again')
+    argparser.add_argument('-w', '--workers', type=int,
+                           default=os.cpu_count(),
+                           help='Number of parsing processes')
+    argparser.add_argument('--chunksize', type=int, default=16,
+                           help='Number of pages sent to a process at once')
+    args = argparser.parse_args()
+    conf = load_config(args.conf)
+    parameters = conf["parameters"]
+    credentials = conf["credentials"]
+    PARSER = parameters.get("PARSER", "html.parser")
+    archive_path = args.archive or parameters.get("ARCHIVE_PATH")
+    if not archive_path or not os.path.isdir(archive_path):
+        print("ERROR :: No archive found at " + str(archive_path))
+        raise SystemExit(1)
+    archive = PageArchive(archive_path)
+    with Pool(args.workers) as pool:
+        for kind in args.kinds:
+            storage = open_storage(parameters, credentials,
+                                   KIND_STORAGE[kind])
+            writer = BulkWriter(
+                storage, parameters.get("WRITE_BATCH_SIZE", 100),
+                parameters.get("WRITE_FLUSH_INTERVAL", 5.),
+                parameters.get("WRITE_QUEUE_SIZE", 1000))
+            print("INFO :: Extracting " + str(archive.count(kind)) +
+                  " archived " + kind + " page(s) with " +
+                  str(args.workers) + " process(es)")
+            tasks = ((archive_path, PARSER, kind, url, digest, query)
+                     for url, _, digest, query in archive.iter_pages(kind))
+            start = time()
+            n_pages = 0
+            for data in pool.imap_unordered(extract_page, tasks,
+                                            args.chunksize):
+                n_pages += 1
+                if data:
+                    writer.write(data)
+            writer.close()
+            storage.close()
+            seconds = max(time() - start, 1e-9)
+            print("INFO :: Extracted " + str(n_pages) + " " + kind +
+                  " page(s) in {:.1f} seconds ({:.1f} pages/sec)".format(
+                      seconds, n_pages / seconds))
+    archive.close()
@@ -3,16 +3,36 @@ Scrape linkedin jobs by using selenium, to simulate the navigation
 (click, scroll) and BeautifulSoup to parse the HTML code of the page
 Perform a number of queries and log a number of files
 for each scraped job offer.
-Write dataset to mongoDB with the scraped data
+Write dataset to mongoDB, or to local files, with the scraped data
 
 """
-from selenium.common.exceptions import TimeoutException
-from utils import init_driver, get_job_urls, login, print_scraped_data,\
-    load_config, get_unseen_urls, scroll_job_panel, connect_mongo
-from time import sleep
-from bs4 import BeautifulSoup
+from selenium.common.exceptions import WebDriverException
+from utils import open_driver, login, print_scraped_data, load_config,\
+    get_unseen_urls, make_soup, record_transfer, print_transfer_stats,\
+    create_nonexistent_dir, launch_profile, EXTRACTION_MODES
+from time import time, perf_counter
 from classes.JobScraper import JobScraper
+from classes.JobPaginator import JobPaginator
+from classes.Waiter import Waiter
+from classes.DriverPool import DriverPool
+from classes.BulkWriter import BulkWriter
+from classes.Storage import open_storage
+from classes.PageArchive import PageArchive
+from classes.Frontier import Frontier
+from classes.SeenIndex import SeenIndex
+from classes.MemoryWatchdog import MemoryWatchdog
+from classes.RateScheduler import RateScheduler, SimulatedClock
+from classes.Metrics import METRICS
+from classes.Profiler import RunProfiler, PROFILE_MODES
+from classes.SessionStore import SessionStore
+from classes.PageFetcher import PageFetcher
+from classes.Pipeline import Pipeline, Stage
+from classes.WorkQueue import open_work_queue
 import argparse
+import atexit
+import itertools
+import os
+import sys
 
 
 parser = argparse.ArgumentParser(
@@ -21,9 +41,46 @@ parser = argparse.ArgumentParser(
 )
 parser.add_argument('-c', '--conf',
                     type=str,
-                    metavar='',
+                    metavar='PATH',
                     required=True,
                     help='Specify the path of the configuration file')
+parser.add_argument('-r', '--record',
+                    type=str,
+                    metavar='DIR',
+                    default=None,
+                    help='Record the browsing session to this directory')
+parser.add_argument('--replay',
+                    type=str,
+                    metavar='DIR',
+                    default=None,
+                    help=('Replay offline the browsing session ' +
+                          'recorded in this directory'))
+parser.add_argument('--latency',
+                    type=float,
+                    metavar='SECONDS',
+                    default=0.,
+                    help='Seconds simulated by each page load of a replay')
+parser.add_argument('--no-pacing',
+                    action='store_true',
+                    help=('Pace the navigations on a simulated clock, ' +
+                          'without waiting for the rate limits, e.g. to ' +
+                          'time a replay without them'))
+parser.add_argument('--profile',
+                    type=str,
+                    choices=PROFILE_MODES,
+                    default=None,
+                    help=('Profile the run with cprofile or sampling, ' +
+                          'PROFILE_MODE if not set'))
+parser.add_argument('--profile-urls',
+                    type=int,
+                    metavar='N',
+                    default=None,
+                    help='Number of URLs profiled, PROFILE_URLS if not set')
+parser.add_argument('--profile-seconds',
+                    type=float,
+                    metavar='SECONDS',
+                    default=None,
+                    help='Seconds profiled, PROFILE_SECONDS if not set')
 args = parser.parse_args()
 conf = load_config(args.conf)
 parameters = conf["parameters"]
@@ -33,61 +90,404 @@ CHROMEDRIVER_PATH = parameters["CHROMEDRIVER_PATH"]
 QUERIES = parameters["JOB_QUERIES"]
 LINUSERNAME = credentials["LINUSERNAME"]
 LINPWD = credentials["LINPWD"]
-MONGOUSER = credentials["MONGOUSER"]
-MONGOPWD = credentials["MONGOPWD"]
-HOST = parameters["HOST"]
-client = connect_mongo(HOST, MONGOUSER, MONGOPWD)
-db = client["linkedin"]
-jobs = db["jobs"]
-driver = init_driver(CHROME_PATH, CHROMEDRIVER_PATH)
-driver.get("https://www.linkedin.com")
-login(driver, LINUSERNAME, LINPWD)
-JOB_SEARCH_URL = "https://www.linkedin.com/jobs/search/?keywords="
-for query in QUERIES:
-    driver.get(JOB_SEARCH_URL + query)
-    sleep(0.5)
-    scroll_job_panel(driver)
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
-    n_results_element = soup.find(class_="t-12 t-black--light t-normal")
-    n_results_string = n_results_element.get_text()
-    n_results = int(n_results_string.split()[0].replace(',', ''))
-    job_urls = get_job_urls(soup)
-    start = 25
-    url = JOB_SEARCH_URL + query + "&start=" + str(start)
-    while start < n_results:
-        try:
-            driver.get(url)
-            scroll_job_panel(driver)
-            soup = BeautifulSoup(driver.page_source, 'html.parser')
-            job_urls.extend(get_job_urls(soup))
-            start += 25
-        except TimeoutException:
-            print(
-                "\nINFO :: TimeoutException raised while getting " +
-                "URL\n" + url
-            )
-    if len(job_urls) == 0:
-        print()
-        print("WARNING :: Could not get any URLs for the query\n" +
-              query)
-        print("Please double-check that LinkedIn is not " +
-              "blocking the query")
-        continue
-    unseen_urls = get_unseen_urls(jobs, job_urls)
+PARSER = parameters.get("PARSER", "html.parser")
+EXTRACTION = parameters.get("EXTRACTION", "soup")
+if EXTRACTION not in EXTRACTION_MODES:
+    raise ValueError("Unknown extraction mode " + repr(EXTRACTION) +
+                     ", expected one of " + ", ".join(EXTRACTION_MODES))
+WAIT_DEADLINES = parameters.get("WAIT_DEADLINES", {})
+WAIT_QUIET_PERIOD = parameters.get("WAIT_QUIET_PERIOD", 0.5)
+CONCURRENCY = parameters.get("CONCURRENCY", 1)
+WRITE_BATCH_SIZE = parameters.get("WRITE_BATCH_SIZE", 100)
+WRITE_FLUSH_INTERVAL = parameters.get("WRITE_FLUSH_INTERVAL", 5.)
+WRITE_QUEUE_SIZE = parameters.get("WRITE_QUEUE_SIZE", 1000)
+ARCHIVE_PATH = parameters.get("ARCHIVE_PATH")
+SEARCH_TABS = parameters.get("SEARCH_TABS", 4)
+SEARCH_MAX_ATTEMPTS = parameters.get("SEARCH_MAX_ATTEMPTS", 3)
+HTTP_FETCH = parameters.get("HTTP_FETCH", False) and not args.replay
+LOG_DIRECTORY = parameters.get("LOG_DIRECTORY", "./logdir/")
+FRONTIER_PATH = parameters.get("FRONTIER_PATH", "./frontier.sqlite")
+DISCOVERY_TTL = parameters.get("DISCOVERY_TTL", 86400)
+URL_MAX_ATTEMPTS = parameters.get("URL_MAX_ATTEMPTS", 3)
+SEEN_INDEX_PATH = parameters.get("SEEN_INDEX_PATH", "./seen.sqlite")
+SEEN_INDEX_CAPACITY = parameters.get("SEEN_INDEX_CAPACITY", 1000000)
+RATE_LIMITS = parameters.get("RATE_LIMITS", {})
+BACKOFF_BASE = parameters.get("BACKOFF_BASE", 5.)
+BACKOFF_MAX = parameters.get("BACKOFF_MAX", 300.)
+METRICS_PORT = parameters.get("METRICS_PORT")
+METRICS_SUMMARY_PATH = parameters.get("METRICS_SUMMARY_PATH")
+METRICS_INTERVAL = parameters.get("METRICS_INTERVAL", 60.)
+PROFILE_MODE = args.profile or parameters.get("PROFILE_MODE")
+PROFILE_URLS = args.profile_urls or parameters.get("PROFILE_URLS")
+PROFILE_SECONDS = args.profile_seconds or parameters.get("PROFILE_SECONDS")
+PROFILE_DIRECTORY = parameters.get("PROFILE_DIRECTORY", "./logdir/profiles/")
+BROWSER_PROFILE = launch_profile(parameters.get("BROWSER_PROFILE", "full"),
+                                 parameters.get("BROWSER_OPTIONS"))
+SESSION_PATH = parameters.get("SESSION_PATH")
+SESSION_MAX_AGE = parameters.get("SESSION_MAX_AGE", 7 * 86400.)
+PIPELINE_QUEUE_SIZE = parameters.get("PIPELINE_QUEUE_SIZE", 100)
+CLAIM_BATCH_SIZE = parameters.get("CLAIM_BATCH_SIZE", 10)
+# a recorded or replayed session keeps the drivers it has started with
+MAX_PAGES_PER_DRIVER = None if args.record or args.replay\
+    else parameters.get("MAX_PAGES_PER_DRIVER")
+BROWSER_RSS_LIMIT_MB = None if args.record or args.replay\
+    else parameters.get("BROWSER_RSS_LIMIT_MB")
+MEMORY_INTERVAL = parameters.get("MEMORY_INTERVAL", 60.)
+MEMORY_TRACE_HEAP = parameters.get("MEMORY_TRACE_HEAP", False)
+PARSE_WORKERS = parameters.get("PARSE_WORKERS", 1)
+frontier = Frontier(":memory:" if args.replay else FRONTIER_PATH,
+                    DISCOVERY_TTL, URL_MAX_ATTEMPTS)
+# IDs of the pages already scraped, whatever the form of their URLs
+seen_index = SeenIndex(":memory:" if args.replay else SEEN_INDEX_PATH,
+                       SEEN_INDEX_CAPACITY)
+scheduler = RateScheduler(RATE_LIMITS, backoff_base=BACKOFF_BASE,
+                          backoff_max=BACKOFF_MAX,
+                          clock=SimulatedClock() if args.no_pacing
+                          else None)
+storage = open_storage(parameters, credentials, "jobs")
+atexit.register(storage.close)
+seen_index.backfill(storage, "jobs")
+# URLs shared with the other hosts scraping the same queries, if enabled
+work_queue = open_work_queue(parameters, credentials, "jobs")
+if work_queue is not None:
+    work_queue.start_heartbeat()
+    atexit.register(work_queue.stop)
+
+
+def mark_done(urls):
+    """
+    Mark scraped URLs as done in the frontier and in the work queue,
+    and record their IDs in the seen index.
+    """
+    frontier.mark_done(urls)
+    seen_index.add(urls)
+    if work_queue is not None:
+        work_queue.complete(urls)
+
+
+def write_failed(urls, error):
+    """
+    Put back in the frontier and in the work queue scraped URLs whose
+    records could not be written, to scrape them again.
+    """
+    for url in urls:
+        frontier.mark_failed(url, error)
+        if work_queue is not None:
+            work_queue.fail(url, error)
+
+
+writer = BulkWriter(storage, WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL,
+                    WRITE_QUEUE_SIZE, mark_done, write_failed)
+atexit.register(writer.close)
+if METRICS_PORT is not None:
+    METRICS.serve(METRICS_PORT)
+if METRICS_SUMMARY_PATH:
+    METRICS.start_summary(METRICS_SUMMARY_PATH, METRICS_INTERVAL)
+atexit.register(METRICS.stop)
+profiler = None
+if PROFILE_MODE:
+    # the drivers of the pool, the parsing and the job search
+    profiler = RunProfiler(PROFILE_DIRECTORY, PROFILE_MODE, PROFILE_URLS,
+                           PROFILE_SECONDS,
+                           threads=CONCURRENCY + PARSE_WORKERS + 1)
+    profiler.start()
+    atexit.register(profiler.close)
+archive = PageArchive(ARCHIVE_PATH) if ARCHIVE_PATH else None
+# a recorded session logs in by typing the credentials, as its replay does
+session_store = None
+if SESSION_PATH and not (args.record or args.replay):
+    session_store = SessionStore(SESSION_PATH, SESSION_MAX_AGE, scheduler)
+driver = open_driver(CHROME_PATH, CHROMEDRIVER_PATH,
+                     args.record, args.replay, args.latency, "main",
+                     BROWSER_PROFILE)
+waiter = Waiter(driver, WAIT_DEADLINES, WAIT_QUIET_PERIOD)
+run_start = time()
+transfer_stats = {}
+driver_count = itertools.count()
+
+
+def log_in(session_driver):
+    """
+    Log a driver in on linkedin.com, restoring the saved session if any.
+    Raise a WebDriverException if it could not be logged in, not to
+    scrape logged-out pages with it.
+    """
+    if session_store is None:
+        scheduler.navigate(session_driver, "https://www.linkedin.com")
+        login(session_driver, LINUSERNAME, LINPWD)
+    elif not session_store.ensure_login(session_driver, LINUSERNAME,
+                                        LINPWD):
+        raise WebDriverException("Could not log in on linkedin.com")
+
+
+def new_driver():
+    """
+    Start a driver of the pool and log it in on linkedin.com.
+    """
+    pool_driver = open_driver(CHROME_PATH, CHROMEDRIVER_PATH,
+                              args.record, args.replay, args.latency,
+                              "worker-" + str(next(driver_count)),
+                              BROWSER_PROFILE)
+    try:
+        log_in(pool_driver)
+    except Exception:
+        pool_driver.quit()
+        raise
+    return pool_driver
+
+
+def recycle_main_driver():
+    """
+    Replace the main driver by a new one, logged in, once it has loaded
+    MAX_PAGES_PER_DRIVER results pages or its browser has grown above
+    BROWSER_RSS_LIMIT_MB, to free the memory the browser accumulates.
+    Called between two searches.
+    """
+    global driver
+    if MAX_PAGES_PER_DRIVER is not None and\
+       paginator.pages_read >= MAX_PAGES_PER_DRIVER:
+        reason = str(paginator.pages_read) + " pages"
+    elif watchdog.is_over_limit("main"):
+        reason = "rss above " + str(BROWSER_RSS_LIMIT_MB) + " MiB"
+    else:
+        return
+    print("INFO :: Recycling the main driver: " + reason)
+    METRICS.inc("driver_recycles_total")
+    try:
+        driver.quit()
+    except Exception:
+        pass
+    driver = open_driver(CHROME_PATH, CHROMEDRIVER_PATH,
+                         args.record, args.replay, args.latency, "main",
+                         BROWSER_PROFILE)
+    watchdog.watch("main", driver)
+    try:
+        log_in(driver)
+    except WebDriverException as e:
+        print("ERROR :: " + e.msg + ". LinkedIn might be asking " +
+              "for a verification")
+        sys.exit(1)
+    paginator.set_driver(driver)
+
+
+def fetch(pool_driver, item):
+    """
+    Get the page of a (query, URL) item over HTTP, or with a driver of
+    the pool, and the job data extracted in the page if asked for.
+    Return the item, the page source if it is to be parsed or archived,
+    the job data, the transfer mode of the page source to parse and the
+    seconds its transfer took. In the in_page mode, a page source
+    transferred only to be archived is counted in the in_page statistics.
+    """
+    _, url = item
+    if fetcher is not None:
+        fetch_start = perf_counter()
+        with METRICS.timer("fetch", kind="job"):
+            page_source, _ = fetcher.fetch(url, pool_driver)
+        if page_source is not None:
+            return item, page_source, None, "http",\
+                perf_counter() - fetch_start
+    else:
+        with METRICS.timer("navigate", kind="job"):
+            scheduler.navigate(pool_driver, url)
+    job_data = None
+    page_source = None
+    if EXTRACTION in ("in_page", "compare"):
+        extraction_start = perf_counter()
+        with METRICS.timer("in_page", kind="job"):
+            job_data, n_bytes = JobScraper.get_job_data_in_page(
+                pool_driver, url, item[0])
+        record_transfer(transfer_stats, "in_page", n_bytes,
+                        perf_counter() - extraction_start)
+    mode = "soup" if EXTRACTION in ("soup", "compare") else None
+    source_seconds = 0.
+    if mode is not None or archive is not None:
+        source_start = perf_counter()
+        with METRICS.timer("page_source", kind="job"):
+            page_source = pool_driver.page_source
+        source_seconds = perf_counter() - source_start
+        if mode is None:
+            record_transfer(transfer_stats, "in_page",
+                            len(page_source.encode('utf-8')),
+                            source_seconds, pages=0)
+    return item, page_source, job_data, mode, source_seconds
+
+
+def parse(fetched):
+    """
+    Extract the job data of a fetched page, out of the drivers of the
+    pool, and archive the page.
+    """
+    item, page_source, job_data, mode, source_seconds = fetched
+    query, url = item
+    if mode is not None and page_source is not None:
+        parse_start = perf_counter()
+        with METRICS.timer("parse", kind="job"):
+            soup = make_soup(page_source, PARSER, JobScraper.PAGE_CLASSES)
+        soup_job_data = JobScraper(soup, url, query).get_job_data()
+        soup.decompose()
+        record_transfer(transfer_stats, mode,
+                        len(page_source.encode('utf-8')),
+                        source_seconds + perf_counter() - parse_start)
+        if job_data is not None and job_data != soup_job_data:
+            print("WARNING :: In-page and soup extraction differ " +
+                  "for URL\n" + url)
+        job_data = soup_job_data
+    if archive is not None and page_source is not None:
+        archive.store(url, page_source, "job", query)
+    return item, job_data
+
+
+def discover(query):
+    """
+    Search a query on LinkedIn and yield the (query, URL) items of the
+    jobs not scraped yet.
+    """
+    if frontier.is_finished("job", query):
+        print("INFO :: All job URLs for the query " + query +
+              " have already been scraped. " +
+              "Moving onto the next query if any.")
+        return
+    if not frontier.is_discovered("job", query):
+        recycle_main_driver()
+        job_urls = search(JOB_SEARCH_URL + query)
+        if len(job_urls) == 0:
+            print()
+            print("WARNING :: Could not get any URLs for the query\n" +
+                  query)
+            print("Please double-check that LinkedIn is not " +
+                  "blocking the query")
+            return
+        frontier.add_urls("job", query, job_urls)
+    pending_urls = frontier.get_urls("job", query)
+    unseen_urls = get_unseen_urls(storage, pending_urls, seen_index)
+    frontier.mark_done(sorted(set(pending_urls) - set(unseen_urls)))
     if len(unseen_urls) != 0:
         print("INFO :: Resuming from URL", unseen_urls[0])
     else:
         print("INFO :: All job URLs for the query " + query +
               " have already been scraped. " +
               "Moving onto the next query if any.")
-        continue
-    for url in unseen_urls:
-        driver.get(url)
-        soup = BeautifulSoup(driver.page_source, 'html.parser')
-        js = JobScraper(soup, url, query)
-        job_data = js.get_job_data()
-        if job_data and\
-           not db["jobs"].count_documents(job_data, limit=1):
-            print_scraped_data(job_data)
-            jobs.insert_one(job_data)
+        frontier.finish_query("job", query)
+        return
+    if work_queue is None:
+        frontier.mark_in_flight(unseen_urls)
+        for url in unseen_urls:
+            yield query, url
+        return
+    # only the URLs claimed by this host, a batch at a time
+    work_queue.add("job", query, unseen_urls)
+    while True:
+        claimed = [url for _, url in work_queue.claim(
+            "job", CLAIM_BATCH_SIZE, query)]
+        if not claimed:
+            return
+        frontier.mark_in_flight(claimed)
+        for url in claimed:
+            yield query, url
+
+
+def scrape_failed(item, error):
+    """
+    Put back in the frontier a (query, URL) item that could not be scraped.
+    """
+    _, url = item
+    print("ERROR :: Could not scrape URL\n" + url + "\n" + error)
+    METRICS.inc("pages_total", kind="job", outcome="failed")
+    frontier.mark_failed(url, error)
+    if work_queue is not None:
+        work_queue.fail(url, error)
+
+
+def store(parsed):
+    """
+    Write the job data of a (query, URL) item, or mark the URL as
+    scraped if there is none.
+    """
+    (_, url), job_data = parsed
+    METRICS.inc("pages_total", kind="job",
+                outcome="scraped" if job_data else "empty")
+    if job_data:
+        print_scraped_data(job_data)
+        writer.write(job_data)
+    else:
+        mark_done([url])
+
+
+fetcher = None
+handler = fetch
+extract = parse
+if profiler is not None:
+    handler = profiler.wrap(fetch, count=True)
+    extract = profiler.wrap(parse)
+# the drivers of the pool start and log in while the main driver does
+pool = DriverPool(new_driver, handler, CONCURRENCY,
+                  max_pages=MAX_PAGES_PER_DRIVER)
+pool.start()
+watchdog = MemoryWatchdog(pool, {"main": driver}, MEMORY_INTERVAL,
+                          BROWSER_RSS_LIMIT_MB, MEMORY_TRACE_HEAP)
+watchdog.start()
+try:
+    log_in(driver)
+except WebDriverException as e:
+    print("ERROR :: " + e.msg + ". LinkedIn might be asking " +
+          "for a verification")
+    sys.exit(1)
+if HTTP_FETCH:
+    fetcher = PageFetcher(pool_size=CONCURRENCY, scheduler=scheduler)
+    fetcher.load_session(driver)
+METRICS.watch("queue_depth", writer.records.qsize, queue="write")
+METRICS.watch("in_flight", lambda: pool.submitted - pool.done)
+paginator = JobPaginator(driver, PARSER, waiter, SEARCH_TABS,
+                         SEARCH_MAX_ATTEMPTS, frontier=frontier,
+                         scheduler=scheduler)
+search = paginator.get_job_urls
+if profiler is not None:
+    search = profiler.wrap(search)
+JOB_SEARCH_URL = "https://www.linkedin.com/jobs/search/?keywords="
+# the job search, the drivers of the pool, the parsing and the storage
+# work at the same time
+pipeline = Pipeline([
+    Stage("discover", discover, expand=True),
+    Stage("fetch", pool=pool, queue_size=PIPELINE_QUEUE_SIZE,
+          on_error=scrape_failed),
+    Stage("parse", extract, PARSE_WORKERS, PIPELINE_QUEUE_SIZE,
+          on_error=scrape_failed),
+    Stage("store", store, queue_size=PIPELINE_QUEUE_SIZE)])
+pipeline.run(QUERIES)
+n_scraped = pipeline.stages[1].items_in
+watchdog.stop()
+watchdog.log()
+pool.close()
+writer.close()
+storage.close()
+for query in QUERIES:
+    frontier.finish_query("job", query)
+frontier.report("job")
+if work_queue is not None:
+    work_queue.stop()
+    work_queue.report("job")
+frontier.close()
+seen_index.report()
+seen_index.close()
+if archive is not None:
+    archive.close()
 driver.quit()
+if fetcher is not None:
+    fetcher.close()
+    fetcher.report()
+    create_nonexistent_dir(LOG_DIRECTORY)
+    fetcher.save_paths(os.path.join(LOG_DIRECTORY, "job_fetch_paths.csv"))
+waiter.report()
+scheduler.report()
+pipeline.report()
+watchdog.report()
+METRICS.stop()
+METRICS.report()
+if profiler is not None:
+    profiler.close()
+print_transfer_stats(transfer_stats)
+run_minutes = (time() - run_start) / 60.
+print("INFO :: Scraped " + str(n_scraped) + " job URLs in " +
+      "{:.1f} minutes ({:.1f} URLs/minute)".format(
+          run_minutes, n_scraped / run_minutes))
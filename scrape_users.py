@@ -3,17 +3,37 @@ Scrape linkedin URLs by using selenium, to simulate the navigation
 (click, scroll) and BeautifulSoup to parse the HTML code of the page
 Perform a number of queries and log a number of files
 for each scraped user.
-Write dataset to mongoDB with the scraped data
+Write dataset to mongoDB, or to local files, with the scraped data
 
 """
 from selenium.webdriver.common.keys import Keys
-from selenium.common.exceptions import ElementNotInteractableException
-from utils import init_driver, get_profile_urls, login,\
-    print_scraped_data, load_config,\
-    get_unseen_urls, connect_mongo
-from time import sleep
+from selenium.webdriver.common.by import By
+from selenium.common.exceptions import ElementNotInteractableException,\
+    TimeoutException, WebDriverException
+from utils import open_driver, iter_profile_urls, login,\
+    print_scraped_data, load_config, launch_profile,\
+    get_unseen_urls, print_transfer_stats, merge_transfer_stats,\
+    EXTRACTION_MODES
+from time import time
+from threading import Lock
 from classes.UserScraper import UserScraper
+from classes.Waiter import Waiter
+from classes.DriverPool import DriverPool
+from classes.BulkWriter import BulkWriter
+from classes.Storage import open_storage
+from classes.PageArchive import PageArchive
+from classes.Frontier import Frontier
+from classes.SeenIndex import SeenIndex
+from classes.MemoryWatchdog import MemoryWatchdog
+from classes.RateScheduler import RateScheduler, SimulatedClock
+from classes.Metrics import METRICS
+from classes.Profiler import RunProfiler, PROFILE_MODES
+from classes.SessionStore import SessionStore
+from classes.Pipeline import Pipeline, Stage
+from classes.WorkQueue import open_work_queue
 import argparse
+import atexit
+import itertools
 import sys
 
 
@@ -24,10 +44,58 @@ parser = argparse.ArgumentParser(
 parser.add_argument(
     '-c', '--conf',
     type=str,
-    metavar='',
+    metavar='PATH',
     required=True,
     help='Specify the path of the configuration file'
 )
+parser.add_argument(
+    '-r', '--record',
+    type=str,
+    metavar='DIR',
+    default=None,
+    help='Record the browsing session to this directory'
+)
+parser.add_argument(
+    '--replay',
+    type=str,
+    metavar='DIR',
+    default=None,
+    help='Replay offline the browsing session recorded in this directory'
+)
+parser.add_argument(
+    '--latency',
+    type=float,
+    metavar='SECONDS',
+    default=0.,
+    help='Seconds simulated by each page load of a replay'
+)
+parser.add_argument(
+    '--no-pacing',
+    action='store_true',
+    help=('Pace the navigations on a simulated clock, without waiting ' +
+          'for the rate limits, e.g. to time a replay without them')
+)
+parser.add_argument(
+    '--profile',
+    type=str,
+    choices=PROFILE_MODES,
+    default=None,
+    help='Profile the run with cprofile or sampling, PROFILE_MODE if not set'
+)
+parser.add_argument(
+    '--profile-urls',
+    type=int,
+    metavar='N',
+    default=None,
+    help='Number of URLs profiled, PROFILE_URLS if not set'
+)
+parser.add_argument(
+    '--profile-seconds',
+    type=float,
+    metavar='SECONDS',
+    default=None,
+    help='Seconds profiled, PROFILE_SECONDS if not set'
+)
 args = parser.parse_args()
 conf = load_config(args.conf)
 parameters = conf["parameters"]
@@ -38,48 +106,406 @@ QUERIES = parameters["USER_QUERIES"]
 N_PAGES = parameters["N_PAGES"]
 LINUSERNAME = credentials["LINUSERNAME"]
 LINPWD = credentials["LINPWD"]
-MONGOUSER = credentials["MONGOUSER"]
-MONGOPWD = credentials["MONGOPWD"]
-HOST = parameters["HOST"]
-client = connect_mongo(HOST, MONGOUSER, MONGOPWD)
-db = client["linkedin"]
-users = db["users"]
-driver = init_driver(CHROME_PATH, CHROMEDRIVER_PATH)
-driver.get("https://www.linkedin.com")
-login(driver, LINUSERNAME, LINPWD)
-us = UserScraper(driver)
-for query in QUERIES:
-    driver.get("https://www.google.com")
-    sleep(2)
-    search_query = driver.find_element_by_name('q')
+PARSER = parameters.get("PARSER", "html.parser")
+EXTRACTION = parameters.get("EXTRACTION", "soup")
+if EXTRACTION not in EXTRACTION_MODES:
+    raise ValueError("Unknown extraction mode " + repr(EXTRACTION) +
+                     ", expected one of " + ", ".join(EXTRACTION_MODES))
+WAIT_DEADLINES = parameters.get("WAIT_DEADLINES", {})
+WAIT_QUIET_PERIOD = parameters.get("WAIT_QUIET_PERIOD", 0.5)
+CONCURRENCY = parameters.get("CONCURRENCY", 1)
+WRITE_BATCH_SIZE = parameters.get("WRITE_BATCH_SIZE", 100)
+WRITE_FLUSH_INTERVAL = parameters.get("WRITE_FLUSH_INTERVAL", 5.)
+WRITE_QUEUE_SIZE = parameters.get("WRITE_QUEUE_SIZE", 1000)
+ARCHIVE_PATH = parameters.get("ARCHIVE_PATH")
+FRONTIER_PATH = parameters.get("FRONTIER_PATH", "./frontier.sqlite")
+DISCOVERY_TTL = parameters.get("DISCOVERY_TTL", 86400)
+URL_MAX_ATTEMPTS = parameters.get("URL_MAX_ATTEMPTS", 3)
+SEEN_INDEX_PATH = parameters.get("SEEN_INDEX_PATH", "./seen.sqlite")
+SEEN_INDEX_CAPACITY = parameters.get("SEEN_INDEX_CAPACITY", 1000000)
+RATE_LIMITS = parameters.get("RATE_LIMITS", {})
+BACKOFF_BASE = parameters.get("BACKOFF_BASE", 5.)
+BACKOFF_MAX = parameters.get("BACKOFF_MAX", 300.)
+METRICS_PORT = parameters.get("METRICS_PORT")
+METRICS_SUMMARY_PATH = parameters.get("METRICS_SUMMARY_PATH")
+METRICS_INTERVAL = parameters.get("METRICS_INTERVAL", 60.)
+PROFILE_MODE = args.profile or parameters.get("PROFILE_MODE")
+PROFILE_URLS = args.profile_urls or parameters.get("PROFILE_URLS")
+PROFILE_SECONDS = args.profile_seconds or parameters.get("PROFILE_SECONDS")
+PROFILE_DIRECTORY = parameters.get("PROFILE_DIRECTORY", "./logdir/profiles/")
+BROWSER_PROFILE = launch_profile(parameters.get("BROWSER_PROFILE", "full"),
+                                 parameters.get("BROWSER_OPTIONS"))
+SESSION_PATH = parameters.get("SESSION_PATH")
+SESSION_MAX_AGE = parameters.get("SESSION_MAX_AGE", 7 * 86400.)
+PIPELINE_QUEUE_SIZE = parameters.get("PIPELINE_QUEUE_SIZE", 100)
+CLAIM_BATCH_SIZE = parameters.get("CLAIM_BATCH_SIZE", 10)
+# a recorded or replayed session keeps the drivers it has started with
+MAX_PAGES_PER_DRIVER = None if args.record or args.replay\
+    else parameters.get("MAX_PAGES_PER_DRIVER")
+BROWSER_RSS_LIMIT_MB = None if args.record or args.replay\
+    else parameters.get("BROWSER_RSS_LIMIT_MB")
+MEMORY_INTERVAL = parameters.get("MEMORY_INTERVAL", 60.)
+MEMORY_TRACE_HEAP = parameters.get("MEMORY_TRACE_HEAP", False)
+GOOGLE_URL = "https://www.google.com"
+frontier = Frontier(":memory:" if args.replay else FRONTIER_PATH,
+                    DISCOVERY_TTL, URL_MAX_ATTEMPTS)
+# IDs of the pages already scraped, whatever the form of their URLs
+seen_index = SeenIndex(":memory:" if args.replay else SEEN_INDEX_PATH,
+                       SEEN_INDEX_CAPACITY)
+scheduler = RateScheduler(RATE_LIMITS, backoff_base=BACKOFF_BASE,
+                          backoff_max=BACKOFF_MAX,
+                          clock=SimulatedClock() if args.no_pacing
+                          else None)
+storage = open_storage(parameters, credentials, "users")
+atexit.register(storage.close)
+seen_index.backfill(storage, "users")
+# URLs shared with the other hosts scraping the same queries, if enabled
+work_queue = open_work_queue(parameters, credentials, "users")
+if work_queue is not None:
+    work_queue.start_heartbeat()
+    atexit.register(work_queue.stop)
+
+
+def mark_done(urls):
+    """
+    Mark scraped URLs as done in the frontier and in the work queue,
+    and record their IDs in the seen index.
+    """
+    frontier.mark_done(urls)
+    seen_index.add(urls)
+    if work_queue is not None:
+        work_queue.complete(urls)
+
+
+def write_failed(urls, error):
+    """
+    Put back in the frontier and in the work queue scraped URLs whose
+    records could not be written, to scrape them again.
+    """
+    for url in urls:
+        frontier.mark_failed(url, error)
+        if work_queue is not None:
+            work_queue.fail(url, error)
+
+
+writer = BulkWriter(storage, WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL,
+                    WRITE_QUEUE_SIZE, mark_done, write_failed)
+atexit.register(writer.close)
+if METRICS_PORT is not None:
+    METRICS.serve(METRICS_PORT)
+if METRICS_SUMMARY_PATH:
+    METRICS.start_summary(METRICS_SUMMARY_PATH, METRICS_INTERVAL)
+atexit.register(METRICS.stop)
+profiler = None
+if PROFILE_MODE:
+    # the drivers of the pool and the discovery
+    profiler = RunProfiler(PROFILE_DIRECTORY, PROFILE_MODE, PROFILE_URLS,
+                           PROFILE_SECONDS, threads=CONCURRENCY + 1)
+    profiler.start()
+    atexit.register(profiler.close)
+archive = PageArchive(ARCHIVE_PATH) if ARCHIVE_PATH else None
+# a recorded session logs in by typing the credentials, as its replay does
+session_store = None
+if SESSION_PATH and not (args.record or args.replay):
+    session_store = SessionStore(SESSION_PATH, SESSION_MAX_AGE, scheduler)
+driver = open_driver(CHROME_PATH, CHROMEDRIVER_PATH,
+                     args.record, args.replay, args.latency, "main",
+                     BROWSER_PROFILE)
+waiter = Waiter(driver, WAIT_DEADLINES, WAIT_QUIET_PERIOD)
+run_start = time()
+scrapers = {}
+driver_count = itertools.count()
+# Google pages loaded by the main driver, to recycle it
+main_pages = 0
+# waits and transfers of the drivers of the pool that have been quit
+transfer_stats = {}
+retired_lock = Lock()
+
+
+def log_in(session_driver):
+    """
+    Log a driver in on linkedin.com, restoring the saved session if any.
+    Raise a WebDriverException if it could not be logged in, not to
+    scrape logged-out pages with it.
+    """
+    if session_store is None:
+        scheduler.navigate(session_driver, "https://www.linkedin.com")
+        login(session_driver, LINUSERNAME, LINPWD)
+    elif not session_store.ensure_login(session_driver, LINUSERNAME,
+                                        LINPWD):
+        raise WebDriverException("Could not log in on linkedin.com")
+
+
+def new_driver():
+    """
+    Start a driver of the pool and log it in on linkedin.com.
+    """
+    pool_driver = open_driver(CHROME_PATH, CHROMEDRIVER_PATH,
+                              args.record, args.replay, args.latency,
+                              "worker-" + str(next(driver_count)),
+                              BROWSER_PROFILE)
     try:
-        search_query.send_keys(query)
-    except ElementNotInteractableException:
-        print("ERROR :: Cannot send query. Google might be blocking")
-        sys.exit(1)
-    sleep(0.5)
-    search_query.send_keys(Keys.RETURN)
-    profile_urls = get_profile_urls(driver, N_PAGES)
-    if len(profile_urls) == 0:
-        print()
-        print("WARNING :: " +
-              "Could not get any URLs for the query\n" + query)
-        print("Please double-check that Google is not " +
-              "blocking the query")
-        continue
-    unseen_urls = get_unseen_urls(users, profile_urls)
-    if len(unseen_urls) != 0:
-        print("INFO :: Resuming from URL", unseen_urls[0])
+        log_in(pool_driver)
+    except Exception:
+        pool_driver.quit()
+        raise
+    scrapers[pool_driver] = UserScraper(
+        pool_driver, PARSER,
+        Waiter(pool_driver, WAIT_DEADLINES, WAIT_QUIET_PERIOD), EXTRACTION,
+        archive, scheduler)
+    return pool_driver
+
+
+def retire_scraper(pool_driver):
+    """
+    Drop the scraper of a driver of the pool that has been quit, keeping
+    its waits and transfers for the report of the run.
+    """
+    us = scrapers.pop(pool_driver, None)
+    if us is None:
+        return
+    with retired_lock:
+        waiter.absorb(us.waiter)
+    merge_transfer_stats(transfer_stats, us.transfer_stats)
+
+
+def scrape(pool_driver, item):
+    """
+    Scrape a (query, URL) item with a driver of the pool.
+    """
+    query, url = item
+    return item, scrapers[pool_driver].scrape_user(query, url)
+
+
+def claim_urls(query, urls):
+    """
+    Yield the URLs of a query not already scraped, marking them in
+    flight. With a work queue, yield only the ones claimed by this
+    host, a batch at a time.
+    """
+    unseen = get_unseen_urls(storage, urls, seen_index)
+    frontier.mark_done(sorted(set(urls) - set(unseen)))
+    if work_queue is None:
+        frontier.mark_in_flight(unseen)
+        yield from unseen
+        return
+    work_queue.add("profile", query, unseen)
+    while True:
+        claimed = [url for _, url in work_queue.claim(
+            "profile", CLAIM_BATCH_SIZE, query)]
+        if not claimed:
+            return
+        frontier.mark_in_flight(claimed)
+        yield from claimed
+
+
+def recycle_main_driver():
+    """
+    Replace the main driver by a new one once it has loaded
+    MAX_PAGES_PER_DRIVER Google pages or its browser has grown above
+    BROWSER_RSS_LIMIT_MB, to free the memory the browser accumulates.
+    Called between two searches.
+    """
+    global driver, main_pages
+    if MAX_PAGES_PER_DRIVER is not None and\
+       main_pages >= MAX_PAGES_PER_DRIVER:
+        reason = str(main_pages) + " pages"
+    elif watchdog.is_over_limit("main"):
+        reason = "rss above " + str(BROWSER_RSS_LIMIT_MB) + " MiB"
     else:
+        return
+    print("INFO :: Recycling the main driver: " + reason)
+    METRICS.inc("driver_recycles_total")
+    try:
+        driver.quit()
+    except Exception:
+        pass
+    driver = open_driver(CHROME_PATH, CHROMEDRIVER_PATH,
+                         args.record, args.replay, args.latency, "main",
+                         BROWSER_PROFILE)
+    watchdog.watch("main", driver)
+    waiter.driver = driver
+    main_pages = 0
+
+
+def discover(query):
+    """
+    Search a query on Google and yield the (query, URL) items of the
+    profiles not scraped yet, page by page, then of the ones left
+    pending by a previous run.
+    """
+    global main_pages
+    if frontier.is_finished("profile", query):
+        print("INFO :: All URLs for the query " + query +
+              " have already been scraped. " +
+              "Moving onto the next query if any.")
+        return
+    n_submitted = 0
+    if not frontier.is_discovered("profile", query):
+        # the results pages read by a run interrupted during the
+        # discovery, whose URLs are already in the frontier
+        n_discovered = 0
+        next_page_url = None
+        start = 0
+        while start < N_PAGES:
+            page = frontier.get_page("profile", query, start)
+            if page is None:
+                break
+            n_discovered += len(page[0])
+            next_page_url = page[2]
+            start += 1
+        if n_discovered == 0:
+            # nothing to resume from, e.g. Google was blocking
+            start = 0
+        recycle_main_driver()
+        pages = iter(())
+        if start == 0:
+            main_pages += 1
+            try:
+                scheduler.navigate(driver, GOOGLE_URL)
+            except TimeoutException:
+                print("WARNING :: Cannot load Google. " +
+                      "Google might be blocking")
+                return
+            waiter.until_present("search_load", By.NAME, 'q')
+            search_query = driver.find_element_by_name('q')
+            try:
+                search_query.send_keys(query)
+            except ElementNotInteractableException:
+                print("ERROR :: Cannot send query. " +
+                      "Google might be blocking")
+                sys.exit(1)
+            scheduler.acquire(GOOGLE_URL)
+            search_query.send_keys(Keys.RETURN)
+            try:
+                scheduler.check(driver, GOOGLE_URL)
+            except TimeoutException:
+                print("WARNING :: Google is blocking the query\n" + query)
+                return
+            pages = iter_profile_urls(driver, N_PAGES, scheduler)
+        elif start < N_PAGES and next_page_url is not None:
+            print("INFO :: Resuming the search of the query " + query +
+                  " from results page " + str(start + 1))
+            try:
+                scheduler.navigate(driver, next_page_url)
+                pages = iter_profile_urls(driver, N_PAGES - start,
+                                          scheduler)
+            except TimeoutException:
+                print("WARNING :: Google is blocking the query\n" + query)
+                return
+        # the URLs of each results page are scraped while the next loads
+        for profile_urls, next_page_url in iter(
+                lambda: read_next(pages, None), None):
+            frontier.add_urls("profile", query, profile_urls,
+                              discovered=False)
+            frontier.save_page("profile", query, start, profile_urls,
+                               next_url=next_page_url)
+            start += 1
+            main_pages += 1
+            n_discovered += len(profile_urls)
+            for url in claim_urls(query, profile_urls):
+                n_submitted += 1
+                yield query, url
+        if n_discovered == 0:
+            scheduler.failure(GOOGLE_URL, "empty")
+            print()
+            print("WARNING :: " +
+                  "Could not get any URLs for the query\n" + query)
+            print("Please double-check that Google is not " +
+                  "blocking the query")
+            return
+        frontier.add_urls("profile", query, [])
+    pending_urls = frontier.get_urls("profile", query)
+    if len(pending_urls) != 0:
+        print("INFO :: Resuming from URL", pending_urls[0])
+    for url in claim_urls(query, pending_urls):
+        n_submitted += 1
+        yield query, url
+    if n_submitted == 0:
         print("INFO :: All URLs from " + str(N_PAGES) +
               " Google-search page(s) for the query " + query +
               " have already been scraped. " +
               "Moving onto the next query if any.")
-        continue
-    for url in unseen_urls:
-        user_data = us.scrape_user(query, url)
-        if user_data and\
-           not db["users"].count_documents(user_data, limit=1):
-            print_scraped_data(user_data)
-            users.insert_one(user_data)
+        frontier.finish_query("profile", query)
+
+
+def scrape_failed(item, error):
+    """
+    Put back in the frontier a (query, URL) item that could not be scraped.
+    """
+    _, url = item
+    print("ERROR :: Could not scrape URL\n" + url + "\n" + error)
+    METRICS.inc("pages_total", kind="profile", outcome="failed")
+    frontier.mark_failed(url, error)
+    if work_queue is not None:
+        work_queue.fail(url, error)
+
+
+def store(scraped):
+    """
+    Write the user data scraped from a (query, URL) item, or mark
+    the URL as scraped if there is none.
+    """
+    (_, url), user_data = scraped
+    METRICS.inc("pages_total", kind="profile",
+                outcome="scraped" if user_data else "empty")
+    if user_data:
+        print_scraped_data(user_data)
+        writer.write(user_data)
+    else:
+        mark_done([url])
+
+
+handler = scrape
+read_next = next
+if profiler is not None:
+    handler = profiler.wrap(scrape, count=True)
+    read_next = profiler.wrap(next)
+pool = DriverPool(new_driver, handler, CONCURRENCY,
+                  max_pages=MAX_PAGES_PER_DRIVER, on_quit=retire_scraper)
+pool.start()
+watchdog = MemoryWatchdog(pool, {"main": driver}, MEMORY_INTERVAL,
+                          BROWSER_RSS_LIMIT_MB, MEMORY_TRACE_HEAP)
+watchdog.start()
+METRICS.watch("queue_depth", writer.records.qsize, queue="write")
+METRICS.watch("in_flight", lambda: pool.submitted - pool.done)
+# Google, the drivers of the pool and the storage work at the same time
+pipeline = Pipeline([
+    Stage("discover", discover, expand=True),
+    Stage("scrape", pool=pool, queue_size=PIPELINE_QUEUE_SIZE,
+          on_error=scrape_failed),
+    Stage("store", store, queue_size=PIPELINE_QUEUE_SIZE)])
+pipeline.run(QUERIES)
+n_scraped = pipeline.stages[1].items_in
+watchdog.stop()
+watchdog.log()
+pool.close()
+writer.close()
+storage.close()
+for query in QUERIES:
+    frontier.finish_query("profile", query)
+frontier.report("profile")
+if work_queue is not None:
+    work_queue.stop()
+    work_queue.report("profile")
+frontier.close()
+seen_index.report()
+seen_index.close()
+if archive is not None:
+    archive.close()
 driver.quit()
+for pool_driver in list(scrapers):
+    retire_scraper(pool_driver)
+waiter.report()
+scheduler.report()
+pipeline.report()
+watchdog.report()
+METRICS.stop()
+METRICS.report()
+if profiler is not None:
+    profiler.close()
+print_transfer_stats(transfer_stats)
+run_minutes = (time() - run_start) / 60.
+print("INFO :: Scraped " + str(n_scraped) + " profile URLs in " +
+      "{:.1f} minutes ({:.1f} URLs/minute)".format(
+          run_minutes, n_scraped / run_minutes))
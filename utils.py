@@ -1,17 +1,133 @@
 from time import sleep
 from selenium import webdriver
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions
-from selenium.webdriver.common.by import By
-from selenium.common.exceptions import NoSuchElementException,\
-    TimeoutException
+from selenium.common.exceptions import TimeoutException
 from pymongo import MongoClient
-from validator_collection import checkers
+from pymongo.errors import OperationFailure
+from bs4 import BeautifulSoup, SoupStrainer
+from classes.RateScheduler import RateScheduler
+from classes.ReplayDriver import ReplayDriver
+from classes.SessionRecorder import SessionRecorder
+from urllib.parse import urlsplit, parse_qs, quote, unquote
 import json
 import os
+import re
 import errno
 import unicodedata
+import threading
+
+
+PARSERS = ("html.parser", "lxml", "strained")
+EXTRACTION_MODES = ("soup", "in_page", "compare")
+TRANSFER_LOCK = threading.Lock()
+# links and displayed URLs of the results of a Google results page,
+# with the link to the next page
+GOOGLE_RESULTS_SCRIPT = """
+var results = [];
+document.querySelectorAll('.iUh30').forEach(function (cite) {
+    var link = cite.closest('a');
+    results.push([link ? link.href : null, cite.textContent]);
+});
+var next = document.querySelector('#pnnext');
+return {results: results, next: next ? next.href : null};
+"""
+# canonical URL of each kind of page, from its ID; the job URLs keep the
+# form they have always been stored with
+CANONICAL_URL_FORMATS = {"profile": "https://www.linkedin.com/in/{}",
+                         "job": "http://www.linkedin.com/jobs/view/{}"}
+# separator of the path segments of the URLs displayed by Google
+DISPLAY_URL_SEPARATOR = "\u203a"
+JOB_ID_PATTERN = re.compile(r"(?:^|-)(\d+)$")
+JOB_SEARCH_CLASSES = ["job-card-search__link-wrapper",
+                      "t-12 t-black--light t-normal"]
+# URL patterns, as matched by Network.setBlockedURLs, of the kinds of
+# resources a launch profile can block; LinkedIn serves its images and
+# videos from URLs without an extension
+BLOCKED_RESOURCES = {
+    "images": ["*.png*", "*.jpg*", "*.jpeg*", "*.gif*", "*.webp*",
+               "*.svg*", "*.ico*", "*licdn.com/dms/image/*"],
+    "media": ["*.mp4*", "*.webm*", "*.m3u8*", "*.mp3*",
+              "*licdn.com/playlist/*"],
+    "fonts": ["*.woff*", "*.ttf*", "*.otf*", "*.eot*"]
+}
+THIRD_PARTY_HOSTS = ["doubleclick.net", "google-analytics.com",
+                     "googletagmanager.com", "googlesyndication.com",
+                     "facebook.net", "ads.linkedin.com", "bat.bing.com",
+                     "scorecardresearch.com", "demdex.net", "omtrdc.net"]
+# settings of the Chrome drivers started by init_driver():
+#   HEADLESS: bool run without a window
+#   BLOCK: list of kinds of BLOCKED_RESOURCES not downloaded
+#   BLOCK_HOSTS: list of hosts, with their subdomains, not contacted
+#   BLOCK_PATTERNS: list of other URL patterns not downloaded
+#   PAGE_LOAD_STRATEGY: "normal" waits for every resource of a page,
+#       "eager" only for its DOM
+#   WINDOW_SIZE: [width, height] in pixels, maximised if None
+#   DISK_CACHE_MB: int size of the disk cache, Chrome's default if None
+LAUNCH_PROFILES = {
+    "full": {"HEADLESS": False, "BLOCK": [], "BLOCK_HOSTS": [],
+             "BLOCK_PATTERNS": [], "PAGE_LOAD_STRATEGY": "normal",
+             "WINDOW_SIZE": None, "DISK_CACHE_MB": None},
+    "light": {"HEADLESS": True, "BLOCK": ["images", "media", "fonts"],
+              "BLOCK_HOSTS": THIRD_PARTY_HOSTS, "BLOCK_PATTERNS": [],
+              "PAGE_LOAD_STRATEGY": "eager", "WINDOW_SIZE": [1280, 900],
+              "DISK_CACHE_MB": 200}
+}
+SKILLS_BUTTON_XPATH = ("//button[@class=" +
+                       "'pv-profile-section__card-action-bar " +
+                       "pv-skills-section__additional-skills " +
+                       "artdeco-container-card-action-bar']")
+# arguments: container CSS selector, stop XPath, click the stop element,
+# step pause, quiet period and timeout in ms, callback
+SCROLL_UNTIL_STABLE_SCRIPT = """
+var container = arguments[0], stopXPath = arguments[1],
+    clickStop = arguments[2], stepPause = arguments[3],
+    quiet = arguments[4], timeout = arguments[5],
+    done = arguments[arguments.length - 1];
+var target = container ? document.querySelector(container) : null;
+var start = Date.now(), steps = 0, lastHeight = -1, lastChange = start;
+function height() {
+    return target ? target.scrollHeight : document.body.scrollHeight;
+}
+function atBottom() {
+    if (target) {
+        return target.scrollTop + target.clientHeight >=
+            target.scrollHeight - 2;
+    }
+    return window.innerHeight + window.pageYOffset >=
+        document.body.scrollHeight - 2;
+}
+function stopElement() {
+    if (!stopXPath) { return null; }
+    return document.evaluate(stopXPath, document, null,
+        XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+}
+function finish(found) {
+    done({height: height(), steps: steps,
+          elapsed: (Date.now() - start) / 1000, found: found});
+}
+function step() {
+    var now = Date.now(), stop = stopElement(), current = height();
+    if (stop) {
+        if (clickStop) { stop.click(); }
+        return finish(true);
+    }
+    if (current !== lastHeight) {
+        lastHeight = current;
+        lastChange = now;
+    } else if (atBottom() && now - lastChange >= quiet) {
+        return finish(false);
+    }
+    if (now - start >= timeout) { return finish(false); }
+    if (target) {
+        target.scrollTop += target.clientHeight;
+    } else {
+        window.scrollBy(0, window.innerHeight);
+    }
+    steps += 1;
+    setTimeout(step, stepPause);
+}
+if (container && !target) { return done(null); }
+step();
+"""
 
 
 def load_config(path):
@@ -87,21 +203,149 @@ def validate_user_data(user_data):
         return {}
 
 
-def init_driver(chrome_path, chromedriver_path):
+def make_soup(page_source, parser="html.parser", only_classes=None):
     """
-    Iniitialize Chrome driver
+    Parse the HTML code of a page with the given parser backend.
+    The backend can be either "html.parser", the pure-Python parser,
+    "lxml", or "strained", which parses with lxml only the subtrees
+    rooted at the tags having one of the given HTML classes,
+    and discards the rest of the page.
+
+    :param page_source: str HTML code of the page
+    :param parser: str parser backend, one of PARSERS
+    :param only_classes: list of str HTML classes to keep
+        when the parser is "strained"
+    :return: BeautifulSoup object
+    """
+    if parser not in PARSERS:
+        raise ValueError("Unknown parser: " + str(parser) +
+                         ". Choose one of " + ", ".join(PARSERS))
+    if parser == "strained":
+        if not only_classes:
+            raise ValueError("The strained parser needs the HTML classes " +
+                             "of the subtrees to keep")
+        wanted = set(only_classes)
+
+        def has_wanted_class(value):
+            # the value is either a single class or the whole
+            # attribute string, depending on the bs4 version
+            if not value:
+                return False
+            return value in wanted or not wanted.isdisjoint(value.split())
+        strainer = SoupStrainer(class_=has_wanted_class)
+        return BeautifulSoup(page_source, "lxml", parse_only=strainer)
+    return BeautifulSoup(page_source, parser)
+
+
+def launch_profile(name="full", overrides=None):
+    """
+    Get the settings of a launch profile of LAUNCH_PROFILES,
+    updated with the given ones.
+
+    :param name: str name of the launch profile
+    :param overrides: dict setting -> value
+    :return: dict settings
+    """
+    if name not in LAUNCH_PROFILES:
+        raise ValueError("Unknown launch profile " + repr(name) +
+                         ", expected one of " +
+                         ", ".join(sorted(LAUNCH_PROFILES)))
+    profile = dict(LAUNCH_PROFILES[name])
+    profile.update(overrides or {})
+    return profile
+
+
+def blocked_url_patterns(profile):
+    """
+    Get the URL patterns blocked by a launch profile.
+
+    :param profile: dict settings of a launch profile
+    :return: list of str URL patterns
+    """
+    patterns = []
+    for kind in profile.get("BLOCK", []):
+        patterns.extend(BLOCKED_RESOURCES[kind])
+    for host in profile.get("BLOCK_HOSTS", []):
+        patterns.extend(["*://" + host + "/*", "*://" + host + ":*",
+                         "*." + host + "/*"])
+    patterns.extend(profile.get("BLOCK_PATTERNS", []))
+    return patterns
+
+
+def init_driver(chrome_path, chromedriver_path, profile=None):
+    """
+    Iniitialize Chrome driver with the settings of a launch profile.
+    Images are blocked in every tab through the content settings,
+    the other URL patterns through the DevTools protocol, which only
+    applies to the first tab.
     :param chrome_path: str chrome executable path
     :param chromedriver_path: str chrome driver path
+    :param profile: dict settings of a launch profile,
+        the "full" one if not given
     :return: selenium driver object
     """
+    if profile is None:
+        profile = launch_profile()
     chrome_options = webdriver.ChromeOptions()
     chrome_options.binary_location = chrome_path
-    chrome_options.add_argument("--normal")
-    chrome_options.add_argument("--start-maximized")
+    if profile["HEADLESS"]:
+        chrome_options.add_argument("--headless")
+        chrome_options.add_argument("--disable-gpu")
+    else:
+        chrome_options.add_argument("--normal")
+    if profile["WINDOW_SIZE"]:
+        chrome_options.add_argument(
+            "--window-size={},{}".format(*profile["WINDOW_SIZE"]))
+    else:
+        chrome_options.add_argument("--start-maximized")
     chrome_options.add_argument("--disable-extensions")
     chrome_options.add_argument("--disable-infobars")
+    if profile["DISK_CACHE_MB"] is not None:
+        chrome_options.add_argument(
+            "--disk-cache-size=" +
+            str(int(profile["DISK_CACHE_MB"] * 1024 * 1024)))
+    if "images" in profile["BLOCK"]:
+        chrome_options.add_experimental_option(
+            "prefs", {"profile.managed_default_content_settings.images": 2})
+    capabilities = chrome_options.to_capabilities()
+    capabilities["pageLoadStrategy"] = profile["PAGE_LOAD_STRATEGY"]
     driver = webdriver.Chrome(executable_path=chromedriver_path,
-                              chrome_options=chrome_options)
+                              desired_capabilities=capabilities)
+    patterns = blocked_url_patterns(profile)
+    if patterns:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+    return driver
+
+
+def open_driver(chrome_path, chromedriver_path, record=None, replay=None,
+                latency=0., name=None, profile=None):
+    """
+    Get the driver of a run: a ReplayDriver serving the session
+    recorded in the "replay" directory if given, otherwise a new Chrome
+    driver, wrapped by a SessionRecorder saving the session to the
+    "record" directory if given.
+
+    :param chrome_path: str chrome executable path
+    :param chromedriver_path: str chrome driver path
+    :param record: str path of the directory to record the session to
+    :param replay: str path of the directory of the session to replay
+    :param latency: float seconds simulated by each get() of a replay
+    :param name: str name of the driver, used as the subdirectory of
+        "record" its session is saved to when a run has many drivers
+    :param profile: dict settings of the launch profile of Chrome,
+        the "full" one if not given
+    :return: driver object
+    """
+    if replay:
+        print("INFO :: Replaying the session recorded in", replay)
+        return ReplayDriver(replay, latency)
+    driver = init_driver(chrome_path, chromedriver_path, profile)
+    if record:
+        if name:
+            record = os.path.join(record, name)
+        print("INFO :: Recording the session to", record)
+        driver = SessionRecorder(driver, record)
     return driver
 
 
@@ -113,39 +357,187 @@ def get_job_urls(soup):
     :param soup: BeautifulSoup instance
     :return: list of linkedin-job URLs
     """
-    base_url = "http://www.linkedin.com"
-    job_urls = [base_url + url['href'].split('/?')[0]
+    job_urls = [canonical_job_url(url['href'])
                 for url in soup.find_all(
                     class_="job-card-search__link-wrapper",
                     href=True)]
-    return list(dict.fromkeys(job_urls))
+    return list(dict.fromkeys(url for url in job_urls if url is not None))
+
+
+def get_n_results(soup):
+    """
+    Return the number of results of a query on LinkedIn,
+    0 if it cannot be found in the page.
+
+    :param soup: BeautifulSoup instance
+    :return: int number of job offers found
+    """
+    n_results_element = soup.find(class_="t-12 t-black--light t-normal")
+    if n_results_element is None:
+        return 0
+    n_results_string = n_results_element.get_text().split()
+    if not n_results_string:
+        return 0
+    digits = "".join(c for c in n_results_string[0] if c.isdigit())
+    return int(digits) if digits else 0
+
+
+def canonical_id(url):
+    """
+    Get the kind and the stable ID of the LinkedIn page a URL points to,
+    whatever its form: with a country subdomain, a trailing slash, a
+    query or a fragment, percent-encoded or not, relative to
+    linkedin.com, or displayed by Google as "it.linkedin.com › in › name".
+    The ID of a profile is its lowercase name, the one of a job offer
+    its number, read from /jobs/view/<title>-<number> or from the
+    currentJobId parameter of a search.
+    A displayed URL Google has truncated has no ID.
+
+    :param url: str URL
+    :return: tuple (str kind "profile" or "job", str ID),
+        None if the URL is not the one of a profile or a job offer
+    """
+    url = url.strip()
+    if DISPLAY_URL_SEPARATOR in url:
+        url = "/".join(part.strip()
+                       for part in url.split(DISPLAY_URL_SEPARATOR))
+    if url.startswith("/"):
+        url = "https://www.linkedin.com" + url
+    elif "://" not in url:
+        url = "https://" + url
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme not in ("http", "https") or\
+       not (host == "linkedin.com" or host.endswith(".linkedin.com")):
+        return None
+    segments = [unquote(segment) for segment in parts.path.split("/")
+                if segment]
+    if len(segments) >= 2 and segments[0] == "in":
+        name = segments[1].lower()
+        if name.endswith(("...", "\u2026")):
+            return None
+        return "profile", name
+    if len(segments) >= 3 and segments[:2] == ["jobs", "view"]:
+        match = JOB_ID_PATTERN.search(segments[2])
+        return ("job", match.group(1)) if match else None
+    if segments[:1] == ["jobs"]:
+        job_ids = parse_qs(parts.query).get("currentJobId", [])
+        if job_ids and job_ids[0].isdigit():
+            return "job", job_ids[0]
+    return None
+
+
+def canonical_url(kind, page_id):
+    """
+    Get the canonical URL of a LinkedIn page from its ID.
+
+    :param kind: str kind of page, "profile" or "job"
+    :param page_id: str ID returned by canonical_id
+    :return: str canonical URL
+    """
+    return CANONICAL_URL_FORMATS[kind].format(quote(page_id))
 
 
-def get_profile_urls(driver, n_pages=1):
+def _canonical_url_of_kind(url, kind):
+    key = canonical_id(url)
+    if key is None or key[0] != kind:
+        return None
+    return canonical_url(*key)
+
+
+def canonical_profile_url(url):
+    """
+    Get the canonical form of the URL of a LinkedIn profile, i.e.
+    https://www.linkedin.com/in/<name> with a lowercase name and
+    without country subdomain, subpage, query, fragment or
+    trailing slash.
+
+    :param url: str URL, or URL displayed by Google
+    :return: str canonical URL, None if not the URL of a profile
+    """
+    return _canonical_url_of_kind(url, "profile")
+
+
+def canonical_job_url(url):
+    """
+    Get the canonical form of the URL of a LinkedIn job offer, i.e.
+    http://www.linkedin.com/jobs/view/<number>.
+
+    :param url: str URL, possibly relative to linkedin.com
+    :return: str canonical URL, None if not the URL of a job offer
+    """
+    return _canonical_url_of_kind(url, "job")
+
+
+def read_profile_results(driver):
+    """
+    Read the LinkedIn profile URLs of a Google results page and the URL
+    of the next results page in a single script call.
+    The link of each result is read, or its displayed URL if it has
+    none, then canonicalised; the results that are not the URL of a
+    profile are left out.
+
+    :param driver: selenium chrome driver object
+    :return: tuple (list of canonical URLs without repetitions,
+        in the order of the results, str URL of the next page or None)
+    """
+    page = driver.execute_script(GOOGLE_RESULTS_SCRIPT) or {}
+    urls = []
+    for href, text in page.get("results", []):
+        url = canonical_profile_url(href or "")
+        if url is None and text:
+            url = canonical_profile_url(text)
+        if url is not None:
+            urls.append(url)
+    return list(dict.fromkeys(urls)), page.get("next")
+
+
+def iter_profile_urls(driver, n_pages=1, scheduler=None):
+    """
+    Yield, for each of the first n_pages results pages of a query on
+    Google search, the profile URLs it adds to the previous pages,
+    as soon as the page has been read, so that they can be scraped
+    while the next pages load, with the URL of the next page so that
+    a discovery can be resumed from it. The next results pages are
+    loaded once allowed by the scheduler.
+
+    :param driver: selenium chrome driver object on the first page
+    :param n_pages: int number of google pages to loop over
+    :param scheduler: RateScheduler object pacing the navigations,
+        one with the default rates if not given
+    :return: generator of tuples (list of canonical profile URLs,
+        str URL of the next page or None)
+    """
+    if scheduler is None:
+        scheduler = RateScheduler()
+    seen = set()
+    for i in range(n_pages):
+        urls, next_page_url = read_profile_results(driver)
+        new_urls = [url for url in urls if url not in seen]
+        seen.update(new_urls)
+        yield new_urls, next_page_url
+        if i == n_pages - 1 or next_page_url is None:
+            break
+        try:
+            scheduler.navigate(driver, next_page_url)
+        except TimeoutException:
+            break
+
+
+def get_profile_urls(driver, n_pages=1, scheduler=None):
     """
     Return a list without repetitions of alphabetically sorted URLs
     taken from the results of a given query on Google search.
 
     :param driver: selenium chrome driver object
     :param n_pages: int number of google pages to loop over
+    :param scheduler: RateScheduler object pacing the navigations,
+        one with the default rates if not given
     :return: list of linkedin-profile URLs
     """
-    linkedin_urls = []
-    for i in range(n_pages):
-        urls = driver.find_elements_by_class_name('iUh30')
-        linkedin_urls += [url.text for url in urls
-                          if checkers.is_url(url.text)]
-        sleep(0.5)
-        if i > 1:
-            try:
-                next_button_url = driver.find_element_by_css_selector(
-                    '#pnnext').get_attribute('href')
-                driver.get(next_button_url)
-            except NoSuchElementException:
-                break
-    linkedin_urls_no_rep = sorted(
-        list(dict.fromkeys([url for url in linkedin_urls])))
-    return linkedin_urls_no_rep
+    return sorted(url for urls, _ in iter_profile_urls(driver, n_pages,
+                                                        scheduler)
+                  for url in urls)
 
 
 def login(driver, user, pwd):
@@ -168,79 +560,79 @@ def login(driver, user, pwd):
     sign_in_button.click()
 
 
-def scroll_job_panel(driver):
+def scroll_until_stable(driver, container=None, stop_xpath=None,
+                        click_stop=False, step_pause=0.2, quiet=0.5,
+                        timeout=30):
     """
-    Scroll the left panel containing the job offers by sending PAGE_DOWN
-    key until the very end has been reached
+    Scroll the page, or the element matching the container CSS selector,
+    one screen at a time until its scroll height has not changed for the
+    quiet period after reaching the bottom, until an element matching
+    stop_xpath is in the page, or until the timeout.
+    The whole loop runs inside the page as a single asynchronous script,
+    i.e. in one WebDriver round trip.
+    Return a dictionary with the final scroll "height", the number of
+    "steps", the "elapsed" seconds, and whether the stop element has
+    been "found" (and clicked, if click_stop is True).
 
     :param driver: selenium chrome driver object
-    :return: None
+    :param container: str CSS selector of the element to scroll,
+        the whole page if None
+    :param stop_xpath: str XPath of the element to stop at
+    :param click_stop: bool click the stop element once found
+    :param step_pause: float seconds to wait after each step
+    :param quiet: float seconds the height must be stable at the bottom
+    :param timeout: float seconds after which the loop stops anyway
+    :return: dict
     """
-    panel = driver.find_element_by_class_name("jobs-search-results")
-    last_height = driver.execute_script(
-        "return document.getElementsByClassName(" +
-        "'jobs-search-results')[0].scrollHeight")
-    while True:
-        panel.send_keys(Keys.PAGE_DOWN)
-        sleep(0.2)
-        new_height = driver.execute_script(
-            "return document.getElementsByClassName(" +
-            "'jobs-search-results')[0].scrollHeight")
-        if new_height == last_height:
-            break
-        else:
-            last_height = new_height
-    javascript = (
-        "var x = document.getElementsByClassName(" +
-        "'jobs-search-results')[0]; x.scrollTo(0, x.scrollHeight)"
-    )
-    driver.execute_script(javascript)
+    driver.set_script_timeout(timeout + 10)
+    result = driver.execute_async_script(
+        SCROLL_UNTIL_STABLE_SCRIPT, container, stop_xpath, click_stop,
+        int(1000 * step_pause), int(1000 * quiet), int(1000 * timeout))
+    if not result:
+        result = {"height": None, "steps": 0, "elapsed": 0.,
+                  "found": False}
+    return result
 
 
-def scroll_profile_page(driver):
+def scroll_job_panel(driver, waiter=None):
     """
-    Scroll a profile page by sending the keys PAGE_DOWN
-    until the end of the page has been reached.
+    Scroll the left panel containing the job offers until the very end
+    has been reached, by calling scroll_until_stable().
+    If a waiter is given, take the timeout from its "scroll_panel"
+    deadline and record the time spent scrolling.
 
     :param driver: selenium chrome driver object
-    :return:
+    :param waiter: Waiter object
+    :return: dict returned by scroll_until_stable()
     """
-    body = driver.find_element_by_tag_name("body")
-    last_height = driver.execute_script(
-        "return document.body.scrollHeight")
-    while True:
-        body.send_keys(Keys.PAGE_DOWN)
-        sleep(3)
-        new_height = driver.execute_script(
-            "return document.body.scrollHeight")
-        if new_height == last_height:
-            break
-        else:
-            last_height = new_height
+    timeout = waiter.deadline("scroll_panel") if waiter else 30
+    quiet = waiter.quiet_period if waiter else 0.5
+    result = scroll_until_stable(driver, ".jobs-search-results",
+                                 quiet=quiet, timeout=timeout)
+    if waiter is not None:
+        waiter.record("scroll_panel", result["elapsed"],
+                      result["elapsed"] >= timeout)
+    return result
 
 
-def is_button_found(driver, delay):
+def scroll_profile_page(driver, waiter=None):
     """
-    Try to find the "show more" button in the "skills" section.
-    Return a boolean and the button element.
+    Scroll a profile page until the end of the page has been reached,
+    by calling scroll_until_stable().
+    If a waiter is given, take the timeout from its "scroll_page"
+    deadline and record the time spent scrolling.
 
     :param driver: selenium chrome driver object
-    :param delay: float delay in seconds
-    :return:
+    :param waiter: Waiter object
+    :return: dict returned by scroll_until_stable()
     """
-    button_found = False
-    button_element = None
-    try:
-        condition_is_met = expected_conditions.presence_of_element_located(
-                (By.XPATH, "//button[@class=" +
-                 "'pv-profile-section__card-action-bar " +
-                 "pv-skills-section__additional-skills " +
-                 "artdeco-container-card-action-bar']"))
-        button_element = WebDriverWait(driver, delay).until(condition_is_met)
-        button_found = True
-    except TimeoutException:
-        pass
-    return button_found, button_element
+    timeout = waiter.deadline("scroll_page") if waiter else 60
+    quiet = waiter.quiet_period if waiter else 0.5
+    result = scroll_until_stable(driver, quiet=quiet, timeout=timeout)
+    if waiter is not None:
+        waiter.record("scroll_page", result["elapsed"],
+                      result["elapsed"] >= timeout)
+    return result
 
 
 def print_scraped_data(data):
@@ -253,21 +645,107 @@ def print_scraped_data(data):
         print(key + ": " + str(data[key]))
 
 
-def get_unseen_urls(collection, urls):
+def record_transfer(stats, mode, n_bytes, seconds, pages=1):
     """
-    Get a list of URLs that have not already been scraped.
-    Loop over all the db entries and create a list with the
-    URLs already scraped.
-    Get the difference of such list and the list of all the URLs
-    for a given query.
-    Return a list of URLs which have not already been scraped.
+    Add a page to the statistics of an extraction mode:
+    number of pages, bytes received from the browser and seconds spent.
+
+    :param stats: dict mode -> dict statistics, updated in place
+    :param mode: str extraction mode, "soup" or "in_page"
+    :param n_bytes: int bytes received from the browser
+    :param seconds: float seconds spent getting and extracting the data
+    :param pages: int number of pages, 0 to add the bytes and seconds
+        of an extra transfer to a page already recorded
+    :return: None
+    """
+    with TRANSFER_LOCK:
+        mode_stats = stats.setdefault(mode, {"pages": 0, "bytes": 0,
+                                             "seconds": 0.})
+        mode_stats["pages"] += pages
+        mode_stats["bytes"] += n_bytes
+        mode_stats["seconds"] += seconds
+
+
+def merge_transfer_stats(stats, other):
+    """
+    Add the statistics of other to stats, e.g. to sum up
+    the statistics of many drivers.
+
+    :param stats: dict mode -> dict statistics, updated in place
+    :param other: dict mode -> dict statistics
+    :return: None
+    """
+    with TRANSFER_LOCK:
+        for mode, mode_stats in other.items():
+            target = stats.setdefault(mode, {"pages": 0, "bytes": 0,
+                                             "seconds": 0.})
+            for key in target:
+                target[key] += mode_stats[key]
+
+
+def print_transfer_stats(stats):
+    """
+    Print the mean bytes received and time spent per page
+    for each extraction mode, "http" being the pages fetched
+    by a PageFetcher.
+
+    :param stats: dict mode -> dict statistics
+    :return: None
+    """
+    print("INFO :: Data received per extraction mode")
+    print("{:<8} {:>7} {:>12} {:>10}".format(
+        "mode", "pages", "KiB/page", "ms/page"))
+    for mode in sorted(stats):
+        mode_stats = stats[mode]
+        pages = mode_stats["pages"]
+        print("{:<8} {:>7} {:>12.1f} {:>10.1f}".format(
+            mode, pages, mode_stats["bytes"] / 1024. / pages,
+            1000. * mode_stats["seconds"] / pages))
+
+
+def ensure_url_index(collection):
+    """
+    Create the unique index on the "URL" field of the collection,
+    if it does not exist yet.
+    If the collection already holds duplicated URLs, the unique index
+    cannot be built: create a non-unique one instead and warn.
 
     :param collection: Mongo DB collection
-    :param urls: lsit of URLs to check
+    :return: str name of the index
+    """
+    try:
+        return collection.create_index("URL", unique=True,
+                                       name="URL_unique")
+    except OperationFailure as e:
+        print("WARNING :: Could not create a unique index on URL for " +
+              "the collection " + collection.name + ": " + str(e) +
+              "\nRemove the duplicated URLs to enforce uniqueness. " +
+              "Creating a non-unique index instead.")
+        return collection.create_index("URL", name="URL")
+
+
+def get_unseen_urls(storage, urls, seen_index=None):
+    """
+    Get a list of URLs that have not already been scraped.
+    Check the seen index first, if any, which also drops the URLs
+    pointing to the same page as a URL before them, then ask the
+    storage backend for the URLs left only and keep the URLs that
+    have not been found, recording the ones found in the index.
+    Return a list of URLs which have not already been scraped,
+    in the order they have been given.
+
+    :param storage: Storage object
+    :param urls: list of URLs to check
+    :param seen_index: SeenIndex object, None to ask the storage only
     :return: list of unseen URLs
     """
-    scraped_urls = [entry["URL"] for entry in collection.find()]
-    unseen_urls = list(set(urls) - set(scraped_urls))
+    urls = list(dict.fromkeys(urls))
+    if seen_index is not None:
+        urls = seen_index.get_unseen_urls(urls)
+    scraped_urls = storage.get_seen_urls(urls)
+    if seen_index is not None and scraped_urls:
+        seen_index.add(scraped_urls)
+    unseen_urls = [url for url in urls if url not in scraped_urls]
     return unseen_urls
 
 